@@ -3,37 +3,135 @@ from tkinter import simpledialog, messagebox, filedialog
 from tkinter import ttk
 import serial
 import serial.tools.list_ports
-import subprocess
 import os
 import threading
 import sys
 import time
+import concurrent.futures
 import re  # Import regular expressions module
+import queue
+import arduino_backend
+import build_matrix
+import device_inventory
+import flash_scheduler
+import esp_flasher
+import job_runner
+import serial_decoders
+import serial_plot
+import hex_view
+import link_benchmark
+import udev_helper
+import crash_decoder
+import compile_ahead
+import ui_watchdog
+import ui_tasks
+import serial_broker
+import remote_ports
+import capture_file
+import sysfs_ports
+import nvs_partition
+import tracing
+import send_expect
 
 # Paths to the tools
 ARDUINO_CLI_PATH = "arduino-cli"  # Ensure arduino-cli is in your system's PATH
-ESPTOOL_PY_PATH = "esptool.py"    # Ensure esptool.py is in your system's PATH
 
-UDEV_RULE_PATH = '/etc/udev/rules.d/99-esp32.rules'  # Path to udev rules file
+# Board passed to arduino-cli for compile and upload
+BOARD_FQBN = "esp32:esp32:esp32doit-devkit-v1"
+BOARD_OPTIONS = "UploadSpeed=115200"
 
-# Global variables for serial monitor
-serial_port = None
-monitor_running = False
+UDEV_RULE_PATH = udev_helper.UDEV_RULE_PATH  # Path to udev rules file
+
+# Seconds before a job is killed; a board stuck in "Connecting......" no longer blocks the station
+COMPILE_TIMEOUT = 900
+UPLOAD_TIMEOUT = 180
+FLASH_TIMEOUT = 300
+
+# Where the uploader compiles sketches, so the ELF of the last build is at a known path
+BUILD_ROOT = os.path.expanduser("~/.dognosis/build")
+# Library folders watched by compile-ahead along with the sketch's own folder
+LIBRARY_DIRS = [os.path.expanduser("~/Arduino/libraries")]
+
+UI_POLL_MS = 50  # How often the Tk thread drains updates queued by background jobs
+
+RECORD_DISPLAY_INTERVAL = 0.2    # Seconds between record summaries in the console
+MONITOR_TCP_PORT = 0             # Port the console shares the monitor on over localhost TCP (0 = any free port)
+
+# Global variables for serial monitor; the port itself is owned by its serial_broker.PortBroker
+monitor_port = None
+monitor_subscription = None
+monitor_logger = None
+monitor_tcp = None
+monitor_recorder = None
+replay_cancel = None  # Set to stop a capture replay feeding the monitor
 console_window = None
 console_text = None  # Declare console_text at the global scope
 
+# Decoder the serial monitor feeds received bytes through; plain text lines by default
+monitor_decoder = serial_decoders.DecoderPipeline("newline")
+last_record_display = 0
+
+# Decodes crash backtraces in the monitor against the ELF of the last compile or manifest upload
+monitor_crash_decoder = None
+
+# Plot pane in the console window, fed with numeric channels from the monitor
+plot_pane = None
+
+# Raw bytes received by the monitor, kept for the hex view
+raw_capture = hex_view.ByteRing()
+hex_pane = None
+
+# Background compiler watching the selected sketch, when compile-ahead is switched on
+compile_watcher = None
+
+# Future of the running compile/upload job, used by the cancel button
+active_job = None
+
+# Callbacks queued by background threads for the Tk thread to run
+ui_queue = queue.Queue()
+
+# Function to run a callback on the Tk thread; Tk widgets must not be touched from other threads
+def call_in_ui(func, *args, **kwargs):
+    if threading.current_thread() is threading.main_thread():
+        return func(*args, **kwargs)
+    ui_queue.put((func, args, kwargs))
+
+# Function to run the callbacks queued by background threads
+def process_ui_queue():
+    while True:
+        try:
+            func, args, kwargs = ui_queue.get_nowait()
+        except queue.Empty:
+            break
+        func(*args, **kwargs)
+    root.after(UI_POLL_MS, process_ui_queue)
+
+# Function to show an info box from any thread
+def show_info(title, message):
+    call_in_ui(messagebox.showinfo, title, message)
+
+# Function to show an error box from any thread
+def show_error(title, message):
+    call_in_ui(messagebox.showerror, title, message)
+
 # Function to update the progress bar
 def update_progress(value):
+    if threading.current_thread() is not threading.main_thread():
+        return call_in_ui(update_progress, value)
     progress_bar['value'] = value
     root.update_idletasks()
 
 # Function to update the status label in the main GUI
 def update_status_label(message):
+    if threading.current_thread() is not threading.main_thread():
+        return call_in_ui(update_status_label, message)
     status_label.config(text=message)
     root.update_idletasks()
 
 # Function to update the console window logs
 def update_console(message):
+    if threading.current_thread() is not threading.main_thread():
+        return call_in_ui(update_console, message)
     if console_window and console_text:
         console_text.configure(state=tk.NORMAL)
         console_text.insert(tk.END, message + '\n')
@@ -41,15 +139,18 @@ def update_console(message):
         console_text.see(tk.END)
 
 # Function to list all available serial ports and check if they have symbolic names and serial numbers
+# Ports of the RFC2217 stations in ~/.dognosis/stations.json are listed by their rfc2217:// URL
 def get_serial_ports():
-    ports = list(serial.tools.list_ports.comports())
+    with tracing.span("port scan", "ports") as attributes:
+        ports = sysfs_ports.comports() + remote_ports.comports()
+        attributes["ports"] = len(ports)
     available_ports = []
     
     for port in ports:
         serial_number = port.serial_number if port.serial_number else "N/A"
         # Only add ports with valid devices and serial numbers
         if serial_number != "N/A" and port.device:
-            symbolic_name = get_symbolic_name_by_serial(serial_number)
+            symbolic_name = symbolic_name_for_port(port.device, serial_number)
             display_name = port.device
             if symbolic_name:
                 display_name = f"/dev/{symbolic_name} ({port.device})"
@@ -59,18 +160,19 @@ def get_serial_ports():
 
 # Function to get symbolic name of a port by serial number from the udev rules
 def get_symbolic_name_by_serial(serial_number):
-    if os.path.exists(UDEV_RULE_PATH):
-        with open(UDEV_RULE_PATH, 'r') as f:
-            rules = f.readlines()
-        
-        # Loop through all the udev rules
-        for rule in rules:
-            # Check if the serial number is in the rule and the rule contains SYMLINK
-            if serial_number in rule and 'SYMLINK+=' in rule:
-                # Extract the symbolic name between the quotes after SYMLINK+=
-                symbolic_name = rule.split('SYMLINK+="')[1].split('"')[0]
-                return symbolic_name
-    return None
+    return udev_helper.symbolic_name_by_serial(serial_number, UDEV_RULE_PATH)
+
+# Function to get the local udev name of a port; a station's ports never have one (see udev_helper)
+def symbolic_name_for_port(port_device, serial_number):
+    return udev_helper.symbolic_name_for_port(port_device, serial_number, UDEV_RULE_PATH)
+
+# Function to refuse udev edits for a station's port, whose rules live on the station (runs on the Tk thread)
+def refuse_remote_port(selected_port):
+    port_device = selected_port.split(" - ")[0].split(" ")[0]
+    if remote_ports.is_remote(port_device):
+        messagebox.showerror("Error", f"{port_device} is on a remote station. Manage its symbolic name on the station itself.")
+        return True
+    return False
 
 # Function to onboard a selected port with a custom symbolic name
 def onboard_port():
@@ -78,20 +180,81 @@ def onboard_port():
     if not selected_port:
         messagebox.showerror("Error", "Please select a port.")
         return
+    if refuse_remote_port(selected_port):
+        return
     port_device = selected_port.split(" - ")[0].split(" ")[0]
     serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
     custom_name = simpledialog.askstring("Onboard Port", f"Enter the custom name for the port with serial {serial_number}:")
     
     if serial_number and custom_name:
-        rule = f'SUBSYSTEM=="tty", ATTRS{{serial}}=="{serial_number}", SYMLINK+="{custom_name}"\n'
-        
-        # Append the new rule to the file
-        with open(UDEV_RULE_PATH, 'a') as f:
-            f.write(rule)
-        
-        reload_udev_rules()
-        messagebox.showinfo("Success", f"Port with serial {serial_number} onboarded with name: {custom_name}")
-        refresh_ports()
+        def task():
+            udev_helper.apply_changes([{"op": "add", "serial": serial_number, "name": custom_name}])
+            device_inventory.set_symbolic_name(serial_number, custom_name)
+            return device_inventory.latest_link_benchmark(serial_number)
+
+        def done(benchmark):
+            messagebox.showinfo("Success", f"Port with serial {serial_number} onboarded with name: {custom_name}")
+            check_link_benchmark(serial_number, benchmark)
+            refresh_ports()
+
+        port_tasks.run("onboard", task, on_done=done, on_error=show_udev_error, button=onboard_button, busy_text="Onboarding...")
+
+# Function to flag a slow or unreliable link from the last benchmark stored for a serial number
+def check_link_benchmark(serial_number, results):
+    if not results:
+        messagebox.showwarning(
+            "Link Not Benchmarked",
+            f"No link benchmark on record for serial {serial_number}. "
+            "Run 'Benchmark Selected Port' with the loopback firmware before putting it in service."
+        )
+        return
+    problems = link_benchmark.assess(results)
+    if problems:
+        messagebox.showwarning("Slow Link", f"The link to serial {serial_number} failed its last benchmark:\n" + "\n".join(problems))
+
+# Function to benchmark the selected port's link; the device must be running the loopback firmware
+def benchmark_selected_port():
+    selected_port = dropdown.get()
+    if not selected_port or "Serial: " not in selected_port:
+        messagebox.showerror("Error", "Please select a port.")
+        return
+    port_device = selected_port.split(" - ")[0].split(" ")[0]
+    serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
+    if not messagebox.askyesno(
+        "Benchmark Link",
+        f"Benchmark {port_device}? The device must be running the loopback firmware (or have TX and RX bridged)."
+    ):
+        return
+    total = len(link_benchmark.DEFAULT_BAUDS) * len(link_benchmark.DEFAULT_CHUNK_SIZES)
+    done = []
+
+    def on_result(result):
+        done.append(result)
+        update_console(link_benchmark.format_result(result))
+        update_progress(int(len(done) / total * 100))
+        update_status_label(f"Benchmarking {port_device}: {len(done)}/{total} steps")
+
+    def task():
+        started = time.time()
+        try:
+            with serial_broker.handed_over(port_device):
+                results = link_benchmark.benchmark_port(port_device, on_result=on_result)
+        except (OSError, serial.SerialException) as e:
+            update_status_label("Benchmark failed.")
+            show_error("Benchmark Error", f"Failed to benchmark {port_device}: {e}")
+            return
+        device_inventory.record_link_benchmark(serial_number, started, port_device, results)
+        problems = link_benchmark.assess(results)
+        if problems:
+            update_status_label(f"Slow link on {port_device}.")
+            call_in_ui(messagebox.showwarning, "Slow Link", f"{port_device} (serial {serial_number}):\n" + "\n".join(problems))
+        else:
+            update_status_label(f"Link on {port_device} passed.")
+            show_info("Benchmark Complete", f"The link to {port_device} passed at every baud rate and chunk size.")
+
+    update_console(f"Benchmarking {port_device} (serial {serial_number})...")
+    update_progress(0)
+    threading.Thread(target=task, daemon=True).start()
 
 # Function to replace a port's serial number in an existing symbolic name
 def replace_serial_in_symbolic_name():
@@ -99,35 +262,30 @@ def replace_serial_in_symbolic_name():
     if not selected_port:
         messagebox.showerror("Error", "Please select a port.")
         return
-    serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
-    existing_symbolic_name = get_symbolic_name_by_serial(serial_number)
-    
-    if not existing_symbolic_name:
-        messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+    if refuse_remote_port(selected_port):
         return
-    
-    new_port_serial = simpledialog.askstring("Replace Serial", f"Enter the new port's serial number to map to '{existing_symbolic_name}':")
-    
-    if new_port_serial:
-        replaced = False
-        if os.path.exists(UDEV_RULE_PATH):
-            with open(UDEV_RULE_PATH, 'r') as f:
-                rules = f.readlines()
-            
-            # Replace the old serial number with the new one in the matching rule
-            with open(UDEV_RULE_PATH, 'w') as f:
-                for rule in rules:
-                    if existing_symbolic_name in rule and 'SYMLINK+=' in rule:
-                        rule = rule.split('ATTRS{serial}')[0] + f'ATTRS{{serial}}=="{new_port_serial}", SYMLINK+="{existing_symbolic_name}"\n'
-                        replaced = True
-                    f.write(rule)
+    serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
+
+    def ask(existing_symbolic_name):
+        if not existing_symbolic_name:
+            messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+            return
         
-        if replaced:
-            reload_udev_rules()
-            messagebox.showinfo("Success", f"Symbolic name '{existing_symbolic_name}' now maps to serial {new_port_serial}.")
-            refresh_ports()
-        else:
-            messagebox.showerror("Error", f"Failed to replace the serial for '{existing_symbolic_name}'.")
+        new_port_serial = simpledialog.askstring("Replace Serial", f"Enter the new port's serial number to map to '{existing_symbolic_name}':")
+        
+        if new_port_serial:
+            def task():
+                udev_helper.apply_changes([{"op": "replace_serial", "name": existing_symbolic_name, "serial": new_port_serial}])
+                device_inventory.set_symbolic_name(serial_number, None)
+                device_inventory.set_symbolic_name(new_port_serial, existing_symbolic_name)
+
+            def done(_):
+                messagebox.showinfo("Success", f"Symbolic name '{existing_symbolic_name}' now maps to serial {new_port_serial}.")
+                refresh_ports()
+
+            port_tasks.run("replace", task, on_done=done, on_error=show_udev_error, button=replace_button, busy_text="Replacing...")
+
+    port_tasks.run("replace", get_symbolic_name_by_serial, serial_number, on_done=ask, button=replace_button, busy_text="Replacing...")
 
 # Function to rename a symbolic name for an existing serial number
 def rename_symbolic_name():
@@ -135,35 +293,29 @@ def rename_symbolic_name():
     if not selected_port:
         messagebox.showerror("Error", "Please select a port.")
         return
-    serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
-    existing_symbolic_name = get_symbolic_name_by_serial(serial_number)
-    
-    if not existing_symbolic_name:
-        messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+    if refuse_remote_port(selected_port):
         return
-    
-    new_symbolic_name = simpledialog.askstring("Rename Symbolic Name", f"Enter the new symbolic name for serial {serial_number}:")
-    
-    if new_symbolic_name and existing_symbolic_name:
-        renamed = False
-        if os.path.exists(UDEV_RULE_PATH):
-            with open(UDEV_RULE_PATH, 'r') as f:
-                rules = f.readlines()
-            
-            # Rename the symbolic name in the matching rule
-            with open(UDEV_RULE_PATH, 'w') as f:
-                for rule in rules:
-                    if existing_symbolic_name in rule and 'SYMLINK+=' in rule:
-                        rule = rule.replace(f'SYMLINK+="{existing_symbolic_name}"', f'SYMLINK+="{new_symbolic_name}"')
-                        renamed = True
-                    f.write(rule)
-            
-        if renamed:
-            reload_udev_rules()
-            messagebox.showinfo("Success", f"Symbolic name '{existing_symbolic_name}' renamed to '{new_symbolic_name}'.")
-            refresh_ports()
-        else:
-            messagebox.showerror("Error", f"Failed to rename '{existing_symbolic_name}'.")
+    serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
+
+    def ask(existing_symbolic_name):
+        if not existing_symbolic_name:
+            messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+            return
+        
+        new_symbolic_name = simpledialog.askstring("Rename Symbolic Name", f"Enter the new symbolic name for serial {serial_number}:")
+        
+        if new_symbolic_name:
+            def task():
+                udev_helper.apply_changes([{"op": "rename", "old": existing_symbolic_name, "new": new_symbolic_name}])
+                device_inventory.set_symbolic_name(serial_number, new_symbolic_name)
+
+            def done(_):
+                messagebox.showinfo("Success", f"Symbolic name '{existing_symbolic_name}' renamed to '{new_symbolic_name}'.")
+                refresh_ports()
+
+            port_tasks.run("rename", task, on_done=done, on_error=show_udev_error, button=rename_button, busy_text="Renaming...")
+
+    port_tasks.run("rename", get_symbolic_name_by_serial, serial_number, on_done=ask, button=rename_button, busy_text="Renaming...")
 
 # Function to delete a symbolic name rule
 def delete_symbolic_name():
@@ -171,92 +323,148 @@ def delete_symbolic_name():
     if not selected_port:
         messagebox.showerror("Error", "Please select a port.")
         return
-    serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
-    symbolic_name = get_symbolic_name_by_serial(serial_number)
-    
-    if not symbolic_name:
-        messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+    if refuse_remote_port(selected_port):
         return
-    
-    deleted = False
-    if os.path.exists(UDEV_RULE_PATH):
-        with open(UDEV_RULE_PATH, 'r') as f:
-            rules = f.readlines()
-        
-        # Remove the matching rule from the file
-        with open(UDEV_RULE_PATH, 'w') as f:
-            for rule in rules:
-                if symbolic_name not in rule:
-                    f.write(rule)
-                else:
-                    deleted = True
-    
-    if deleted:
-        reload_udev_rules()
+    serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
+
+    def task():
+        symbolic_name = get_symbolic_name_by_serial(serial_number)
+        if symbolic_name:
+            udev_helper.apply_changes([{"op": "delete", "name": symbolic_name}])
+            device_inventory.set_symbolic_name(serial_number, None)
+        return symbolic_name
+
+    def done(symbolic_name):
+        if not symbolic_name:
+            messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+            return
         messagebox.showinfo("Success", f"Symbolic name '{symbolic_name}' has been deleted.")
         refresh_ports()
-    else:
-        messagebox.showerror("Error", f"Symbolic name '{symbolic_name}' not found.")
 
-# Function to reload udev rules
-def reload_udev_rules():
-    try:
-        subprocess.run(['sudo', 'udevadm', 'control', '--reload-rules'], check=True)
-        subprocess.run(['sudo', 'udevadm', 'trigger'], check=True)
-    except subprocess.CalledProcessError as e:
-        messagebox.showerror("Error", f"Failed to reload udev rules: {e}")
+    port_tasks.run("delete", task, on_done=done, on_error=show_udev_error, button=delete_button, busy_text="Deleting...")
+
+# Function to report a failed udev edit (runs on the Tk thread)
+def show_udev_error(error):
+    if isinstance(error, udev_helper.UdevRuleError):
+        messagebox.showerror("Error", str(error))
+    else:
+        messagebox.showerror("Error", f"Failed to update udev rules: {error}")
 
-# Function to refresh the list of ports
+# Function to refresh the list of ports; the scan runs in the background and a click during one queues another
 def refresh_ports():
-    available_ports = get_serial_ports()
+    port_tasks.run("refresh", get_serial_ports, on_done=show_ports, button=refresh_button, busy_text="Refreshing...", rerun_if_busy=True)
+
+# Function to show a port scan in the dropdown
+def show_ports(available_ports):
     dropdown['values'] = available_ports
     if available_ports:
         dropdown.current(0)
     else:
         dropdown.set("No available ports found")
 
+# Function to get a sketch's name from its .ino file or folder
+def sketch_name(sketch_path):
+    return os.path.splitext(os.path.basename(sketch_path.rstrip(os.sep)))[0]
+
+# Function to get the build folder used for a sketch
+def sketch_build_path(sketch_path):
+    return os.path.join(BUILD_ROOT, sketch_name(sketch_path))
+
+# Function to decode crash dumps in the monitor against an ELF; its symbol index is built in the background
+def set_crash_elf(elf_path):
+    global monitor_crash_decoder
+    if os.path.exists(elf_path):
+        monitor_crash_decoder = crash_decoder.CrashDecoder(
+            elf_path, on_late_lines=lambda lines: update_console("\n".join(lines))
+        )
+
+# Function to get the compile-ahead watcher if it is watching this sketch
+def compile_watcher_for(sketch_path):
+    watcher = compile_watcher
+    if watcher and os.path.abspath(watcher.sketch_path) == os.path.abspath(sketch_path):
+        return watcher
+    return None
+
+# Function to start or stop compile-ahead for the selected sketch (checkbox toggled or file changed)
+def update_compile_ahead(*_):
+    global compile_watcher
+    if compile_watcher:
+        compile_watcher.stop()
+        compile_watcher = None
+    sketch_path = file_path_var.get()
+    if not compile_ahead_var.get() or not sketch_path.lower().endswith('.ino') or not os.path.exists(sketch_path):
+        return
+    try:
+        compile_watcher = compile_ahead.CompileAhead(
+            ARDUINO_CLI_PATH, sketch_path, BOARD_FQBN, BOARD_OPTIONS, sketch_build_path(sketch_path),
+            LIBRARY_DIRS, on_status=lambda message: update_console(f"[compile-ahead] {message}")
+        )
+    except OSError as e:
+        compile_ahead_var.set(False)
+        messagebox.showerror("Error", f"Cannot watch the sketch folder: {e}")
+
 # Function to compile the selected Arduino code
 def compile_code(sketch_path):
     try:
+        build_path = sketch_build_path(sketch_path)
+        watcher = compile_watcher_for(sketch_path)
+        if watcher and watcher.is_fresh():
+            set_crash_elf(os.path.join(build_path, f"{sketch_name(sketch_path)}.ino.elf"))
+            update_progress(100)
+            update_console("Sketch unchanged since the background compile, skipping compilation.")
+            update_status_label("Using the build compiled ahead.")
+            return True
+        fingerprint = watcher.fingerprint() if watcher else None
         update_status_label("Compiling...")
-        update_console("Compiling Arduino code...")
-        process = subprocess.Popen(
-            [
-                ARDUINO_CLI_PATH,
-                "compile",
-                "--fqbn", "esp32:esp32:esp32doit-devkit-v1",
-                "--board-options", "UploadSpeed=115200",
-                "--verbose",
-                sketch_path
-            ],
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
-        )
+        backend = arduino_backend.get_backend(ARDUINO_CLI_PATH)
+        update_console(f"Compiling Arduino code ({backend.name} back end)...")
         total_steps = 20  # Estimate total number of steps
-        current_step = 0
+        state = {"step": 0}
+        phases = None  # Spans of the trace for each compile phase, once the compile span is open
 
-        for line in process.stdout:
-            update_console(line.strip())
+        def on_line(line):
+            line = line.strip()
+            update_console(line)
             # Update progress based on specific output patterns
             if "Compiling sketch..." in line:
-                current_step = 2
+                state["step"] = 2
+                phases.enter("sketch")
             elif "Compiling libraries..." in line:
-                current_step = 4
+                state["step"] = 4
+                phases.enter("libraries")
             elif "Compiling core..." in line:
-                current_step = 6
+                state["step"] = 6
+                phases.enter("core")
             elif "Linking everything together..." in line:
-                current_step = 8
+                state["step"] = 8
+                phases.enter("link")
             elif "Building..." in line:
-                current_step += 1
+                state["step"] += 1
             elif "Sketch uses" in line:
-                current_step = total_steps - 1  # Almost done
+                state["step"] = total_steps - 1  # Almost done
             # Calculate progress percentage
-            progress = int((current_step / total_steps) * 100)
-            update_progress(progress)
+            update_progress(int((state["step"] / total_steps) * 100))
             # Update status label with the last line
-            update_status_label(line.strip())
-
-        process.wait()
-        if process.returncode == 0:
+            update_status_label(line)
+
+        def on_percent(percent):
+            # The daemon reports real task progress, which beats guessing from the log
+            update_progress(int(percent))
+
+        with tracing.span("compile", "compile", sketch=sketch_name(sketch_path), backend=backend.name) as attributes:
+            phases = tracing.PhaseSpans("compile")
+            try:
+                returncode = backend.compile(
+                    sketch_path, BOARD_FQBN, BOARD_OPTIONS, build_path=build_path, on_line=on_line,
+                    on_percent=on_percent
+                )
+            finally:
+                phases.close()
+            attributes["returncode"] = returncode
+        if returncode == 0:
+            if fingerprint:
+                compile_ahead.write_stamp(build_path, fingerprint)
+            set_crash_elf(os.path.join(build_path, f"{sketch_name(sketch_path)}.ino.elf"))
             update_progress(100)
             update_console("Compilation successful.")
             update_status_label("Compilation successful.")
@@ -264,138 +472,287 @@ def compile_code(sketch_path):
         else:
             update_console("Compilation failed.")
             update_status_label("Compilation failed.")
-            messagebox.showerror("Compilation Error", "Compilation failed. Check logs for details.")
+            show_error("Compilation Error", "Compilation failed. Check logs for details.")
             return False
+    except arduino_backend.ArduinoCliCancelled:
+        update_console("Compilation cancelled.")
+        update_status_label("Compilation cancelled.")
+        return False
     except Exception as e:
         update_console(f"Error during compilation: {e}")
         update_status_label("Error during compilation.")
-        messagebox.showerror("Error", f"Error during compilation:\n{e}")
+        show_error("Error", f"Error during compilation:\n{e}")
         return False
 
 # Function to upload the compiled code to the selected port
-def upload_code(port, sketch_path):
+def upload_code(port, sketch_path, serial_number=None):
+    started = time.time()
+    result = "failed"
     try:
         update_status_label("Uploading...")
         update_console(f"Uploading code to {port}...")
-        process = subprocess.Popen(
-            [
-                ARDUINO_CLI_PATH,
-                "upload",
-                "-p", port,
-                "--fqbn", "esp32:esp32:esp32doit-devkit-v1",
-                "--board-options", "UploadSpeed=115200",
-                sketch_path,
-                "--verbose"
-            ],
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
-        )
-
+        backend = arduino_backend.get_backend(ARDUINO_CLI_PATH)
         total_steps = 10  # Estimate total number of steps
-        current_step = 0
+        state = {"step": 0}
+        phases = None  # Spans of the trace for esptool's stages, told apart by its output
 
-        for line in process.stdout:
-            update_console(line.strip())
+        def on_line(line):
+            line = line.strip()
+            update_console(line)
             # Update progress based on specific output patterns
             if "Connecting..." in line:
-                current_step = 2
+                state["step"] = 2
+                phases.enter("connect")
             elif "Chip is" in line:
-                current_step = 4
+                state["step"] = 4
             elif "Writing at" in line:
-                current_step += 1
+                state["step"] += 1
+                phases.enter("write")
             elif "Hash of data verified" in line:
-                current_step = total_steps - 1
+                state["step"] = total_steps - 1
+            if "Flash will be erased" in line or "Erasing flash" in line:
+                phases.enter("erase")
+            elif line.startswith("Wrote "):
+                phases.enter("verify")
+            elif "Hard resetting" in line:
+                phases.enter("reset")
             # Calculate progress percentage
-            progress = int((current_step / total_steps) * 100)
-            update_progress(progress)
+            update_progress(int((state["step"] / total_steps) * 100))
             # Update status label with the last line
-            update_status_label(line.strip())
-
-        process.wait()
-        if process.returncode == 0:
+            update_status_label(line)
+
+        with tracing.span("upload", "flash", port=port, serial_number=serial_number, sketch=sketch_name(sketch_path),
+                          tool="arduino-cli") as attributes:
+            phases = tracing.PhaseSpans("flash")
+            # arduino-cli opens the port itself, so lend it out of the monitor's broker for the upload
+            try:
+                with serial_broker.handed_over(port):
+                    returncode = backend.upload(
+                        port, sketch_path, BOARD_FQBN, BOARD_OPTIONS, input_dir=sketch_build_path(sketch_path),
+                        on_line=on_line
+                    )
+            finally:
+                phases.close()
+            attributes["returncode"] = returncode
+        if returncode == 0:
+            result = "ok"
             update_progress(100)
             update_console("Upload successful.")
             update_status_label("Upload successful.")
-            messagebox.showinfo("Success", "Code uploaded successfully!")
+            show_info("Success", "Code uploaded successfully!")
         else:
-            update_console(f"Upload failed with exit status {process.returncode}.")
+            update_console(f"Upload failed with exit status {returncode}.")
             update_status_label("Upload failed.")
-            messagebox.showerror("Upload Error", f"Upload failed. Check logs for details.")
+            show_error("Upload Error", f"Upload failed. Check logs for details.")
+    except arduino_backend.ArduinoCliCancelled:
+        result = "cancelled"
+        update_console("Upload cancelled.")
+        update_status_label("Upload cancelled.")
     except Exception as e:
         update_console(f"Error during upload: {e}")
         update_status_label("Error during upload.")
-        messagebox.showerror("Error", f"Error during upload:\n{e}")
+        show_error("Error", f"Error during upload:\n{e}")
+    finally:
+        # The history entry has no image hash: arduino-cli picks the images to write itself
+        if serial_number:
+            device_inventory.record_flash(
+                serial_number, None, started, time.time() - started, 115200, result, port=port
+            )
+
+# Function to flash one or more (address, path) images to a port through the flash engine
+def flash_images_to_port(port, images, success_message, serial_number=None, chip=esp_flasher.DEFAULT_CHIP):
+    try:
+        # The engine keeps esptool loaded in a worker process, so only the first job pays the start-up
+        engine = esp_flasher.get_engine(port, chip=chip, baud=115200)
+
+        def on_progress(stage, done, total):
+            update_progress(esp_flasher.overall_percent(stage, done, total))
+
+        def on_log(message):
+            update_console(message)
+            update_status_label(message)
+
+        with tracing.span("upload", "flash", port=port, tool="esp_flasher"), serial_broker.handed_over(port):
+            result = engine.flash_images(
+                images,
+                flash_mode="dio", flash_freq="40m", flash_size="detect",
+                on_progress=on_progress, on_log=on_log, serial_number=serial_number,
+                symbolic_name=symbolic_name_for_port(port, serial_number) if serial_number else None,
+                skip_if_current=skip_current_var.get()
+            )
+        update_progress(100)
+        if result["skipped"]:
+            update_console(f"Device already runs this image ({result['description']}, connected in "
+                           f"{result['connect_ms'] / 1000:.2f}s), nothing written.")
+            update_status_label("Already up to date.")
+            return
+        update_console(f"{success_message} ({result['size']} bytes, {result['description']}, connected in "
+                       f"{result['connect_ms'] / 1000:.2f}s).")
+        update_status_label("Upload successful.")
+        show_info("Success", f"{success_message}!")
+    except esp_flasher.FlashCancelled:
+        update_console("Upload cancelled.")
+        update_status_label("Upload cancelled.")
+    except esp_flasher.FlashError as e:
+        update_console(f"Upload failed: {e}")
+        update_status_label("Upload failed.")
+        show_error("Upload Error", f"Upload failed. Check logs for details.")
+    except Exception as e:
+        update_console(f"Error during upload: {e}")
+        update_status_label("Error during upload.")
+        show_error("Error", f"Error during upload:\n{e}")
 
 # Function to upload the binary file to the selected port
-def upload_binary(port, bin_path):
+def upload_binary(port, bin_path, serial_number=None):
+    update_status_label("Uploading binary...")
+    update_console(f"Uploading binary to {port}...")
+    flash_images_to_port(port, [(0x1000, bin_path)], "Binary uploaded successfully", serial_number)
+
+# Function to upload the build a matrix manifest assigns to the selected device
+def upload_from_manifest(port, manifest_path, serial_number):
     try:
-        update_status_label("Uploading binary...")
-        update_console(f"Uploading binary to {port}...")
-
-        cmd = [
-            ESPTOOL_PY_PATH,
-            "--chip", "esp32",
-            "--port", port,
-            "--baud", "115200",
-            "write_flash", "-z",
-            "--flash_mode", "dio",
-            "--flash_freq", "40m",
-            "--flash_size", "detect",
-            "0x1000", bin_path
-        ]
-
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
-        )
+        manifest = build_matrix.load_manifest(manifest_path)
+    except (OSError, ValueError) as e:
+        show_error("Error", f"Could not read build manifest:\n{e}")
+        return
+    symbolic_name = symbolic_name_for_port(port, serial_number)
+    build = build_matrix.artifact_for_device(manifest, symbolic_name, serial_number)
+    if not build:
+        update_status_label("No matching build.")
+        show_error("Error", f"The manifest has no build for {symbolic_name or serial_number}.")
+        return
+    try:
+        images = build_matrix.device_images(manifest, build, symbolic_name, serial_number)
+    except (OSError, nvs_partition.NvsError) as e:
+        update_status_label("Personalization failed.")
+        show_error("Error", f"Could not generate the device's NVS partition:\n{e}")
+        return
+    if "elf" in build["artifacts"]:
+        set_crash_elf(build["artifacts"]["elf"])
+    update_status_label("Uploading build...")
+    update_console(f"Uploading {build['profile']}/{build['variant']} build of {build['sketch']} to {port}...")
+    flash_images_to_port(port, images, "Build uploaded successfully", serial_number, build_matrix.flash_chip(build))
+
+# Function to compile every sketch, board profile and flag variant listed in a matrix file
+def run_build_matrix():
+    config_path = filedialog.askopenfilename(
+        title="Select Build Matrix",
+        filetypes=[("Build Matrix", "*.json")]
+    )
+    if not config_path:
+        return
+    try:
+        matrix = build_matrix.load_matrix(config_path)
+    except (OSError, ValueError) as e:
+        show_error("Error", f"Could not read build matrix:\n{e}")
+        return
 
-        total_steps = 10  # Estimate total number of steps
-        current_step = 0
+    def on_result(entry, done, total):
+        status = "ok" if entry["ok"] else f"failed, see {entry['log']}"
+        update_console(f"[{done}/{total}] {entry['sketch']} {entry['profile']}/{entry['variant']}: {status}")
+        update_progress(int(done / total * 100))
 
-        for line in process.stdout:
-            update_console(line.strip())
-            # Update progress based on specific output patterns
-            if "Connecting..." in line:
-                current_step = 2
-            elif "Chip is" in line:
-                current_step = 4
-            elif "Writing at" in line:
-                current_step += 1
-            elif "Hash of data verified" in line:
-                current_step = total_steps - 1
-            # Calculate progress percentage
-            progress = int((current_step / total_steps) * 100)
-            update_progress(progress)
-            # Update status label with the last line
-            update_status_label(line.strip())
+    def task():
+        update_progress(0)
+        update_status_label("Building matrix...")
+        try:
+            manifest_path, manifest = build_matrix.run_matrix(matrix, ARDUINO_CLI_PATH, on_result=on_result)
+        except Exception as e:
+            update_console(f"Error during matrix build: {e}")
+            update_status_label("Matrix build failed.")
+            return
+        failed = sum(1 for entry in manifest["builds"] if not entry["ok"])
+        update_console(f"Manifest written to {manifest_path} ({failed} failed builds).")
+        update_status_label("Matrix build finished." if not failed else f"Matrix build finished with {failed} failures.")
+        call_in_ui(file_path_var.set, manifest_path)
+
+    threading.Thread(target=task, daemon=True).start()
+
+# Function to cancel the running compile, upload or binary upload
+def cancel_upload():
+    if active_job:
+        update_console("Cancelling...")
+        active_job.cancel()
+
+# Coroutine running one compile/upload job on the job runner loop
+async def upload_job(ext, port_device, file_path, serial_number):
+    if ext == '.ino':
+        # Keep compile-ahead out of the build folder until the upload is done, finishing a build it already began
+        watcher = compile_watcher_for(file_path)
+        try:
+            if watcher:
+                # run_blocking lets hold() return even when cancelled, so the release below always pairs with it
+                await job_runner.run_blocking(watcher.hold, cancel=watcher.cancel_build, timeout=COMPILE_TIMEOUT)
+            # Compile and upload using arduino-cli
+            compiled = await job_runner.run_blocking(
+                compile_code, file_path, cancel=arduino_backend.cancel_active, timeout=COMPILE_TIMEOUT
+            )
+            if compiled:
+                await job_runner.run_blocking(
+                    upload_code, port_device, file_path, serial_number,
+                    cancel=arduino_backend.cancel_active, timeout=UPLOAD_TIMEOUT
+                )
+        finally:
+            if watcher:
+                watcher.release()
+    elif ext == '.bin':
+        # Upload directly through the flash engine
+        await job_runner.run_blocking(
+            upload_binary, port_device, file_path, serial_number,
+            cancel=lambda: esp_flasher.cancel_engine(port_device), timeout=FLASH_TIMEOUT
+        )
+    elif ext == '.json':
+        # Pick this device's artifacts from a build matrix manifest
+        await job_runner.run_blocking(
+            upload_from_manifest, port_device, file_path, serial_number,
+            cancel=lambda: esp_flasher.cancel_engine(port_device), timeout=FLASH_TIMEOUT
+        )
 
-        process.wait()
-        if process.returncode == 0:
-            update_progress(100)
-            update_console("Binary upload successful.")
-            update_status_label("Upload successful.")
-            messagebox.showinfo("Success", "Binary uploaded successfully!")
-        else:
-            update_console(f"Upload failed with exit status {process.returncode}.")
-            update_status_label("Upload failed.")
-            messagebox.showerror("Upload Error", f"Upload failed. Check logs for details.")
-    except Exception as e:
-        update_console(f"Error during upload: {e}")
-        update_status_label("Error during upload.")
-        messagebox.showerror("Error", f"Error during upload:\n{e}")
+# Function called on the Tk thread once a compile/upload job has finished
+def on_upload_job_done(future, port_device):
+    global active_job
+    active_job = None
+    if future.cancelled():
+        update_console("Job cancelled.")
+        update_status_label("Cancelled.")
+    elif isinstance(future.exception(), job_runner.JobTimeout):
+        update_console(f"Job timed out: {future.exception()}")
+        update_status_label("Timed out.")
+        messagebox.showerror("Timeout", f"The job was stopped because it took too long.\n{future.exception()}")
+    elif future.exception():
+        update_console(f"Error during job: {future.exception()}")
+        update_status_label("Error.")
+        messagebox.showerror("Error", f"Error during job:\n{future.exception()}")
+
+    # Re-enable the button after the process is complete
+    upload_button.config(state=tk.NORMAL)
+
+    # The monitor got the port back when the upload finished; start it if it wasn't running
+    start_serial_monitor(port_device)
 
 # Function to compile and upload the code to the selected serial port
 def compile_and_upload():
+    global active_job
     selected_port = dropdown.get()
     if not selected_port:
         messagebox.showerror("Error", "Please select a port.")
         return
     port_device = selected_port.split(" - ")[0].split(" ")[0]
+    serial_number = selected_port.split("Serial: ")[1]  # Extract serial number
     file_path = file_path_var.get()
 
     if not file_path:
         messagebox.showerror("Error", "Please select a file.")
         return
 
+    # Determine if the file is .ino, .bin or a build manifest
+    _, ext = os.path.splitext(file_path)
+    ext = ext.lower()
+    if ext not in ('.ino', '.bin', '.json'):
+        messagebox.showerror("Error", "Unsupported file type. Please select a .ino, .bin or manifest file.")
+        update_status_label("Unsupported file type.")
+        return
+
     # Disable button while compiling/uploading
     upload_button.config(state=tk.DISABLED)
 
@@ -403,45 +760,212 @@ def compile_and_upload():
     update_progress(0)
     update_status_label("")
 
-    # Stop serial monitor during upload
-    stop_serial_monitor()
-
-    # Determine if the file is .ino or .bin
-    _, ext = os.path.splitext(file_path)
-    ext = ext.lower()
-
-    # Run the compilation and upload in a separate thread
-    def task():
-        if ext == '.ino':
-            # Compile and upload using arduino-cli
-            if compile_code(file_path):
-                upload_code(port_device, file_path)
-        elif ext == '.bin':
-            # Upload directly using esptool.py
-            upload_binary(port_device, file_path)
-        else:
-            messagebox.showerror("Error", "Unsupported file type. Please select a .ino or .bin file.")
-            update_status_label("Unsupported file type.")
-
-        # Re-enable the button after the process is complete
-        upload_button.config(state=tk.NORMAL)
-
-        # Restart serial monitor after upload
-        start_serial_monitor(port_device)
+    # Run the job on the background event loop and hear back on the Tk thread
+    active_job = job_runner.submit(upload_job(ext, port_device, file_path, serial_number))
+    active_job.add_done_callback(lambda future: call_in_ui(on_upload_job_done, future, port_device))
 
-    threading.Thread(target=task).start()
-
-# Function to browse for a file (either .ino or .bin)
+# Function to browse for a file (.ino, .bin or a build manifest)
 def browse_file():
     filename = filedialog.askopenfilename(
         title="Select File",
-        filetypes=[("Arduino Sketch or Binary", "*.ino *.bin")]
+        filetypes=[("Arduino Sketch or Binary", "*.ino *.bin"), ("Build Manifest", "*.json")]
     )
     file_path_var.set(filename)
 
+# Function to open the batch window for flashing one image to many ports at once
+def open_batch_flash_window():
+    batch_window = tk.Toplevel(root)
+    batch_window.title("Batch Flash")
+    batch_window.geometry("700x460")
+
+    ttk.Label(batch_window, text="Select the ports to flash with the selected .bin or build manifest:", font=("Helvetica", 12)).pack(pady=5)
+    port_list = tk.Listbox(batch_window, selectmode=tk.EXTENDED, font=("Helvetica", 10))
+    port_list.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
+    batch_ports = get_serial_ports()
+    for port in batch_ports:
+        port_list.insert(tk.END, port)
+
+    test_frame = ttk.Frame(batch_window)
+    test_frame.pack(pady=5, padx=10, fill=tk.X)
+    ttk.Label(test_frame, text="Test script:").pack(side=tk.LEFT)
+    test_script_var = tk.StringVar()
+    ttk.Entry(test_frame, textvariable=test_script_var).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+    ttk.Button(test_frame, text="Browse", command=lambda: test_script_var.set(filedialog.askopenfilename(
+        parent=batch_window, filetypes=[("Test scripts", "*.json"), ("All files", "*.*")]
+    ) or test_script_var.get())).pack(side=tk.LEFT)
+    test_after_flash_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(batch_window, text="Test each device after flashing", variable=test_after_flash_var).pack()
+
+    batch_status_label = ttk.Label(batch_window, text="", font=("Helvetica", 10))
+    batch_status_label.pack(pady=5)
+    state = {"scheduler": None, "tests": None, "test_cancel": None}
+
+    def load_test_script():
+        try:
+            return send_expect.load_script(test_script_var.get())
+        except send_expect.ScriptError as e:
+            messagebox.showerror("Error", str(e), parent=batch_window)
+            return None
+
+    def on_test_result(report):
+        send_expect.record(report)
+        update_console(f"Test {send_expect.format_report(report)}")
+
+    def test_summary(script, reports):
+        passed = sum(1 for report in reports if report["result"] == "pass")
+        update_console(f"Test report written to {send_expect.save_report(script, reports)}")
+        return f"{passed}/{len(reports)} devices passed {script['name']}."
+
+    def build_jobs(selected):
+        file_path = file_path_var.get()
+        _, ext = os.path.splitext(file_path)
+        manifest = build_matrix.load_manifest(file_path) if ext.lower() == '.json' else None
+        jobs = []
+        for entry in selected:
+            port_device = entry.split(" - ")[0].split(" ")[0]
+            serial_number = entry.split("Serial: ")[1]
+            symbolic_name = symbolic_name_for_port(port_device, serial_number)
+            if manifest is not None:
+                build = build_matrix.artifact_for_device(manifest, symbolic_name, serial_number)
+                if not build:
+                    update_console(f"No build for {symbolic_name or serial_number} in the manifest, skipping.")
+                    continue
+                try:
+                    images = build_matrix.device_images(manifest, build, symbolic_name, serial_number)
+                except (OSError, nvs_partition.NvsError) as e:
+                    update_console(f"Could not personalize {symbolic_name or serial_number}: {e} Skipping.")
+                    continue
+            elif ext.lower() == '.bin':
+                images = [(0x1000, file_path)]
+            else:
+                raise ValueError("Select a .bin file or a build manifest first.")
+            chip = build_matrix.flash_chip(build) if manifest is not None else esp_flasher.DEFAULT_CHIP
+            jobs.append(flash_scheduler.FlashJob(port_device, images, serial_number, symbolic_name, chip))
+        return jobs
+
+    def on_job_start(job):
+        update_console(f"[{job.label}] Flashing on hub {job.hub} (attempt {job.attempts})...")
+
+    def on_job_done(job):
+        if state["tests"] is not None and not job.error:
+            # Tested on a thread of its own, so the scheduler can hand the hub's slot to the next flash
+            target = (job.port, job.serial_number, job.symbolic_name)
+            future = state["test_pool"].submit(
+                send_expect.DeviceTest(state["test_script"], *target, cancel_event=state["test_cancel"]).run
+            )
+            future.add_done_callback(lambda done: on_test_result(done.result()))
+            state["tests"].append(future)
+        if job.error:
+            update_console(f"[{job.label}] Failed after {job.duration:.1f}s: {job.error}")
+        elif job.result["skipped"]:
+            update_console(f"[{job.label}] Already up to date (connected in {job.connect_ms / 1000:.2f}s).")
+        else:
+            rate = f", {job.rate / 1024:.1f} KiB/s" if job.rate else ""
+            update_console(f"[{job.label}] Done in {job.duration:.1f}s, connected in "
+                           f"{job.connect_ms / 1000:.2f}s{rate}.")
+
+    def start_batch():
+        selected = [batch_ports[i] for i in port_list.curselection()]
+        if not selected:
+            messagebox.showerror("Error", "Please select at least one port.", parent=batch_window)
+            return
+        try:
+            jobs = build_jobs(selected)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", str(e), parent=batch_window)
+            return
+        if not jobs:
+            return
+        state["tests"] = None
+        if test_after_flash_var.get():
+            script = load_test_script()
+            if script is None:
+                return
+            state.update(tests=[], test_script=script, test_cancel=threading.Event(),
+                         test_pool=concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs),
+                                                                         thread_name_prefix="serial-test"))
+        scheduler = flash_scheduler.BatchFlashScheduler(
+            jobs,
+            flash_kwargs={"flash_mode": "dio", "flash_freq": "40m", "flash_size": "detect",
+                          "skip_if_current": skip_current_var.get()},
+            on_job_start=on_job_start, on_job_done=on_job_done
+        )
+        state["scheduler"] = scheduler
+        start_button.config(state=tk.DISABLED)
+
+        def task():
+            try:
+                scheduler.run()
+                failed = sum(1 for job in jobs if job.error)
+                summary = f"Flashed {len(jobs) - failed}/{len(jobs)} devices in {scheduler.duration:.1f}s."
+                update_console(summary)
+                if state["tests"] is not None:
+                    state["test_pool"].shutdown(wait=True)
+                    reports = [future.result() for future in state["tests"]]
+                    if reports:
+                        summary += " " + test_summary(state["test_script"], reports)
+                trace_path = tracing.save()
+                if trace_path:
+                    update_console(f"Trace written to {trace_path}")
+            except Exception as e:
+                summary = f"Batch failed: {e}"
+                update_console(summary)
+            finally:
+                call_in_ui(start_button.config, state=tk.NORMAL)
+                state.update(scheduler=None, tests=None, test_cancel=None)
+            call_in_ui(batch_status_label.config, text=summary)
+
+        batch_status_label.config(text=f"Flashing {len(jobs)} devices...")
+        threading.Thread(target=task, daemon=True).start()
+
+    def start_tests():
+        selected = [batch_ports[i] for i in port_list.curselection()]
+        if not selected:
+            messagebox.showerror("Error", "Please select at least one port.", parent=batch_window)
+            return
+        script = load_test_script()
+        if script is None:
+            return
+        targets = []
+        for entry in selected:
+            serial_number = entry.split("Serial: ")[1]
+            port_device = entry.split(" - ")[0].split(" ")[0]
+            targets.append((port_device, serial_number, symbolic_name_for_port(port_device, serial_number)))
+        state["test_cancel"] = cancel_event = threading.Event()
+        test_button.config(state=tk.DISABLED)
+
+        def task():
+            try:
+                reports = send_expect.run_all(script, targets, cancel_event, on_result=on_test_result)
+                summary = test_summary(script, reports)
+            except Exception as e:
+                summary = f"Test run failed: {e}"
+            finally:
+                call_in_ui(test_button.config, state=tk.NORMAL)
+                state["test_cancel"] = None
+            update_console(summary)
+            call_in_ui(batch_status_label.config, text=summary)
+
+        batch_status_label.config(text=f"Testing {len(targets)} devices...")
+        threading.Thread(target=task, daemon=True).start()
+
+    def cancel_batch():
+        if state["scheduler"]:
+            state["scheduler"].cancel()
+        if state["test_cancel"]:
+            state["test_cancel"].set()
+
+    batch_buttons = ttk.Frame(batch_window)
+    batch_buttons.pack(pady=10)
+    start_button = ttk.Button(batch_buttons, text="Flash Selected", command=start_batch, width=20)
+    start_button.pack(side=tk.LEFT, padx=5)
+    test_button = ttk.Button(batch_buttons, text="Test Selected", command=start_tests, width=20)
+    test_button.pack(side=tk.LEFT, padx=5)
+    ttk.Button(batch_buttons, text="Cancel", command=cancel_batch, width=20).pack(side=tk.LEFT, padx=5)
+
 # Function to open the console window
 def open_console_window():
-    global console_window, console_text  # Declare console_text as global
+    global console_window, console_text, plot_pane, hex_pane  # Declare console_text as global
     if console_window:
         console_window.deiconify()
         return
@@ -450,9 +974,65 @@ def open_console_window():
     console_window.title("Console and Serial Monitor")
     console_window.geometry("800x400")
 
+    # Decoder controls: framing and an optional record schema such as "t:u4, ax:i2, ay:i2, az:i2"
+    decoder_frame = ttk.Frame(console_window)
+    decoder_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+    ttk.Label(decoder_frame, text="Framing:").pack(side=tk.LEFT)
+    framing_var = tk.StringVar(value=monitor_decoder.framer.name)
+    ttk.Combobox(decoder_frame, textvariable=framing_var, values=list(serial_decoders.FRAMERS), state="readonly", width=12).pack(side=tk.LEFT, padx=5)
+    ttk.Label(decoder_frame, text="Schema:").pack(side=tk.LEFT)
+    schema_var = tk.StringVar()
+    ttk.Entry(decoder_frame, textvariable=schema_var, width=40).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+    ttk.Button(decoder_frame, text="Apply", command=lambda: set_monitor_decoder(framing_var.get(), schema_var.get())).pack(side=tk.LEFT)
+
+    # Plot of numeric channels (CSV, key=value or decoded records), shown on demand
+    plot_pane = serial_plot.SerialPlot(console_window)
+    plot_visible_var = tk.BooleanVar(value=False)
+
+    def toggle_plot():
+        if plot_visible_var.get():
+            plot_pane.canvas.pack(fill=tk.X, padx=10, pady=(10, 0), after=decoder_frame)
+            plot_pane.start()
+        else:
+            plot_pane.stop()
+            plot_pane.canvas.pack_forget()
+
+    ttk.Checkbutton(decoder_frame, text="Plot", variable=plot_visible_var, command=toggle_plot).pack(side=tk.LEFT, padx=5)
+    ttk.Button(decoder_frame, text="Clear Plot", command=plot_pane.clear).pack(side=tk.LEFT)
+
     console_text = tk.Text(console_window, height=25, state=tk.DISABLED, wrap=tk.WORD)
     console_text.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
 
+    # Hex + ASCII view of the raw bytes, swapped in place of the text console
+    hex_pane = hex_view.HexView(console_window, raw_capture)
+    hex_visible_var = tk.BooleanVar(value=False)
+
+    def toggle_hex():
+        if hex_visible_var.get():
+            console_text.pack_forget()
+            hex_pane.frame.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+            hex_pane.start()
+        else:
+            hex_pane.stop()
+            hex_pane.frame.pack_forget()
+            console_text.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+
+    ttk.Checkbutton(decoder_frame, text="Hex", variable=hex_visible_var, command=toggle_hex).pack(side=tk.LEFT, padx=5)
+
+    # Other consumers of the same port: a raw log file and localhost TCP clients such as test scripts
+    log_var = tk.BooleanVar(value=False)
+    tcp_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(decoder_frame, text="Log", variable=log_var, command=lambda: toggle_monitor_log(log_var)).pack(side=tk.LEFT, padx=5)
+    ttk.Checkbutton(decoder_frame, text="TCP", variable=tcp_var, command=lambda: toggle_monitor_tcp(tcp_var)).pack(side=tk.LEFT, padx=5)
+
+    # Timestamped binary capture of the port, and replay of one through the decoders at a chosen speed
+    record_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(decoder_frame, text="Record", variable=record_var, command=lambda: toggle_monitor_record(record_var)).pack(side=tk.LEFT, padx=5)
+    replay_speed_var = tk.StringVar(value="1x")
+    ttk.Combobox(decoder_frame, textvariable=replay_speed_var, values=list(capture_file.SPEEDS), state="readonly", width=4).pack(side=tk.LEFT)
+    replay_button = ttk.Button(decoder_frame, text="Replay...", command=lambda: toggle_replay(replay_button, replay_speed_var.get()))
+    replay_button.pack(side=tk.LEFT, padx=5)
+
     # Start serial monitor if port is selected
     selected_port = dropdown.get()
     if selected_port:
@@ -464,46 +1044,191 @@ def open_console_window():
 
 # Function to handle console window close event
 def on_console_close():
-    global console_window
+    global console_window, plot_pane, hex_pane, monitor_logger, monitor_tcp, monitor_recorder
+    if replay_cancel:
+        replay_cancel.set()
+    if monitor_recorder:
+        monitor_recorder.stop()
+        monitor_recorder = None
+    if monitor_logger:
+        monitor_logger.stop()
+        monitor_logger = None
+    if monitor_tcp:
+        monitor_tcp.stop()
+        monitor_tcp = None
     stop_serial_monitor()
+    plot_pane.stop()
+    plot_pane = None
+    hex_pane.stop()
+    hex_pane = None
     console_window.destroy()
     console_window = None
 
-# Function to start serial monitor
+# Function to start serial monitor: subscribe the console to the port's broker, opening the port if needed
 def start_serial_monitor(port):
-    global serial_port, monitor_running
-    if monitor_running:
+    global monitor_port, monitor_subscription
+    if monitor_subscription:
         return
+    broker = serial_broker.get_broker(port)
+    monitor_subscription = broker.subscribe(on_monitor_data, on_status=update_console)
+    monitor_port = port
     try:
-        serial_port = serial.Serial(port, baudrate=115200, timeout=1)
-        monitor_running = True
-        threading.Thread(target=read_from_port, daemon=True).start()
-        update_console(f"Serial monitor started on {port}")
+        broker.open()
     except serial.SerialException as e:
         update_console(f"Error opening serial port {port}: {e}")
-        monitor_running = False
+        stop_serial_monitor()
 
-# Function to stop serial monitor
+# Function to stop serial monitor; the port stays open while a log or TCP client still uses it
 def stop_serial_monitor():
-    global serial_port, monitor_running
-    monitor_running = False
-    if serial_port and serial_port.is_open:
-        serial_port.close()
-        update_console("Serial monitor stopped")
-        serial_port = None
-
-# Function to read from serial port
-def read_from_port():
-    global serial_port, monitor_running
-    while monitor_running and serial_port and serial_port.is_open:
+    global monitor_port, monitor_subscription
+    if not monitor_subscription:
+        return
+    monitor_subscription.close()
+    serial_broker.release_if_idle(monitor_port)
+    monitor_subscription = None
+    monitor_port = None
+    update_console("Serial monitor stopped")
+
+# Function to start or stop logging the monitored port's raw bytes to a file
+def toggle_monitor_log(log_var):
+    global monitor_logger
+    if not log_var.get():
+        if monitor_logger:
+            monitor_logger.stop()
+            update_console(f"Stopped logging to {monitor_logger.path}")
+            monitor_logger = None
+        return
+    if not monitor_port:
+        log_var.set(False)
+        messagebox.showerror("Error", "Start the serial monitor first.")
+        return
+    path = filedialog.asksaveasfilename(title="Log Serial Output", defaultextension=".log")
+    if not path:
+        log_var.set(False)
+        return
+    monitor_logger = serial_broker.FileLogger(serial_broker.get_broker(monitor_port), path)
+    update_console(f"Logging {monitor_port} to {path}")
+
+# Function to start or stop recording the monitored port to a binary capture file
+def toggle_monitor_record(record_var):
+    global monitor_recorder
+    if not record_var.get():
+        if monitor_recorder:
+            monitor_recorder.stop()
+            update_console(f"Capture saved to {monitor_recorder.path} ({monitor_recorder.writer.chunks} chunks)")
+            monitor_recorder = None
+        return
+    if not monitor_port:
+        record_var.set(False)
+        messagebox.showerror("Error", "Start the serial monitor first.")
+        return
+    path = filedialog.asksaveasfilename(title="Record Serial Capture", defaultextension=".dgcap",
+                                        filetypes=[("Serial Capture", "*.dgcap")])
+    if not path:
+        record_var.set(False)
+        return
+    try:
+        monitor_recorder = capture_file.CaptureRecorder(serial_broker.get_broker(monitor_port), path)
+    except OSError as e:
+        record_var.set(False)
+        messagebox.showerror("Error", f"Could not record to {path}:\n{e}")
+        return
+    update_console(f"Recording {monitor_port} to {path}")
+
+# Function to replay a capture through the monitor's decoders and console, or stop the running replay
+def toggle_replay(replay_button, speed_name):
+    global replay_cancel
+    if replay_cancel:
+        replay_cancel.set()
+        return
+    path = filedialog.askopenfilename(title="Replay Serial Capture", filetypes=[("Serial Capture", "*.dgcap")])
+    if not path:
+        return
+    # Live bytes would interleave with the replayed ones, so the monitor stops for the replay
+    stop_serial_monitor()
+    monitor_decoder.reset()
+    cancel_event = threading.Event()
+    replay_cancel = cancel_event
+    replay_button.config(text="Stop Replay")
+    update_console(f"Replaying {os.path.basename(path)} at {speed_name}...")
+
+    def task():
+        global replay_cancel
         try:
-            line = serial_port.readline().decode('utf-8', errors='replace').rstrip()
-            if line:
-                update_console(line)
-        except Exception as e:
-            update_console(f"Error reading from serial port: {e}")
-            break
-    monitor_running = False
+            total, chunks, seconds = capture_file.replay(path, on_monitor_data, capture_file.SPEEDS[speed_name],
+                                                         cancel_event=cancel_event,
+                                                         batch_bytes=capture_file.REPLAY_BATCH_BYTES)
+            rate = f", {total / seconds / 1024:.0f} KiB/s through the decoders" if seconds else ""
+            stopped = " (stopped)" if cancel_event.is_set() else ""
+            update_console(f"Replayed {total} bytes in {chunks} chunks in {seconds:.2f}s{rate}{stopped}.")
+        except (OSError, ValueError, capture_file.CaptureError) as e:
+            update_console(f"Replay failed: {e}")
+        finally:
+            replay_cancel = None
+            call_in_ui(lambda: replay_button.winfo_exists() and replay_button.config(text="Replay..."))
+
+    threading.Thread(target=task, daemon=True).start()
+
+# Function to start or stop sharing the monitored port with localhost TCP clients
+def toggle_monitor_tcp(tcp_var):
+    global monitor_tcp
+    if not tcp_var.get():
+        if monitor_tcp:
+            monitor_tcp.stop()
+            monitor_tcp = None
+            update_console("Stopped sharing the serial port over TCP")
+        return
+    if not monitor_port:
+        tcp_var.set(False)
+        messagebox.showerror("Error", "Start the serial monitor first.")
+        return
+    try:
+        monitor_tcp = serial_broker.TcpFanout(serial_broker.get_broker(monitor_port), MONITOR_TCP_PORT)
+    except OSError as e:
+        tcp_var.set(False)
+        messagebox.showerror("Error", f"Could not share the port over TCP:\n{e}")
+        return
+    host, tcp_port = monitor_tcp.address
+    update_console(f"Sharing {monitor_port} on {host}:{tcp_port}")
+
+# Function to switch the serial monitor to another framing and record schema
+def set_monitor_decoder(framing, schema):
+    global monitor_decoder
+    try:
+        monitor_decoder = serial_decoders.DecoderPipeline(framing, schema.strip() or None)
+    except (KeyError, TypeError, ValueError) as e:
+        messagebox.showerror("Error", f"Invalid decoder settings:\n{e}")
+        return
+    update_console(f"Serial monitor decoding {framing} frames" + (f" as {schema.strip()}" if schema.strip() else ""))
+
+# Function to show what the decoder produced from one received chunk
+def show_decoded(decoded):
+    global last_record_display
+    plot = plot_pane
+    if isinstance(decoded, list):
+        lines = [line.rstrip() for line in decoded if line.strip()]
+        decoder = monitor_crash_decoder
+        if decoder and lines:
+            lines = decoder.annotate(lines)
+        if lines:
+            update_console("\n".join(lines))
+            if plot:
+                plot.add_lines(lines)
+        return
+    if plot and len(decoded):
+        plot.add_records(decoded)
+    # Records can arrive at kHz rates, so only summarise them a few times per second
+    now = time.monotonic()
+    if len(decoded) and now - last_record_display >= RECORD_DISPLAY_INTERVAL:
+        last_record_display = now
+        last = decoded[-1]
+        fields = ", ".join(f"{name}={last[name]}" for name in decoded.dtype.names)
+        update_console(f"[{monitor_decoder.frames} frames, {monitor_decoder.errors} errors] {fields}")
+
+# Function run by the port's broker for every chunk it reads, on the broker's reader thread
+def on_monitor_data(data):
+    raw_capture.append(data)
+    show_decoded(monitor_decoder.feed(data))
 
 # GUI Setup
 root = tk.Tk()
@@ -526,32 +1251,34 @@ frame.pack(pady=10, padx=20, fill=tk.BOTH, expand=True)
 # Label for dropdown
 ttk.Label(frame, text="Select a Serial Port:", font=("Helvetica", 12)).pack(pady=5)
 
-# Dropdown for available serial ports
-available_ports = get_serial_ports()
+# Dropdown for available serial ports, filled in by the first background scan
 selected_port_var = tk.StringVar()
 
-dropdown = ttk.Combobox(frame, textvariable=selected_port_var, values=available_ports, state="readonly", font=("Helvetica", 10), width=80)
+dropdown = ttk.Combobox(frame, textvariable=selected_port_var, values=[], state="readonly", font=("Helvetica", 10), width=80)
 dropdown.pack(pady=10, fill=tk.X)
-if available_ports:
-    dropdown.current(0)
-else:
-    dropdown.set("No available ports found")
+dropdown.set("Scanning ports...")
 
 # Buttons for Port Manager actions
 button_frame = ttk.Frame(frame)
 button_frame.pack(pady=10)
 
-ttk.Button(button_frame, text="Onboard Selected Port", command=onboard_port, width=30).pack(pady=5)
-ttk.Button(button_frame, text="Replace Serial in Symbolic Name", command=replace_serial_in_symbolic_name, width=30).pack(pady=5)
-ttk.Button(button_frame, text="Rename Symbolic Name", command=rename_symbolic_name, width=30).pack(pady=5)
-ttk.Button(button_frame, text="Delete Symbolic Name", command=delete_symbolic_name, width=30).pack(pady=5)
-ttk.Button(button_frame, text="Refresh Port List", command=refresh_ports, width=30).pack(pady=5)
+onboard_button = ttk.Button(button_frame, text="Onboard Selected Port", command=onboard_port, width=30)
+onboard_button.pack(pady=5)
+replace_button = ttk.Button(button_frame, text="Replace Serial in Symbolic Name", command=replace_serial_in_symbolic_name, width=30)
+replace_button.pack(pady=5)
+rename_button = ttk.Button(button_frame, text="Rename Symbolic Name", command=rename_symbolic_name, width=30)
+rename_button.pack(pady=5)
+delete_button = ttk.Button(button_frame, text="Delete Symbolic Name", command=delete_symbolic_name, width=30)
+delete_button.pack(pady=5)
+ttk.Button(button_frame, text="Benchmark Selected Port", command=benchmark_selected_port, width=30).pack(pady=5)
+refresh_button = ttk.Button(button_frame, text="Refresh Port List", command=refresh_ports, width=30)
+refresh_button.pack(pady=5)
 
 # Separator between Port Manager and File Upload sections
 ttk.Separator(frame, orient='horizontal').pack(fill=tk.X, pady=20)
 
 # File Selection Section
-ttk.Label(frame, text="Select File (.ino or .bin):", font=("Helvetica", 12)).pack(pady=5)
+ttk.Label(frame, text="Select File (.ino, .bin or build manifest):", font=("Helvetica", 12)).pack(pady=5)
 
 # Entry field to display the selected file
 file_path_var = tk.StringVar()
@@ -561,10 +1288,25 @@ file_entry.pack(pady=5, fill=tk.X)
 # Button to browse for a file
 ttk.Button(frame, text="Browse", command=browse_file, width=30).pack(pady=5)
 
+# Checkbox to skip writing devices whose flash already matches the image
+skip_current_var = tk.BooleanVar(value=False)
+ttk.Checkbutton(frame, text="Skip devices already running this image", variable=skip_current_var).pack(pady=5)
+
+# Checkbox to compile the selected sketch in the background whenever its files change
+compile_ahead_var = tk.BooleanVar(value=False)
+ttk.Checkbutton(frame, text="Compile ahead when the sketch changes", variable=compile_ahead_var, command=update_compile_ahead).pack(pady=5)
+file_path_var.trace_add("write", update_compile_ahead)
+
+# Button to compile a build matrix and load its manifest
+ttk.Button(frame, text="Build Matrix...", command=run_build_matrix, width=30).pack(pady=5)
+
 # Button for compile and upload actions
 upload_button = ttk.Button(frame, text="Compile and Upload / Upload Binary", command=compile_and_upload, width=30)
 upload_button.pack(pady=10)
 
+# Button to cancel a running compile or upload
+ttk.Button(frame, text="Cancel Upload", command=cancel_upload, width=30).pack(pady=5)
+
 # Progress bar for upload
 progress_bar = ttk.Progressbar(frame, orient='horizontal', length=400, mode='determinate')
 progress_bar.pack(pady=5)
@@ -578,10 +1320,39 @@ bottom_frame = ttk.Frame(root)
 bottom_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=10)
 
 ttk.Button(bottom_frame, text="Open Console Window", command=open_console_window, width=30).pack(side=tk.RIGHT, padx=5)
+ttk.Button(bottom_frame, text="Batch Flash...", command=open_batch_flash_window, width=20).pack(side=tk.RIGHT, padx=5)
 
 # Add copyright notice at the bottom
 copyright_label = ttk.Label(bottom_frame, text="Copyrights reserved by Dognosis Corp/2024", font=("Helvetica", 10))
 copyright_label.pack(side=tk.LEFT)
 
+# Function to stop the flash workers and the arduino-cli daemon before closing the app
+def on_root_close():
+    if ui_stall_watchdog:
+        ui_stall_watchdog.stop()
+        ui_stall_watchdog.write_summary()
+    if compile_watcher:
+        compile_watcher.stop()
+    port_tasks.shutdown()
+    serial_broker.shutdown_brokers()
+    esp_flasher.shutdown_engines()
+    arduino_backend.shutdown_backend()
+    root.destroy()
+
+root.protocol("WM_DELETE_WINDOW", on_root_close)
+
+# Start draining updates from background jobs
+process_ui_queue()
+
+# Port-manager operations (udev edits, port scans) run on this pool so the window never waits on udev
+port_tasks = ui_tasks.UiTaskRunner(root)
+refresh_ports()
+
+# Log stalls of the Tk event loop, with the main thread's stack, when DOGNOSIS_UI_WATCHDOG=1
+ui_stall_watchdog = None
+if ui_watchdog.enabled():
+    ui_stall_watchdog = ui_watchdog.StallWatchdog(root, on_stall=update_console)
+    ui_stall_watchdog.start()
+
 # Start the GUI event loop
 root.mainloop()
\ No newline at end of file
@@ -1,15 +1,17 @@
 import tkinter as tk
 from tkinter import simpledialog, messagebox
 from tkinter import ttk
-import serial.tools.list_ports
-import subprocess
 import os
+import udev_helper
+import ui_watchdog
+import ui_tasks
+import sysfs_ports
 
-UDEV_RULE_PATH = '/etc/udev/rules.d/99-esp32.rules'  # Path to udev rules file
+UDEV_RULE_PATH = udev_helper.UDEV_RULE_PATH  # Path to udev rules file
 
 # Function to list all available serial ports and check if they have symbolic names and serial numbers
 def get_serial_ports():
-    ports = list(serial.tools.list_ports.comports())
+    ports = sysfs_ports.comports()
     available_ports = []
     
     for port in ports:
@@ -41,129 +43,113 @@ def get_symbolic_name_by_serial(serial_number):
 
 # Function to onboard a selected port with a custom symbolic name
 def onboard_port(selected_port):
-    port_device = selected_port.split(" - ")[0]
-    serial_number = selected_port.split("Serial: ")[1].split(")")[0]  # Extract serial number
+    if not selected_port:
+        messagebox.showerror("Error", "Please select a port.")
+        return
+    serial_number = selected_port.split("Serial: ")[1].split(" | ")[0]  # Extract serial number
     custom_name = simpledialog.askstring("Onboard Port", f"Enter the custom name for the port with serial {serial_number}:")
     
     if serial_number and custom_name:
-        rule = f'SUBSYSTEM=="tty", ATTRS{{serial}}=="{serial_number}", SYMLINK+="{custom_name}"\n'
-        
-        # Append the new rule to the file
-        with open(UDEV_RULE_PATH, 'a') as f:
-            f.write(rule)
-        
-        reload_udev_rules()
-        messagebox.showinfo("Success", f"Port with serial {serial_number} onboarded with name: {custom_name}")
-        refresh_ports()
+        def done(_):
+            messagebox.showinfo("Success", f"Port with serial {serial_number} onboarded with name: {custom_name}")
+            refresh_ports()
+
+        port_tasks.run(
+            "onboard", udev_helper.apply_changes, [{"op": "add", "serial": serial_number, "name": custom_name}],
+            on_done=done, on_error=show_udev_error, button=onboard_button, busy_text="Onboarding..."
+        )
 
 # Function to replace a port's serial number in an existing symbolic name
 def replace_serial_in_symbolic_name():
     selected_port = dropdown.get()
-    serial_number = selected_port.split("Serial: ")[1].split(")")[0]  # Extract serial number
-    existing_symbolic_name = get_symbolic_name_by_serial(serial_number)
-    
-    if not existing_symbolic_name:
-        messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+    if not selected_port:
+        messagebox.showerror("Error", "Please select a port.")
         return
-    
-    new_port = simpledialog.askstring("Replace Serial", f"Enter the new port's serial number to map to '{existing_symbolic_name}':")
-    
-    if new_port:
-        replaced = False
-        if os.path.exists(UDEV_RULE_PATH):
-            with open(UDEV_RULE_PATH, 'r') as f:
-                rules = f.readlines()
-            
-            # Replace the old serial number with the new one in the matching rule
-            with open(UDEV_RULE_PATH, 'w') as f:
-                for rule in rules:
-                    if existing_symbolic_name in rule and 'SYMLINK+=' in rule:
-                        rule = rule.split('ATTRS{serial}')[0] + f'ATTRS{{serial}}=="{new_port}", SYMLINK+="{existing_symbolic_name}"\n'
-                        replaced = True
-                    f.write(rule)
+    serial_number = selected_port.split("Serial: ")[1].split(" | ")[0]  # Extract serial number
+
+    def ask(existing_symbolic_name):
+        if not existing_symbolic_name:
+            messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+            return
         
-        if replaced:
-            reload_udev_rules()
-            messagebox.showinfo("Success", f"Symbolic name '{existing_symbolic_name}' now maps to serial {new_port}.")
-            refresh_ports()
-        else:
-            messagebox.showerror("Error", f"Failed to replace the serial for '{existing_symbolic_name}'.")
+        new_port_serial = simpledialog.askstring("Replace Serial", f"Enter the new port's serial number to map to '{existing_symbolic_name}':")
+        
+        if new_port_serial:
+            def done(_):
+                messagebox.showinfo("Success", f"Symbolic name '{existing_symbolic_name}' now maps to serial {new_port_serial}.")
+                refresh_ports()
+
+            port_tasks.run(
+                "replace", udev_helper.apply_changes,
+                [{"op": "replace_serial", "name": existing_symbolic_name, "serial": new_port_serial}],
+                on_done=done, on_error=show_udev_error, button=replace_button, busy_text="Replacing..."
+            )
+
+    port_tasks.run("replace", get_symbolic_name_by_serial, serial_number, on_done=ask, button=replace_button, busy_text="Replacing...")
 
 # Function to rename a symbolic name for an existing serial number
 def rename_symbolic_name():
     selected_port = dropdown.get()
-    serial_number = selected_port.split("Serial: ")[1].split(")")[0]  # Extract serial number
-    existing_symbolic_name = get_symbolic_name_by_serial(serial_number)
-    
-    if not existing_symbolic_name:
-        messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+    if not selected_port:
+        messagebox.showerror("Error", "Please select a port.")
         return
-    
-    new_symbolic_name = simpledialog.askstring("Rename Symbolic Name", f"Enter the new symbolic name for serial {serial_number}:")
-    
-    if new_symbolic_name and existing_symbolic_name:
-        renamed = False
-        if os.path.exists(UDEV_RULE_PATH):
-            with open(UDEV_RULE_PATH, 'r') as f:
-                rules = f.readlines()
-            
-            # Rename the symbolic name in the matching rule
-            with open(UDEV_RULE_PATH, 'w') as f:
-                for rule in rules:
-                    if existing_symbolic_name in rule and 'SYMLINK+=' in rule:
-                        rule = rule.replace(f'SYMLINK+="{existing_symbolic_name}"', f'SYMLINK+="{new_symbolic_name}"')
-                        renamed = True
-                    f.write(rule)
+    serial_number = selected_port.split("Serial: ")[1].split(" | ")[0]  # Extract serial number
+
+    def ask(existing_symbolic_name):
+        if not existing_symbolic_name:
+            messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+            return
         
-        if renamed:
-            reload_udev_rules()
-            messagebox.showinfo("Success", f"Symbolic name '{existing_symbolic_name}' renamed to '{new_symbolic_name}'.")
-            refresh_ports()
-        else:
-            messagebox.showerror("Error", f"Failed to rename '{existing_symbolic_name}'.")
+        new_symbolic_name = simpledialog.askstring("Rename Symbolic Name", f"Enter the new symbolic name for serial {serial_number}:")
+        
+        if new_symbolic_name:
+            def done(_):
+                messagebox.showinfo("Success", f"Symbolic name '{existing_symbolic_name}' renamed to '{new_symbolic_name}'.")
+                refresh_ports()
+
+            port_tasks.run(
+                "rename", udev_helper.apply_changes, [{"op": "rename", "old": existing_symbolic_name, "new": new_symbolic_name}],
+                on_done=done, on_error=show_udev_error, button=rename_button, busy_text="Renaming..."
+            )
+
+    port_tasks.run("rename", get_symbolic_name_by_serial, serial_number, on_done=ask, button=rename_button, busy_text="Renaming...")
 
 # Function to delete a symbolic name rule
 def delete_symbolic_name():
     selected_port = dropdown.get()
-    serial_number = selected_port.split("Serial: ")[1].split(")")[0]  # Extract serial number
-    symbolic_name = get_symbolic_name_by_serial(serial_number)
-    
-    if not symbolic_name:
-        messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+    if not selected_port:
+        messagebox.showerror("Error", "Please select a port.")
         return
-    
-    deleted = False
-    if os.path.exists(UDEV_RULE_PATH):
-        with open(UDEV_RULE_PATH, 'r') as f:
-            rules = f.readlines()
-        
-        # Remove the matching rule from the file
-        with open(UDEV_RULE_PATH, 'w') as f:
-            for rule in rules:
-                if symbolic_name not in rule:
-                    f.write(rule)
-                else:
-                    deleted = True
-    
-    if deleted:
-        reload_udev_rules()
+    serial_number = selected_port.split("Serial: ")[1].split(" | ")[0]  # Extract serial number
+
+    def task():
+        symbolic_name = get_symbolic_name_by_serial(serial_number)
+        if symbolic_name:
+            udev_helper.apply_changes([{"op": "delete", "name": symbolic_name}])
+        return symbolic_name
+
+    def done(symbolic_name):
+        if not symbolic_name:
+            messagebox.showerror("Error", f"No symbolic name found for the port with serial {serial_number}.")
+            return
         messagebox.showinfo("Success", f"Symbolic name '{symbolic_name}' has been deleted.")
         refresh_ports()
+
+    port_tasks.run("delete", task, on_done=done, on_error=show_udev_error, button=delete_button, busy_text="Deleting...")
+
+# Function to report a failed udev edit (runs on the Tk thread)
+def show_udev_error(error):
+    if isinstance(error, udev_helper.UdevRuleError):
+        messagebox.showerror("Error", str(error))
     else:
-        messagebox.showerror("Error", f"Symbolic name '{symbolic_name}' not found.")
-
-# Function to reload udev rules
-def reload_udev_rules():
-    try:
-        subprocess.run(['sudo', 'udevadm', 'control', '--reload-rules'], check=True)
-        subprocess.run(['sudo', 'udevadm', 'trigger'], check=True)
-        messagebox.showinfo("Success", "Udev rules reloaded successfully!")
-    except subprocess.CalledProcessError as e:
-        messagebox.showerror("Error", f"Failed to reload udev rules: {e}")
-
-# Function to refresh the list of ports
+        messagebox.showerror("Error", f"Failed to update udev rules: {error}")
+
+# Function to refresh the list of ports; the scan runs in the background and a click during one queues another
 def refresh_ports():
-    available_ports = get_serial_ports()
+    port_tasks.run("refresh", get_serial_ports, on_done=show_ports, button=refresh_button, busy_text="Refreshing...", rerun_if_busy=True)
+
+# Function to show a port scan in the dropdown
+def show_ports(available_ports):
     dropdown['values'] = available_ports
     if available_ports:
         dropdown.current(0)
@@ -195,29 +181,46 @@ frame.pack(pady=20, padx=20, fill=tk.BOTH, expand=True)
 # Label for dropdown
 ttk.Label(frame, text="Select a Serial Port:", font=("Helvetica", 12)).pack(pady=5)
 
-# Dropdown for available serial ports
-available_ports = get_serial_ports()
+# Dropdown for available serial ports, filled in by the first background scan
 selected_port = tk.StringVar()
 
-dropdown = ttk.Combobox(frame, textvariable=selected_port, values=available_ports, state="readonly", font=("Helvetica", 10))
+dropdown = ttk.Combobox(frame, textvariable=selected_port, values=[], state="readonly", font=("Helvetica", 10))
 dropdown.pack(pady=10, fill=tk.X)
-if available_ports:
-    dropdown.current(0)
-else:
-    dropdown.set("No available ports found")
+dropdown.set("Scanning ports...")
 
 # Buttons for actions
 button_frame = ttk.Frame(frame)
 button_frame.pack(pady=20)
 
-ttk.Button(button_frame, text="Onboard Selected Port", command=lambda: onboard_port(selected_port.get()), style="Accent.TButton", width=30).pack(pady=5)
-ttk.Button(button_frame, text="Replace Serial in Symbolic Name", command=replace_serial_in_symbolic_name, style="Accent.TButton", width=30).pack(pady=5)
-ttk.Button(button_frame, text="Rename Symbolic Name", command=rename_symbolic_name, style="Accent.TButton", width=30).pack(pady=5)
-ttk.Button(button_frame, text="Delete Symbolic Name", command=delete_symbolic_name, style="Accent.TButton", width=30).pack(pady=5)
-ttk.Button(button_frame, text="Refresh Port List", command=refresh_ports, style="Accent.TButton", width=30).pack(pady=5)
+onboard_button = ttk.Button(button_frame, text="Onboard Selected Port", command=lambda: onboard_port(selected_port.get()), style="Accent.TButton", width=30)
+onboard_button.pack(pady=5)
+replace_button = ttk.Button(button_frame, text="Replace Serial in Symbolic Name", command=replace_serial_in_symbolic_name, style="Accent.TButton", width=30)
+replace_button.pack(pady=5)
+rename_button = ttk.Button(button_frame, text="Rename Symbolic Name", command=rename_symbolic_name, style="Accent.TButton", width=30)
+rename_button.pack(pady=5)
+delete_button = ttk.Button(button_frame, text="Delete Symbolic Name", command=delete_symbolic_name, style="Accent.TButton", width=30)
+delete_button.pack(pady=5)
+refresh_button = ttk.Button(button_frame, text="Refresh Port List", command=refresh_ports, style="Accent.TButton", width=30)
+refresh_button.pack(pady=5)
 
 # Add padding and styling
 for child in frame.winfo_children():
     child.pack_configure(padx=10, pady=5)
 
+# Port-manager operations (udev edits, port scans) run on this pool so the window never waits on udev
+port_tasks = ui_tasks.UiTaskRunner(root)
+refresh_ports()
+
+# Log stalls of the Tk event loop, with the main thread's stack, when DOGNOSIS_UI_WATCHDOG=1
+if ui_watchdog.enabled():
+    ui_stall_watchdog = ui_watchdog.StallWatchdog(root)
+    ui_stall_watchdog.start()
+
+    def on_root_close():
+        ui_stall_watchdog.stop()
+        ui_stall_watchdog.write_summary()
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", on_root_close)
+
 root.mainloop()
\ No newline at end of file
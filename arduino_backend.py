@@ -0,0 +1,292 @@
+import concurrent.futures
+import os
+import socket
+import subprocess
+import threading
+
+import job_runner
+
+# gRPC stubs generated from arduino-cli's rpc/ protos (python -m grpc_tools.protoc ... rpc/cc/arduino/cli/commands/v1/*.proto)
+try:
+    import grpc
+    from cc.arduino.cli.commands.v1 import commands_pb2, commands_pb2_grpc, compile_pb2, port_pb2, upload_pb2
+except ImportError:
+    grpc = None
+
+DAEMON_START_TIMEOUT = 15  # Seconds to wait for the daemon to accept gRPC connections
+
+
+class ArduinoCliCancelled(Exception):
+    pass
+
+
+class ArduinoCliError(Exception):
+    pass
+
+
+class DaemonUnavailable(ArduinoCliError):
+    pass
+
+
+# Function to join a base FQBN and its board options the way arduino-cli expects them in one string
+def fqbn_with_options(fqbn, board_options=None):
+    if not board_options:
+        return fqbn
+    if isinstance(board_options, dict):
+        board_options = ",".join(f"{key}={value}" for key, value in board_options.items())
+    return f"{fqbn}:{board_options}"
+
+
+# Class running one arduino-cli process per compile or upload (the original behaviour, kept as the fallback)
+class CliBackend:
+    name = "process"
+
+    def __init__(self, cli_path):
+        self.cli_path = cli_path
+        self._future = None
+        self._lock = threading.Lock()
+
+    # Function to run arduino-cli on the job runner's event loop, reading stdout and stderr as they arrive
+    def _run(self, args, on_line):
+        with self._lock:
+            self._future = job_runner.submit(job_runner.run_process([self.cli_path] + args, on_line))
+            try:
+                return self._future.result()
+            except concurrent.futures.CancelledError:
+                raise ArduinoCliCancelled("arduino-cli job cancelled.")
+            finally:
+                self._future = None
+
+    def compile(self, sketch_path, fqbn, board_options=None, build_path=None, build_properties=(), jobs=0,
+                on_line=None, on_percent=None):
+        args = ["compile", "--fqbn", fqbn]
+        if board_options:
+            args += ["--board-options", board_options]
+        if build_path:
+            args += ["--build-path", build_path]
+        for prop in build_properties:
+            args += ["--build-property", prop]
+        if jobs:
+            args += ["--jobs", str(jobs)]
+        args += ["--verbose", sketch_path]
+        return self._run(args, on_line)
+
+    def upload(self, port, sketch_path, fqbn, board_options=None, input_dir=None, on_line=None, on_percent=None):
+        args = ["upload", "-p", port, "--fqbn", fqbn]
+        if board_options:
+            args += ["--board-options", board_options]
+        if input_dir:
+            args += ["--input-dir", input_dir]
+        args += [sketch_path, "--verbose"]
+        return self._run(args, on_line)
+
+    def cancel(self):
+        # Cancelling the task kills arduino-cli's whole process group, including esptool and the compilers
+        future = self._future
+        if future is not None:
+            future.cancel()
+
+    def close(self):
+        self.cancel()
+
+
+# Class keeping one `arduino-cli daemon` running with an initialised instance, driven over gRPC
+class DaemonBackend:
+    name = "daemon"
+
+    def __init__(self, cli_path):
+        self.cli_path = cli_path
+        self._daemon = None
+        self._channel = None
+        self._stub = None
+        self._instance = None
+        self._call = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def _free_port(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    # Function to start the daemon and load the package and library indexes once
+    def start(self):
+        if self._daemon is not None and self._daemon.poll() is None:
+            return
+        self.close()
+        port = self._free_port()
+        try:
+            self._daemon = subprocess.Popen(
+                [self.cli_path, "daemon", "--port", str(port), "--format", "json"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+            )
+        except OSError as e:
+            raise DaemonUnavailable(f"arduino-cli daemon could not be started: {e}")
+        self._channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+        try:
+            grpc.channel_ready_future(self._channel).result(timeout=DAEMON_START_TIMEOUT)
+        except grpc.FutureTimeoutError:
+            self.close()
+            raise DaemonUnavailable("arduino-cli daemon did not start.")
+        self._stub = commands_pb2_grpc.ArduinoCoreServiceStub(self._channel)
+        try:
+            self._instance = self._stub.Create(commands_pb2.CreateRequest()).instance
+            for response in self._stub.Init(commands_pb2.InitRequest(instance=self._instance)):
+                if response.HasField("error") and response.error.code:
+                    raise DaemonUnavailable(f"arduino-cli init failed: {response.error.message}")
+        except grpc.RpcError as e:
+            self.close()
+            raise DaemonUnavailable(f"arduino-cli daemon did not initialise: {e.details() or e}")
+        except DaemonUnavailable:
+            self.close()
+            raise
+
+    # Function to run one streaming call, splitting its output into lines for the console
+    def _stream(self, call, on_line, on_percent):
+        self._call = call
+        pending = {"out": "", "err": ""}
+
+        def feed(key, data):
+            text = pending[key] + data.decode("utf-8", errors="replace")
+            *lines, pending[key] = text.split("\n")
+            for line in lines:
+                if on_line:
+                    on_line(line)
+
+        try:
+            for response in call:
+                if response.out_stream:
+                    feed("out", response.out_stream)
+                if response.err_stream:
+                    feed("err", response.err_stream)
+                if on_percent and response.HasField("progress") and response.progress.percent:
+                    on_percent(response.progress.percent)
+            status = 0
+        except grpc.RpcError as e:
+            if self._cancelled or e.code() == grpc.StatusCode.CANCELLED:
+                raise ArduinoCliCancelled("arduino-cli job cancelled.")
+            if e.code() == grpc.StatusCode.UNAVAILABLE:
+                raise DaemonUnavailable(f"arduino-cli daemon went away: {e.details() or e}")
+            if on_line:
+                on_line(e.details() or str(e))
+            status = 1
+        finally:
+            self._call = None
+        for key in pending:
+            if pending[key] and on_line:
+                on_line(pending[key])
+        return status
+
+    # Function to run a job on the daemon, or on a fresh process back end if the daemon can't be (re)started or dies
+    def _with_fallback(self, job, *args, on_line=None, **kwargs):
+        try:
+            return getattr(self, f"_{job}")(*args, on_line=on_line, **kwargs)
+        except DaemonUnavailable as e:
+            if on_line:
+                on_line(f"{e} Falling back to one arduino-cli process per job.")
+            return getattr(_fall_back_from(self), job)(*args, on_line=on_line, **kwargs)
+
+    def compile(self, *args, **kwargs):
+        return self._with_fallback("compile", *args, **kwargs)
+
+    def upload(self, *args, **kwargs):
+        return self._with_fallback("upload", *args, **kwargs)
+
+    def _compile(self, sketch_path, fqbn, board_options=None, build_path=None, build_properties=(), jobs=0,
+                 on_line=None, on_percent=None):
+        with self._lock:
+            self.start()
+            self._cancelled = False
+            request = compile_pb2.CompileRequest(
+                instance=self._instance,
+                fqbn=fqbn_with_options(fqbn, board_options),
+                sketch_path=os.path.dirname(os.path.abspath(sketch_path)),
+                build_path=build_path or "",
+                build_properties=list(build_properties),
+                jobs=jobs,
+                verbose=True,
+            )
+            return self._stream(self._stub.Compile(request), on_line, on_percent)
+
+    def _upload(self, port, sketch_path, fqbn, board_options=None, input_dir=None, on_line=None, on_percent=None):
+        with self._lock:
+            self.start()
+            self._cancelled = False
+            request = upload_pb2.UploadRequest(
+                instance=self._instance,
+                fqbn=fqbn_with_options(fqbn, board_options),
+                sketch_path=os.path.dirname(os.path.abspath(sketch_path)),
+                port=port_pb2.Port(address=port, protocol="serial"),
+                import_dir=input_dir or "",
+                verbose=True,
+            )
+            return self._stream(self._stub.Upload(request), on_line, on_percent)
+
+    def cancel(self):
+        call = self._call
+        if call is not None:
+            self._cancelled = True
+            call.cancel()
+
+    def close(self):
+        self.cancel()
+        if self._channel is not None:
+            self._channel.close()
+        if self._daemon is not None and self._daemon.poll() is None:
+            self._daemon.terminate()
+            try:
+                self._daemon.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._daemon.kill()
+        self._daemon = None
+        self._channel = None
+        self._stub = None
+        self._instance = None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# Function to get the shared back end: the daemon when gRPC stubs are installed and it starts, else one process per job
+def get_backend(cli_path, use_daemon=True):
+    global _backend
+    with _backend_lock:
+        if _backend is not None and _backend.cli_path == cli_path:
+            return _backend
+        backend = None
+        if use_daemon and grpc is not None:
+            backend = DaemonBackend(cli_path)
+            try:
+                backend.start()
+            except ArduinoCliError:
+                backend.close()
+                backend = None
+        _backend = backend or CliBackend(cli_path)
+        return _backend
+
+
+# Function to swap a daemon that can no longer be used for the process back end, for this job and the ones after it
+def _fall_back_from(daemon):
+    global _backend
+    with _backend_lock:
+        daemon.close()
+        if _backend is daemon:
+            _backend = CliBackend(daemon.cli_path)
+        return _backend if isinstance(_backend, CliBackend) else CliBackend(daemon.cli_path)
+
+
+# Function to cancel whatever job the shared back end is running, without starting one
+def cancel_active():
+    backend = _backend
+    if backend is not None:
+        backend.cancel()
+
+
+# Function to stop the daemon (if any) when the application exits
+def shutdown_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+        _backend = None
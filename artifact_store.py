@@ -0,0 +1,255 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+import zlib
+
+# Firmware images keyed by SHA-256: <sha[:2]>/<sha>/ holds image.bin, image.zlib and meta.json
+STORE_DIR = os.path.expanduser("~/.dognosis/artifacts")
+# (path, size, mtime) -> SHA-256 of files already ingested, so re-flashing a file needn't re-hash it
+PATH_INDEX_NAME = "paths.json"
+
+BLOCK_SIZE = 0x10000     # Per-block MD5s cover one 64 KiB flash erase block each
+COMPRESS_LEVEL = 9       # Same level esptool compresses with
+
+ESP_IMAGE_MAGIC = 0xE9
+IMAGE_HEADER = struct.Struct("<BBBBI")
+EXTENDED_HEADER = struct.Struct("<B3sHBHH4sB")
+SEGMENT_HEADER = struct.Struct("<II")
+MAX_SEGMENTS = 16
+FLASH_MODE_NAMES = {0: "qio", 1: "qout", 2: "dio", 3: "dout"}
+# Chip IDs from the extended image header
+CHIP_IDS = {0: "esp32", 2: "esp32s2", 5: "esp32c3", 9: "esp32s3", 12: "esp32c2", 13: "esp32c6", 16: "esp32h2",
+            18: "esp32p4"}
+
+_lock = threading.Lock()
+_artifacts = {}
+
+
+# Function to parse an ESP app/bootloader image header; None for anything else (partition tables, data)
+def parse_image_header(data):
+    if len(data) < IMAGE_HEADER.size + EXTENDED_HEADER.size or data[0] != ESP_IMAGE_MAGIC:
+        return None
+    _, segment_count, flash_mode, size_freq, entry = IMAGE_HEADER.unpack_from(data, 0)
+    _, _, chip_id, _, min_rev, max_rev, _, hash_appended = EXTENDED_HEADER.unpack_from(data, IMAGE_HEADER.size)
+    if segment_count > MAX_SEGMENTS:
+        return None
+    segments = []
+    offset = IMAGE_HEADER.size + EXTENDED_HEADER.size
+    for _ in range(segment_count):
+        if offset + SEGMENT_HEADER.size > len(data):
+            return None
+        load_address, length = SEGMENT_HEADER.unpack_from(data, offset)
+        offset += SEGMENT_HEADER.size + length
+        if offset > len(data):
+            return None
+        segments.append({"load_address": load_address, "length": length})
+    return {
+        "chip": CHIP_IDS.get(chip_id),
+        "chip_id": chip_id,
+        "entry": entry,
+        "flash_mode": FLASH_MODE_NAMES.get(flash_mode, flash_mode),
+        "flash_size_code": size_freq >> 4,
+        "flash_freq_code": size_freq & 0x0F,
+        "min_chip_revision": min_rev,
+        "max_chip_revision": max_rev,
+        "hash_appended": hash_appended == 1,
+        "segments": segments,
+    }
+
+
+def _object_dir(sha256, store_dir):
+    return os.path.join(store_dir, sha256[:2], sha256)
+
+
+# Function to map a stored file read-only; empty files can't be mapped, so they come back as an empty view
+def _map(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Class describing one stored image; the bytes themselves are only mapped when a flash job asks for them
+class Artifact:
+    def __init__(self, sha256, meta, directory):
+        self.sha256 = sha256
+        self.meta = meta
+        self.directory = directory
+
+    @property
+    def size(self):
+        return self.meta["size"]
+
+    @property
+    def md5(self):
+        return self.meta["md5"]
+
+    @property
+    def block_md5s(self):
+        return self.meta["block_md5s"]
+
+    @property
+    def header(self):
+        return self.meta["header"]
+
+    @property
+    def compressed_size(self):
+        return self.meta["compressed_size"]
+
+    def data(self):
+        return _map(os.path.join(self.directory, "image.bin"))
+
+    def compressed(self):
+        return _map(os.path.join(self.directory, "image.zlib"))
+
+    # Function to read the variants derived from this image, e.g. with patched flash parameters
+    def _derived(self):
+        try:
+            with open(os.path.join(self.directory, "derived.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _add_derived(self, key, sha256):
+        derived = self._derived()
+        derived[key] = sha256
+        path = os.path.join(self.directory, "derived.json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(derived, f)
+        os.replace(tmp_path, path)
+
+
+# Function to work out everything a flash job needs from an image: hashes, header and compressed stream
+def describe(data):
+    with memoryview(data) as view:
+        return {
+            "size": len(view),
+            "md5": hashlib.md5(view).hexdigest(),
+            "block_md5s": [hashlib.md5(view[i:i + BLOCK_SIZE]).hexdigest() for i in range(0, len(view), BLOCK_SIZE)],
+            "block_size": BLOCK_SIZE,
+            "header": parse_image_header(view),
+        }
+
+
+# Function to store an image's bytes once; returns the Artifact, whether or not it was already stored
+def ingest_bytes(data, store_dir=STORE_DIR, sha256=None):
+    sha256 = sha256 or hashlib.sha256(data).hexdigest()
+    artifact = open_artifact(sha256, store_dir)
+    if artifact is not None:
+        return artifact
+
+    directory = _object_dir(sha256, store_dir)
+    tmp_dir = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        meta = describe(data)
+        compressed = zlib.compress(data, COMPRESS_LEVEL)
+        meta["compressed_size"] = len(compressed)
+        meta["sha256"] = sha256
+        with open(os.path.join(tmp_dir, "image.bin"), "wb") as f:
+            f.write(data)
+        with open(os.path.join(tmp_dir, "image.zlib"), "wb") as f:
+            f.write(compressed)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # Another job stored the same image first; its copy is identical
+            if not os.path.exists(os.path.join(directory, "meta.json")):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return open_artifact(sha256, store_dir)
+
+
+def _read_path_index(store_dir):
+    try:
+        with open(os.path.join(store_dir, PATH_INDEX_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_path_index(store_dir, index):
+    path = os.path.join(store_dir, PATH_INDEX_NAME)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+# Function to ingest a file; a file whose size and mtime haven't changed since last time isn't even read
+def ingest_file(path, store_dir=STORE_DIR):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    with _lock:
+        entry = _read_path_index(store_dir).get(path)
+    if entry and entry[:2] == stamp:
+        artifact = open_artifact(entry[2], store_dir)
+        if artifact is not None:
+            return artifact
+
+    with _map(path) as data:
+        artifact = ingest_bytes(data, store_dir)
+    with _lock:
+        index = _read_path_index(store_dir)
+        index[path] = stamp + [artifact.sha256]
+        _write_path_index(store_dir, index)
+    return artifact
+
+
+# Function to look up a stored image by SHA-256; None if the store doesn't have it
+def open_artifact(sha256, store_dir=STORE_DIR):
+    with _lock:
+        if (store_dir, sha256) in _artifacts:
+            return _artifacts[(store_dir, sha256)]
+    directory = _object_dir(sha256, store_dir)
+    try:
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    artifact = Artifact(sha256, meta, directory)
+    with _lock:
+        _artifacts[(store_dir, sha256)] = artifact
+    return artifact
+
+
+# Function to get the variant of an image that transform(data) produces, computing and storing it only once
+# per key; a transform that leaves the bytes alone maps back to the image itself
+def derive(artifact, key, transform, store_dir=STORE_DIR):
+    sha256 = artifact._derived().get(key)
+    if sha256:
+        derived = open_artifact(sha256, store_dir)
+        if derived is not None:
+            return derived
+    with artifact.data() as data, memoryview(data) as view:
+        result = transform(data)
+        derived = artifact if view == result else ingest_bytes(result, store_dir)
+    artifact._add_derived(key, derived.sha256)
+    return derived
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python artifact_store.py <image.bin>...")
+        sys.exit(2)
+    for image_path in sys.argv[1:]:
+        stored = ingest_file(image_path)
+        header = stored.header
+        print(f"{image_path}: {stored.sha256}")
+        print(f"  {stored.size} bytes, {stored.compressed_size} compressed, md5 {stored.md5}, "
+              f"{len(stored.block_md5s)} blocks of {BLOCK_SIZE // 1024} KiB")
+        if header:
+            print(f"  {header['chip'] or 'chip id ' + str(header['chip_id'])} image, entry 0x{header['entry']:08x}, "
+                  f"{header['flash_mode']}, {len(header['segments'])} segments")
+            for segment in header["segments"]:
+                print(f"    0x{segment['load_address']:08x}  {segment['length']} bytes")
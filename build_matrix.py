@@ -0,0 +1,319 @@
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import arduino_backend
+import nvs_partition
+import tracing
+
+ARDUINO_CLI_PATH = "arduino-cli"  # Ensure arduino-cli is in your system's PATH
+
+# Profile used when a matrix file does not list any boards (the board the uploader always targeted)
+DEFAULT_PROFILES = {
+    "esp32doit-devkit-v1": {"fqbn": "esp32:esp32:esp32doit-devkit-v1", "board_options": "UploadSpeed=115200"},
+}
+DEFAULT_VARIANTS = {"default": []}
+DEFAULT_OUTPUT_DIR = "builds"
+MANIFEST_NAME = "manifest.json"
+PERSONALIZED_DIR = "personalized"  # Under the output dir: each device's generated NVS image
+
+# Where each artifact of an ESP32 Arduino build is written in flash; manifests from before builds recorded
+# their chip and layout were all for the ESP32
+ARTIFACT_OFFSETS = {
+    "bootloader": 0x1000,
+    "partitions": 0x8000,
+    "boot_app0": 0xE000,
+    "app": 0x10000,
+}
+# Second-stage bootloader offset of each chip the ESP32 core builds for, when the board doesn't say
+BOOTLOADER_OFFSETS = {
+    "esp32": 0x1000,
+    "esp32s2": 0x1000,
+    "esp32s3": 0x0,
+    "esp32c2": 0x0,
+    "esp32c3": 0x0,
+    "esp32c5": 0x2000,
+    "esp32c6": 0x0,
+    "esp32h2": 0x0,
+    "esp32p4": 0x2000,
+}
+FLASH_ORDER = ("bootloader", "partitions", "boot_app0", "app")
+PARTITION_TYPE_APP = 0x00
+PROPERTIES_TIMEOUT = 120  # Seconds for arduino-cli to resolve a board's properties
+
+# Build properties the ESP32 core leaves empty for user flags, so -D variants do not clobber core defines
+EXTRA_FLAG_PROPERTIES = ("compiler.c.extra_flags", "compiler.cpp.extra_flags")
+
+
+# Function to load a matrix description, filling in the board the uploader used to hard-code
+def load_matrix(config_path):
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    sketches = [os.path.join(base_dir, sketch) for sketch in config.get("sketches", [])]
+    if not sketches:
+        raise ValueError(f"No sketches listed in {config_path}.")
+    output_dir = os.path.join(base_dir, config.get("output_dir", DEFAULT_OUTPUT_DIR))
+    # Per-device config goes into an NVS partition generated at flash time, so it never needs a rebuild
+    personalization = config.get("personalization")
+    if personalization:
+        if "template" not in personalization or "values" not in personalization:
+            raise ValueError(f"personalization in {config_path} needs a template and a values CSV.")
+        personalization = {
+            "template": os.path.join(base_dir, personalization["template"]),
+            "values": os.path.join(base_dir, personalization["values"]),
+            "partition": personalization.get("partition", "nvs"),
+            "output_dir": os.path.join(output_dir, PERSONALIZED_DIR),
+        }
+    return {
+        "sketches": sketches,
+        "profiles": config.get("profiles") or DEFAULT_PROFILES,
+        "variants": config.get("variants") or DEFAULT_VARIANTS,
+        "devices": config.get("devices", {}),
+        "personalization": personalization,
+        "output_dir": output_dir,
+    }
+
+
+# Function to expand a matrix into one job per sketch, board profile and flag variant
+def expand_jobs(matrix, cli_path=ARDUINO_CLI_PATH):
+    jobs = []
+    for sketch, (profile, board), (variant, flags) in itertools.product(
+        matrix["sketches"], matrix["profiles"].items(), matrix["variants"].items()
+    ):
+        sketch_name = os.path.splitext(os.path.basename(sketch))[0]
+        jobs.append({
+            "cli_path": cli_path,
+            "sketch": sketch,
+            "sketch_name": sketch_name,
+            "profile": profile,
+            "fqbn": board["fqbn"],
+            "board_options": board.get("board_options"),
+            "chip": board.get("chip"),
+            "offsets": board.get("offsets"),
+            "variant": variant,
+            "flags": list(flags),
+            # Every combination gets its own build dir so parallel builds never share object files
+            "build_dir": os.path.join(matrix["output_dir"], sketch_name, profile, variant),
+        })
+    return jobs
+
+
+# Function to find the flashable files arduino-cli left in a build dir; boot_app0.bin, which selects the first
+# OTA slot, comes from the core when the build dir has no copy
+def collect_artifacts(build_dir, sketch_name, properties=None):
+    candidates = {
+        "app": f"{sketch_name}.ino.bin",
+        "bootloader": f"{sketch_name}.ino.bootloader.bin",
+        "partitions": f"{sketch_name}.ino.partitions.bin",
+        "boot_app0": "boot_app0.bin",
+        "elf": f"{sketch_name}.ino.elf",
+    }
+    artifacts = {}
+    for kind, name in candidates.items():
+        path = os.path.join(build_dir, name)
+        if os.path.exists(path):
+            artifacts[kind] = path
+    platform_path = (properties or {}).get("runtime.platform.path")
+    if "boot_app0" not in artifacts and platform_path:
+        path = os.path.join(platform_path, "tools", "partitions", "boot_app0.bin")
+        if os.path.exists(path):
+            artifacts["boot_app0"] = path
+    return artifacts
+
+
+# Function to ask arduino-cli for a board's build properties (build.mcu, build.bootloader_addr, ...) without
+# compiling; empty when it can't tell
+def board_properties(cli_path, sketch, fqbn, board_options=None):
+    try:
+        result = subprocess.run(
+            [cli_path, "compile", "--fqbn", arduino_backend.fqbn_with_options(fqbn, board_options),
+             "--show-properties", sketch],
+            capture_output=True, text=True, timeout=PROPERTIES_TIMEOUT
+        )
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    if result.returncode != 0:
+        return {}
+    properties = {}
+    for line in result.stdout.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            properties[key.strip()] = value.strip()
+    return properties
+
+
+def _address(value):
+    return value if isinstance(value, int) else int(str(value), 0)
+
+
+# Function to work out the chip and where each artifact goes for one build, from the profile's "chip" and
+# "offsets" if it sets them, else from the board's properties and the partition table the build produced;
+# raises ValueError for boards that aren't ESP32s
+def flash_layout(job, artifacts, properties):
+    chip = job.get("chip") or properties.get("build.mcu")
+    if chip not in BOOTLOADER_OFFSETS:
+        raise ValueError(f"{job['fqbn']} is not an ESP32 board (chip {chip or 'unknown'}); if it is one, set "
+                         f"\"chip\" in its profile.")
+    offsets = {
+        "bootloader": _address(properties.get("build.bootloader_addr", BOOTLOADER_OFFSETS[chip])),
+        "partitions": ARTIFACT_OFFSETS["partitions"],
+        "boot_app0": ARTIFACT_OFFSETS["boot_app0"],
+        "app": ARTIFACT_OFFSETS["app"],
+    }
+    if "partitions" in artifacts:
+        # The app goes to the first app partition (factory or ota_0) of the table this build uses
+        with open(artifacts["partitions"], "rb") as f:
+            apps = [p for p in nvs_partition.parse_partition_table(f.read()) if p["type"] == PARTITION_TYPE_APP]
+        if apps:
+            offsets["app"] = min(p["offset"] for p in apps)
+    offsets.update((kind, _address(value)) for kind, value in (job.get("offsets") or {}).items())
+    return chip, offsets
+
+
+# Function run on a pool thread: compile one combination and describe its result
+def build_one(job, jobs_per_build=0):
+    os.makedirs(job["build_dir"], exist_ok=True)
+    flags = " ".join(job["flags"])
+    properties = [f"{prop}={flags}" for prop in EXTRA_FLAG_PROPERTIES] if flags else []
+    log_path = os.path.join(job["build_dir"], "build.log")
+
+    start = time.monotonic()
+    with open(log_path, "w") as log:
+        backend = arduino_backend.CliBackend(job["cli_path"])
+        try:
+            returncode = backend.compile(
+                job["sketch"], job["fqbn"], job["board_options"],
+                build_path=job["build_dir"], build_properties=properties, jobs=jobs_per_build,
+                on_line=lambda line: log.write(line + "\n"),
+            )
+        except OSError as e:
+            log.write(f"Error starting arduino-cli: {e}\n")
+            returncode = -1
+
+    entry = {key: job[key] for key in ("sketch", "profile", "fqbn", "board_options", "variant", "flags", "build_dir")}
+    entry["ok"] = returncode == 0
+    entry["duration"] = round(time.monotonic() - start, 2)
+    entry["log"] = log_path
+    entry["artifacts"] = {}
+    if entry["ok"]:
+        properties = board_properties(job["cli_path"], job["sketch"], job["fqbn"], job["board_options"])
+        entry["artifacts"] = collect_artifacts(job["build_dir"], job["sketch_name"], properties)
+        try:
+            entry["chip"], entry["offsets"] = flash_layout(job, entry["artifacts"], properties)
+        except (OSError, ValueError) as e:
+            with open(log_path, "a") as log:
+                log.write(f"Not flashable: {e}\n")
+            entry["ok"] = False
+            entry["artifacts"] = {}
+    if "app" in entry["artifacts"]:
+        with open(entry["artifacts"]["app"], "rb") as f:
+            entry["app_sha256"] = hashlib.sha256(f.read()).hexdigest()
+    return entry
+
+
+# Function to compile every combination in parallel and write the artifact manifest
+def run_matrix(matrix, cli_path=ARDUINO_CLI_PATH, max_workers=None, on_result=None):
+    jobs = expand_jobs(matrix, cli_path)
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(max_workers or cpus, len(jobs)))
+    # Split the cores between concurrent builds instead of letting each one claim all of them
+    jobs_per_build = max(1, cpus // workers)
+
+    entries = []
+    # Each build is an arduino-cli process of its own, so threads only wait on them; no process is forked from the
+    # multithreaded GUI and nothing re-runs the script that imported us
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="build") as pool:
+        futures = [pool.submit(build_one, job, jobs_per_build) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            if on_result:
+                on_result(entry, len(entries), len(jobs))
+
+    entries.sort(key=lambda e: (e["sketch"], e["profile"], e["variant"]))
+    manifest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "builds": entries,
+        "devices": matrix["devices"],
+        "personalization": matrix.get("personalization"),
+    }
+    os.makedirs(matrix["output_dir"], exist_ok=True)
+    manifest_path = os.path.join(matrix["output_dir"], MANIFEST_NAME)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_path, manifest
+
+
+# Function to load a manifest written by run_matrix
+def load_manifest(manifest_path):
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+# Function to pick the build for a device by symbolic name or serial, falling back to the only build present
+def artifact_for_device(manifest, symbolic_name=None, serial_number=None, sketch=None):
+    builds = [b for b in manifest["builds"] if b["ok"] and "app" in b["artifacts"]]
+    if sketch:
+        builds = [b for b in builds if os.path.splitext(os.path.basename(b["sketch"]))[0] == sketch]
+
+    devices = manifest.get("devices", {})
+    wanted = devices.get(symbolic_name) or devices.get(serial_number)
+    if wanted:
+        for build in builds:
+            if build["profile"] == wanted.get("profile") and build["variant"] == wanted.get("variant", "default"):
+                return build
+        return None
+    return builds[0] if len(builds) == 1 else None
+
+
+# Function to list the (address, path) pairs to flash for one build, at the offsets recorded for its chip
+def flash_images(build):
+    offsets = {kind: int(address) for kind, address in (build.get("offsets") or ARTIFACT_OFFSETS).items()}
+    return [
+        (offsets[kind], build["artifacts"][kind])
+        for kind in FLASH_ORDER
+        if kind in build["artifacts"] and kind in offsets
+    ]
+
+
+# Function to get the chip a build is for, to flash it with the matching esptool target
+def flash_chip(build):
+    return build.get("chip") or "esp32"
+
+
+# Function to list what to flash to one device: the build's shared images plus, when the manifest personalizes
+# devices, the NVS image generated from the device's row of the values CSV (NvsError if it has none)
+def device_images(manifest, build, symbolic_name=None, serial_number=None):
+    images = flash_images(build)
+    personalization = manifest.get("personalization")
+    if not personalization:
+        return images
+    with tracing.span("personalize", "flash", serial_number=serial_number, symbolic_name=symbolic_name):
+        image = nvs_partition.device_image(
+            personalization["template"], personalization["values"], personalization["output_dir"],
+            symbolic_name, serial_number, build["artifacts"].get("partitions"), personalization["partition"]
+        )
+    if image is None:
+        raise nvs_partition.NvsError(f"{os.path.basename(personalization['values'])} has no row for "
+                                     f"{symbolic_name or serial_number}.")
+    return sorted(images + [image])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python build_matrix.py <matrix.json>")
+        sys.exit(2)
+
+    def print_result(entry, done, total):
+        status = "ok" if entry["ok"] else f"FAILED (see {entry['log']})"
+        print(f"[{done}/{total}] {entry['sketch']} {entry['profile']}/{entry['variant']}: {status} in {entry['duration']}s")
+
+    path, manifest = run_matrix(load_matrix(sys.argv[1]), on_result=print_result)
+    print(f"Manifest written to {path}")
+    sys.exit(0 if all(b["ok"] for b in manifest["builds"]) else 1)
@@ -0,0 +1,283 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+# File layout: MAGIC, varint header length, JSON header, then records until the footer:
+#   data      varint(delta_us << 1), varint(length), bytes
+#   keyframe  varint(delta_us << 1 | 1), varint(time_us), varint(stream offset)
+# Keyframes let a reader start anywhere; on close a footer lists them all, followed by TRAILER
+MAGIC = b"DGCAP\x01"
+TRAILER = struct.Struct("<Q8s")
+TRAILER_MAGIC = b"DGCAPIDX"
+KEYFRAME_INTERVAL_US = 1_000_000  # A keyframe at least every second of capture...
+KEYFRAME_INTERVAL_BYTES = 64 * 1024  # ...or every 64 KiB of file, whichever comes first
+WRITE_BUFFER = 256 * 1024
+
+SPEEDS = {"1x": 1.0, "2x": 2.0, "4x": 4.0, "10x": 10.0, "max": 0.0}
+REPLAY_BATCH_BYTES = 64 * 1024  # Chunks joined per delivery when a GUI replays as fast as possible
+
+
+class CaptureError(Exception):
+    pass
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+# Function to decode one varint at pos; returns (value, position after it)
+def decode_varint(buf, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise IndexError("Truncated varint.")
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+# Class appending timestamped chunks to a capture file; safe to call from the port's reader thread
+class CaptureWriter:
+    def __init__(self, path, **header):
+        self.path = path
+        self._file = open(path, "wb", buffering=WRITE_BUFFER)
+        header = dict(header, started=time.time())
+        encoded = json.dumps(header).encode()
+        self._file.write(MAGIC + encode_varint(len(encoded)) + encoded)
+        self._offset = len(MAGIC) + len(encode_varint(len(encoded))) + len(encoded)
+        self._start_ns = time.monotonic_ns()
+        self._last_us = 0
+        self._stream = 0
+        self._keyframes = []
+        self._last_key_us = None
+        self._last_key_offset = 0
+        self._lock = threading.Lock()
+        self.chunks = 0
+
+    def _put(self, data):
+        self._file.write(data)
+        self._offset += len(data)
+
+    # Function to append one chunk, stamped with when it arrived (now unless given, in monotonic ns)
+    def write(self, data, when_ns=None):
+        now_us = ((when_ns or time.monotonic_ns()) - self._start_ns) // 1000
+        with self._lock:
+            if self._file is None:
+                return
+            now_us = max(now_us, self._last_us)
+            if (self._last_key_us is None or now_us - self._last_key_us >= KEYFRAME_INTERVAL_US
+                    or self._offset - self._last_key_offset >= KEYFRAME_INTERVAL_BYTES):
+                self._keyframes.append((now_us, self._offset, self._stream))
+                self._put(encode_varint(((now_us - self._last_us) << 1) | 1) + encode_varint(now_us)
+                          + encode_varint(self._stream))
+                self._last_key_us = now_us
+                self._last_key_offset = self._offset
+                self._last_us = now_us
+            self._put(encode_varint((now_us - self._last_us) << 1) + encode_varint(len(data)))
+            self._put(data)
+            self._last_us = now_us
+            self._stream += len(data)
+            self.chunks += 1
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    # Function to write the keyframe index and close; a file that was never closed is still readable
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            footer_offset = self._offset
+            footer = bytearray(encode_varint(len(self._keyframes)))
+            for entry in self._keyframes:
+                for value in entry:
+                    footer += encode_varint(value)
+            self._file.write(bytes(footer) + TRAILER.pack(footer_offset, TRAILER_MAGIC))
+            self._file.close()
+            self._file = None
+
+
+# Class recording everything a serial broker's port receives, stamped as it arrives on the reader thread
+class CaptureRecorder:
+    def __init__(self, broker, path):
+        self.path = path
+        self.writer = CaptureWriter(path, port=broker.port, baud=broker.baudrate)
+        self.subscription = broker.subscribe(self.writer.write)
+
+    def stop(self):
+        self.subscription.close()
+        self.writer.close()
+
+
+# Class reading a capture through a memory map; seeks go to the nearest keyframe before the time
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC) or f.read(len(MAGIC)) != MAGIC:
+                raise CaptureError(f"{path} is not a capture file.")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        length, pos = decode_varint(self._map, len(MAGIC))
+        self.header = json.loads(self._map[pos:pos + length])
+        self._records_start = pos + length
+        self._records_end = len(self._map)
+        self.keyframes = self._read_footer()
+        if self.keyframes is None:
+            # Not closed cleanly: find the keyframes by walking the records once
+            self.keyframes = [(t, offset, stream) for t, offset, stream, _ in self._walk(self._records_start)
+                              if offset is not None]
+
+    def _read_footer(self):
+        if len(self._map) - self._records_start < TRAILER.size:
+            return None
+        footer_offset, magic = TRAILER.unpack_from(self._map, len(self._map) - TRAILER.size)
+        if magic != TRAILER_MAGIC or not self._records_start <= footer_offset <= len(self._map) - TRAILER.size:
+            return None
+        count, pos = decode_varint(self._map, footer_offset)
+        keyframes = []
+        for _ in range(count):
+            t, pos = decode_varint(self._map, pos)
+            offset, pos = decode_varint(self._map, pos)
+            stream, pos = decode_varint(self._map, pos)
+            keyframes.append((t, offset, stream))
+        self._records_end = footer_offset
+        return keyframes
+
+    # Function to walk the records from a file offset: yields (time_us, keyframe offset or None, stream
+    # offset, data or None); a record cut short by a crash ends the walk
+    def _walk(self, pos, t=0, stream=0):
+        buf = self._map
+        end = self._records_end
+        try:
+            while pos < end:
+                record_start = pos
+                tag, pos = decode_varint(buf, pos)
+                t += tag >> 1
+                if tag & 1:
+                    t, pos = decode_varint(buf, pos)
+                    stream, pos = decode_varint(buf, pos)
+                    yield t, record_start, stream, None
+                    continue
+                length, pos = decode_varint(buf, pos)
+                if pos + length > end:
+                    return
+                yield t, None, stream, buf[pos:pos + length]
+                pos += length
+                stream += length
+        except IndexError:
+            return
+
+    # Function to yield (time_us, data) for every chunk from start_us on
+    def chunks(self, start_us=0):
+        pos = self._records_start
+        for t, offset, _ in self.keyframes:
+            # Keyframes can share a time (a burst, or stamps clamped at 0); only one strictly before start_us
+            # is sure to have nothing from start_us on behind it
+            if t >= start_us:
+                break
+            pos = offset
+        for t, _, _, data in self._walk(pos):
+            if data is not None and t >= start_us:
+                yield t, data
+
+    @property
+    def duration_us(self):
+        last = self.keyframes[-1][0] if self.keyframes else 0
+        for t, _ in self.chunks(last):
+            last = t
+        return last
+
+    def close(self):
+        self._map.close()
+
+
+# Function to feed a capture's chunks to deliver(data) with their original spacing divided by speed
+# (speed 0 = as fast as possible, where batch_bytes joins small chunks so a GUI isn't called per chunk);
+# returns (bytes, chunks, seconds taken)
+def replay(path, deliver, speed=1.0, start_us=0, cancel_event=None, batch_bytes=0):
+    reader = CaptureReader(path)
+    total = chunks = 0
+    pending = []
+    pending_size = 0
+    started = time.perf_counter()
+    try:
+        first = None
+        for t, data in reader.chunks(start_us):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            total += len(data)
+            chunks += 1
+            if speed:
+                first = t if first is None else first
+                delay = (t - first) / 1e6 / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            elif batch_bytes:
+                pending.append(data)
+                pending_size += len(data)
+                if pending_size < batch_bytes:
+                    continue
+                data = b"".join(pending)
+                pending, pending_size = [], 0
+            deliver(data)
+        if pending:
+            deliver(b"".join(pending))
+    finally:
+        reader.close()
+    return total, chunks, time.perf_counter() - started
+
+
+# Function to run a capture through a decoder pipeline as fast as possible, to benchmark the monitor's decoding
+def benchmark_decoding(path, framing="newline", schema=None):
+    import serial_decoders
+
+    pipeline = serial_decoders.DecoderPipeline(framing, schema)
+    total, chunks, seconds = replay(path, pipeline.feed, speed=0)
+    return {"bytes": total, "chunks": chunks, "seconds": seconds, "frames": pipeline.frames,
+            "errors": pipeline.errors, "bytes_per_sec": total / seconds if seconds else 0.0}
+
+
+USAGE = """Usage:
+  python capture_file.py info <capture>
+  python capture_file.py dump <capture> [start seconds]
+  python capture_file.py bench <capture> [framing] [schema]"""
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ("info", "dump", "bench"):
+        print(USAGE)
+        sys.exit(2)
+    try:
+        if args[0] == "info":
+            capture = CaptureReader(args[1])
+            data_bytes = sum(len(data) for _, data in capture.chunks())
+            print(json.dumps(capture.header))
+            print(f"{capture.duration_us / 1e6:.3f} s, {data_bytes} bytes of serial data in "
+                  f"{os.path.getsize(args[1])} bytes of file, {len(capture.keyframes)} keyframes")
+        elif args[0] == "dump":
+            start = int(float(args[2]) * 1e6) if len(args) > 2 else 0
+            replay(args[1], lambda data: sys.stdout.buffer.write(data), speed=0, start_us=start)
+        else:
+            result = benchmark_decoding(args[1], args[2] if len(args) > 2 else "newline",
+                                        args[3] if len(args) > 3 else None)
+            print(f"{result['bytes']} bytes in {result['chunks']} chunks decoded in {result['seconds']:.3f} s "
+                  f"({result['bytes_per_sec'] / 1e6:.1f} MB/s), {result['frames']} frames, {result['errors']} errors")
+    except (OSError, CaptureError, ValueError) as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,215 @@
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import select
+import struct
+import threading
+import time
+
+import arduino_backend
+
+DEBOUNCE_SECONDS = 0.75   # Quiet time after the last change before a background compile starts
+STAMP_NAME = "compile_ahead.json"
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+def _ignored(name):
+    # Hidden files, editor swap/backup files and build output don't change what gets compiled
+    return name.startswith(".") or name.endswith(("~", ".swp", ".swx", ".tmp")) or name == "build"
+
+
+# Class wrapping Linux inotify through ctypes, watching whole directory trees
+class Inotify:
+    def __init__(self):
+        global _libc
+        if _libc is None:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = _libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+
+    def add_tree(self, root):
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not _ignored(d)]
+            wd = _libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Cannot watch {dirpath}")
+            self._dirs[wd] = dirpath
+
+    # Function to wait up to timeout seconds for changes; returns the changed paths (None = events were lost)
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed.append(None)
+                continue
+            name = os.fsdecode(name)
+            if wd not in self._dirs or not name or _ignored(name):
+                continue
+            path = os.path.join(self._dirs[wd], name)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Function to fingerprint the sources a build depends on: every file's path, size and mtime, plus the board
+def source_fingerprint(dirs, fqbn, board_options):
+    digest = hashlib.sha256(f"{fqbn}|{board_options}\n".encode())
+    for root in dirs:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not _ignored(d))
+            for name in sorted(filenames):
+                if _ignored(name):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                digest.update(f"{path}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def read_stamp(build_path):
+    try:
+        with open(os.path.join(build_path, STAMP_NAME), "r") as f:
+            return json.load(f).get("fingerprint")
+    except (OSError, ValueError):
+        return None
+
+
+# Function to record which sources the artifacts in build_path were compiled from
+def write_stamp(build_path, fingerprint):
+    path = os.path.join(build_path, STAMP_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"fingerprint": fingerprint, "built": time.time()}, f)
+    os.replace(path + ".tmp", path)
+
+
+# Class compiling a sketch in the background whenever its folder or the library folders change
+class CompileAhead:
+    def __init__(self, cli_path, sketch_path, fqbn, board_options, build_path, library_dirs=(), on_status=None):
+        self.sketch_path = sketch_path
+        self.fqbn = fqbn
+        self.board_options = board_options
+        self.build_path = build_path
+        self.dirs = [os.path.dirname(os.path.abspath(sketch_path))] + [d for d in library_dirs if os.path.isdir(d)]
+        self.on_status = on_status
+        # A backend of its own, so cancelling a background build never touches a foreground job
+        self.backend = arduino_backend.CliBackend(cli_path)
+        self._inotify = Inotify()
+        for root in self.dirs:
+            self._inotify.add_tree(root)
+        self._cond = threading.Condition()
+        self._changed_at = 0.0     # Sources changed and no build has started since (0 = nothing pending)
+        self._building = None      # Fingerprint the running build started from
+        self._held = 0
+        self._stopped = False
+        threading.Thread(target=self._watch, name="compile-ahead", daemon=True).start()
+
+    def _status(self, message):
+        if self.on_status:
+            self.on_status(message)
+
+    def fingerprint(self):
+        return source_fingerprint(self.dirs, self.fqbn, self.board_options)
+
+    def is_fresh(self):
+        return read_stamp(self.build_path) == self.fingerprint()
+
+    def _watch(self):
+        with self._cond:
+            if not self.is_fresh():
+                self._changed_at = time.monotonic() - DEBOUNCE_SECONDS
+        while True:
+            with self._cond:
+                if self._stopped:
+                    break
+                timeout = None
+                if self._changed_at:
+                    timeout = max(0.0, self._changed_at + DEBOUNCE_SECONDS - time.monotonic())
+                    if timeout == 0 and self._building is None and not self._held:
+                        self._changed_at = 0.0
+                        self._building = self.fingerprint()
+                        threading.Thread(target=self._build, args=(self._building,), daemon=True).start()
+                        timeout = None
+            try:
+                changed = self._inotify.read(0.5 if timeout is None else min(timeout, 0.5))
+            except OSError:
+                break
+            if changed:
+                with self._cond:
+                    self._changed_at = time.monotonic()
+                    if self._building is not None:
+                        # Sources moved on mid-build: stop it, the debounce starts a fresh one
+                        self.backend.cancel()
+        self._inotify.close()
+
+    def _build(self, fingerprint):
+        self._status(f"Compiling {os.path.basename(self.sketch_path)} ahead...")
+        started = time.monotonic()
+        os.makedirs(self.build_path, exist_ok=True)
+        try:
+            returncode = self.backend.compile(self.sketch_path, self.fqbn, self.board_options, build_path=self.build_path)
+            if returncode == 0 and self.fingerprint() == fingerprint:
+                write_stamp(self.build_path, fingerprint)
+                self._status(f"Compiled ahead in {time.monotonic() - started:.1f}s.")
+            elif returncode != 0:
+                self._status("Background compile failed; Compile and Upload will show the errors.")
+        except arduino_backend.ArduinoCliCancelled:
+            self._status("Sources changed, restarting the background compile.")
+        except Exception as e:
+            self._status(f"Background compile error: {e}")
+        finally:
+            with self._cond:
+                self._building = None
+                self._cond.notify_all()
+
+    # Function for a foreground compile/upload to take over the build folder: waits for a build of the
+    # current sources to finish, cancels a stale one, and keeps new ones from starting until release()
+    def hold(self):
+        with self._cond:
+            self._held += 1
+            if self._building is not None and self._building != self.fingerprint():
+                self.backend.cancel()
+            while self._building is not None:
+                self._cond.wait()
+
+    def release(self):
+        with self._cond:
+            self._held -= 1
+            self._cond.notify_all()
+
+    def cancel_build(self):
+        self.backend.cancel()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+        self.backend.cancel()
@@ -0,0 +1,288 @@
+import glob
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+
+import numpy as np
+
+# Decoded symbol indexes, one .npz per ELF keyed by the ELF's SHA-256
+SYMBOL_CACHE_DIR = os.path.expanduser("~/.dognosis/symbols")
+# Toolchains installed by arduino-cli; the host's binutils work too since only DWARF is read
+TOOLCHAIN_BIN_GLOB = os.path.expanduser("~/.arduino15/packages/esp32/tools/*/*/bin")
+TOOL_TIMEOUT = 120
+
+STT_FUNC = 2
+SHT_SYMTAB = 2
+
+# How many lines after a panic, abort or watchdog banner count as part of the dump
+DUMP_LINES = 60
+
+DUMP_START_PATTERN = re.compile(
+    r"Guru Meditation Error|abort\(\) was called|task_wdt:|Task watchdog got triggered|assert failed:"
+    r"|Stack smashing protect failure|Interrupt wdt timeout"
+)
+DUMP_END_PATTERN = re.compile(r"^Rebooting\.\.\.|^ELF file SHA256:")
+ELF_SHA_PATTERN = re.compile(r"^ELF file SHA256:\s*([0-9a-fA-F]+)")
+BACKTRACE_PATTERN = re.compile(r"(0x[0-9a-fA-F]{8}):0x[0-9a-fA-F]{8}")
+# Register dump lines whose value is a code address: Xtensa PC, RISC-V MEPC/RA, and the abort() caller
+CODE_ADDRESS_PATTERN = re.compile(r"(?:\bPC\s*:|\bMEPC\s*:|\bRA\s*:|called at PC)\s*(0x[0-9a-fA-F]{8})")
+
+
+# Function to find a binutils tool, preferring the one shipped with the ESP32 toolchain
+def _find_tool(name):
+    for path in sorted(glob.glob(os.path.join(TOOLCHAIN_BIN_GLOB, f"*-{name}")), reverse=True):
+        if os.access(path, os.X_OK):
+            return path
+    return shutil.which(name)
+
+
+# Function to read the function symbols from a 32-bit ELF's symbol table in one pass
+def read_function_symbols(data):
+    if data[:4] != b"\x7fELF" or data[4] != 1:
+        raise ValueError("Not a 32-bit ELF file.")
+    endian = "<" if data[5] == 1 else ">"
+    header = np.frombuffer(data, dtype=np.dtype([
+        ("ident", "V16"), ("type", "u2"), ("machine", "u2"), ("version", "u4"), ("entry", "u4"),
+        ("phoff", "u4"), ("shoff", "u4"), ("flags", "u4"), ("ehsize", "u2"), ("phentsize", "u2"),
+        ("phnum", "u2"), ("shentsize", "u2"), ("shnum", "u2"), ("shstrndx", "u2"),
+    ]).newbyteorder(endian), count=1)[0]
+    section_dtype = np.dtype([
+        ("name", "u4"), ("type", "u4"), ("flags", "u4"), ("addr", "u4"), ("offset", "u4"),
+        ("size", "u4"), ("link", "u4"), ("info", "u4"), ("addralign", "u4"), ("entsize", "u4"),
+    ]).newbyteorder(endian)
+    sections = np.frombuffer(data, dtype=section_dtype, count=int(header["shnum"]), offset=int(header["shoff"]))
+    symtabs = sections[sections["type"] == SHT_SYMTAB]
+    if not len(symtabs):
+        raise ValueError("ELF file has no symbol table.")
+    symtab = symtabs[0]
+    strtab = sections[symtab["link"]]
+
+    symbol_dtype = np.dtype([
+        ("name", "u4"), ("value", "u4"), ("size", "u4"), ("info", "u1"), ("other", "u1"), ("shndx", "u2"),
+    ]).newbyteorder(endian)
+    symbols = np.frombuffer(data, dtype=symbol_dtype, count=int(symtab["size"]) // symbol_dtype.itemsize,
+                            offset=int(symtab["offset"]))
+    symbols = symbols[((symbols["info"] & 0xF) == STT_FUNC) & (symbols["shndx"] != 0) & (symbols["value"] != 0)]
+    strings = data[int(strtab["offset"]):int(strtab["offset"]) + int(strtab["size"])]
+    names = [strings[n:strings.index(b"\0", n)].decode("utf-8", errors="replace") for n in symbols["name"].tolist()]
+    return symbols["value"].astype(np.uint32), symbols["size"].astype(np.uint32), names
+
+
+# Function to demangle C++ names with one c++filt process for the whole list
+def demangle(names):
+    tool = _find_tool("c++filt")
+    if not tool:
+        return names
+    try:
+        result = subprocess.run([tool], input="\n".join(names), capture_output=True, text=True,
+                                timeout=TOOL_TIMEOUT, check=True)
+    except (OSError, subprocess.SubprocessError):
+        return names
+    demangled = result.stdout.split("\n")
+    return demangled[:len(names)] if len(demangled) >= len(names) else names
+
+
+# Function to read the decoded DWARF line table with one readelf run: (address, file, line) rows
+def read_line_table(elf_path):
+    tool = _find_tool("readelf")
+    if not tool:
+        return []
+    try:
+        result = subprocess.run([tool, "--debug-dump=decodedline", elf_path], capture_output=True, text=True,
+                                timeout=TOOL_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return []
+    rows = []
+    current = ""
+    row_pattern = re.compile(r"^(\S+)\s+(\d+|-)\s+(0x[0-9a-fA-F]+)")
+    for text in result.stdout.splitlines():
+        # readelf names the full path once ("CU: path:" or "path:") and then only the base name on each row
+        if text.endswith(":") and " " not in text.strip()[:-1].replace("CU: ", "", 1):
+            current = text.strip()[:-1].replace("CU: ", "", 1)
+            continue
+        match = row_pattern.match(text)
+        if not match:
+            continue
+        name, line, address = match.groups()
+        path = current if os.path.basename(current) == name else name
+        # End-of-sequence rows carry no line; keep them so addresses past a sequence don't borrow its last line
+        rows.append((int(address, 16), path, 0 if line == "-" else int(line)))
+    return rows
+
+
+# Class answering address -> function, file and line lookups with binary searches over sorted arrays
+class SymbolIndex:
+    def __init__(self, sha256, sym_addrs, sym_sizes, sym_names, line_addrs, line_files, line_numbers, files):
+        self.sha256 = sha256
+        self.sym_addrs = sym_addrs
+        self.sym_sizes = sym_sizes
+        self.sym_names = sym_names
+        self.line_addrs = line_addrs
+        self.line_files = line_files
+        self.line_numbers = line_numbers
+        self.files = files
+
+    @classmethod
+    def build(cls, elf_path, data, sha256):
+        addrs, sizes, names = read_function_symbols(data)
+        order = np.argsort(addrs, kind="stable")
+        names = np.array(demangle([names[i] for i in order]) or [""], dtype=str)[:len(order)]
+        rows = sorted(read_line_table(elf_path))
+        files = sorted({path for _, path, _ in rows})
+        file_index = {path: i for i, path in enumerate(files)}
+        return cls(
+            sha256, addrs[order], sizes[order], names,
+            np.array([row[0] for row in rows], dtype=np.uint32),
+            np.array([file_index[row[1]] for row in rows], dtype=np.int32),
+            np.array([row[2] for row in rows], dtype=np.int32),
+            np.array(files or [""], dtype=str),
+        )
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, sha256=np.array(self.sha256), sym_addrs=self.sym_addrs, sym_sizes=self.sym_sizes,
+                 sym_names=self.sym_names, line_addrs=self.line_addrs, line_files=self.line_files,
+                 line_numbers=self.line_numbers, files=self.files)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data["sha256"]), data["sym_addrs"], data["sym_sizes"], data["sym_names"],
+                       data["line_addrs"], data["line_files"], data["line_numbers"], data["files"])
+
+    # Function to look up many addresses at once; returns (function, file, line) per address, None when unknown
+    def lookup(self, addresses):
+        addresses = np.asarray(addresses, dtype=np.uint32)
+        sym = np.searchsorted(self.sym_addrs, addresses, side="right") - 1
+        line = np.searchsorted(self.line_addrs, addresses, side="right") - 1
+        results = []
+        for address, s, l in zip(addresses.tolist(), sym.tolist(), line.tolist()):
+            in_function = s >= 0 and (address < int(self.sym_addrs[s]) + max(int(self.sym_sizes[s]), 1))
+            function = str(self.sym_names[s]) if in_function else None
+            source = None
+            if l >= 0 and self.line_numbers[l] > 0 and (not in_function or self.line_addrs[l] >= self.sym_addrs[s]):
+                source = (str(self.files[self.line_files[l]]), int(self.line_numbers[l]))
+            results.append((function, source))
+        return results
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+# Function to get the symbol index of an ELF, building it once and caching it in memory and on disk
+def load_index(elf_path):
+    with open(elf_path, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    with _indexes_lock:
+        if sha256 in _indexes:
+            return _indexes[sha256]
+    cache_path = os.path.join(SYMBOL_CACHE_DIR, f"{sha256}.npz")
+    try:
+        index = SymbolIndex.load(cache_path)
+    except (OSError, ValueError, KeyError):
+        index = SymbolIndex.build(elf_path, data, sha256)
+        os.makedirs(SYMBOL_CACHE_DIR, exist_ok=True)
+        index.save(cache_path)
+    with _indexes_lock:
+        _indexes[sha256] = index
+    return index
+
+
+# Class spotting crash dumps in monitor lines and adding the decoded frames right after them; frames of a dump
+# that arrives before the symbol index is ready are passed to on_late_lines once it is
+class CrashDecoder:
+    def __init__(self, elf_path, on_late_lines=None):
+        self.elf_path = elf_path
+        self.on_late_lines = on_late_lines
+        self.index = None
+        self.error = None
+        self._dump_lines = 0
+        self._pending = []  # (addresses, ELF SHA prefix or None) seen while the index was loading
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        threading.Thread(target=self._load, name="symbol-index", daemon=True).start()
+
+    def _load(self):
+        try:
+            self.index = load_index(self.elf_path)
+        except (OSError, ValueError) as e:
+            self.error = f"Cannot decode crashes with {os.path.basename(self.elf_path)}: {e}"
+        finally:
+            with self._lock:
+                self._ready.set()
+                pending, self._pending = self._pending, []
+        lines = []
+        # The ELF SHA line ends a dump, but its warning belongs before the frames
+        for addresses, sha in sorted(pending, key=lambda entry: entry[1] is None):
+            lines.extend(self._decode(addresses, sha))
+        if lines and self.on_late_lines:
+            self.on_late_lines(["Decoded frames of the crash above:"] + lines)
+
+    def _describe(self, addresses):
+        lines = []
+        for address, (function, source) in zip(addresses, self.index.lookup([int(a, 16) for a in addresses])):
+            where = f"{function or '??'}"
+            if source:
+                where += f" at {source[0]}:{source[1]}"
+            lines.append(f"  {address}: {where}")
+        return lines
+
+    # Function to decode one line's addresses once the index is ready, warning if the board runs another ELF
+    def _decode(self, addresses, sha):
+        if self.index is None:
+            error, self.error = self.error, None
+            return [error] if error else []
+        lines = []
+        if sha and not self.index.sha256.startswith(sha):
+            lines.append(f"  Warning: the board runs a different ELF than {os.path.basename(self.elf_path)}; "
+                         "decoded frames may be wrong.")
+        return lines + self._describe(addresses)
+
+    # Function to return the lines with decoded frames inserted after every backtrace or code address in a dump;
+    # runs on the port's reader thread, so it never waits for the index
+    def annotate(self, lines):
+        out = []
+        for line in lines:
+            out.append(line)
+            if DUMP_START_PATTERN.search(line):
+                self._dump_lines = DUMP_LINES
+            backtrace = "Backtrace:" in line
+            if not backtrace and self._dump_lines <= 0:
+                continue
+            self._dump_lines -= 1
+            sha_match = ELF_SHA_PATTERN.match(line)
+            if DUMP_END_PATTERN.match(line):
+                self._dump_lines = 0
+            addresses = BACKTRACE_PATTERN.findall(line) if backtrace else CODE_ADDRESS_PATTERN.findall(line)
+            if not addresses and not sha_match:
+                continue
+            sha = sha_match.group(1).lower() if sha_match else None
+            with self._lock:
+                if not self._ready.is_set():
+                    self._pending.append((addresses, sha))
+                    if addresses:
+                        out.append("  (decoding pending)")
+                    continue
+            out.extend(self._decode(addresses, sha))
+        return out
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python crash_decoder.py <firmware.elf> <address or backtrace line>...")
+        sys.exit(2)
+    decoder = CrashDecoder(sys.argv[1])
+    line = " ".join(sys.argv[2:])
+    decoder._ready.wait()
+    if decoder.index is None:
+        print(decoder.error)
+        sys.exit(1)
+    addresses = BACKTRACE_PATTERN.findall(line) or re.findall(r"0x[0-9a-fA-F]+", line)
+    print("\n".join(decoder._describe(addresses)))
@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+import time
+
+# Fingerprints of devices seen by the flasher, keyed by USB serial number
+FINGERPRINT_CACHE_PATH = os.path.expanduser("~/.dognosis/fingerprints.json")
+
+# Fields that make up a fingerprint; the flasher fills them in after a full detection
+FINGERPRINT_FIELDS = ("chip", "description", "revision", "mac", "flash_size", "flash_mode", "flash_freq", "reset_sequence")
+
+_lock = threading.Lock()
+_cache = None
+
+
+def _load():
+    global _cache
+    if _cache is None:
+        try:
+            with open(FINGERPRINT_CACHE_PATH, "r") as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _save():
+    os.makedirs(os.path.dirname(FINGERPRINT_CACHE_PATH), exist_ok=True)
+    tmp_path = FINGERPRINT_CACHE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_cache, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, FINGERPRINT_CACHE_PATH)
+
+
+# Function to get the cached fingerprint for a USB serial number, or None if the device is new
+def get_fingerprint(serial_number):
+    with _lock:
+        entry = _load().get(serial_number)
+        return dict(entry) if entry else None
+
+
+# Function to remember what a device answered so later jobs can skip detection
+def store_fingerprint(serial_number, fingerprint):
+    entry = {field: fingerprint.get(field) for field in FINGERPRINT_FIELDS}
+    entry["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with _lock:
+        cache = _load()
+        if {k: v for k, v in cache.get(serial_number, {}).items() if k != "updated"} == \
+                {k: v for k, v in entry.items() if k != "updated"}:
+            return
+        cache[serial_number] = entry
+        _save()
+
+
+# Function to drop a fingerprint, e.g. after the board behind a serial number was swapped
+def invalidate_fingerprint(serial_number):
+    with _lock:
+        cache = _load()
+        if cache.pop(serial_number, None) is not None:
+            _save()
@@ -0,0 +1,215 @@
+import contextlib
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+# Inventory of every device and every flash, keyed by USB serial number
+INVENTORY_DB_PATH = os.path.expanduser("~/.dognosis/inventory.sqlite3")
+
+# Name of this flashing station in the flash history
+STATION = socket.gethostname()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    serial_number TEXT PRIMARY KEY,
+    symbolic_name TEXT,
+    chip TEXT,
+    mac TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS devices_symbolic_name ON devices (symbolic_name);
+CREATE TABLE IF NOT EXISTS flashes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    serial_number TEXT NOT NULL REFERENCES devices (serial_number),
+    symbolic_name TEXT,
+    image_sha256 TEXT,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    baud INTEGER,
+    result TEXT NOT NULL,
+    station TEXT NOT NULL,
+    port TEXT
+);
+CREATE INDEX IF NOT EXISTS flashes_serial_number ON flashes (serial_number, started);
+CREATE TABLE IF NOT EXISTS link_benchmarks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    serial_number TEXT NOT NULL REFERENCES devices (serial_number),
+    started REAL NOT NULL,
+    port TEXT,
+    baud INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    bytes_per_sec REAL NOT NULL,
+    error_rate REAL NOT NULL,
+    rtt_p50_ms REAL,
+    rtt_p95_ms REAL,
+    rtt_p99_ms REAL,
+    station TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS link_benchmarks_serial_number ON link_benchmarks (serial_number, started);
+CREATE TABLE IF NOT EXISTS test_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    serial_number TEXT NOT NULL REFERENCES devices (serial_number),
+    script TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    result TEXT NOT NULL,
+    failed_step INTEGER,
+    reason TEXT,
+    metrics TEXT,
+    station TEXT NOT NULL,
+    port TEXT
+);
+CREATE INDEX IF NOT EXISTS test_runs_serial_number ON test_runs (serial_number, started);
+"""
+
+_lock = threading.Lock()
+_initialised = False
+
+
+# Function to open the inventory for one transaction, creating its tables on first use; the block commits (or
+# rolls back) and the connection is closed, so no file handle outlives the call
+@contextlib.contextmanager
+def _connect():
+    global _initialised
+    os.makedirs(os.path.dirname(INVENTORY_DB_PATH), exist_ok=True)
+    db = sqlite3.connect(INVENTORY_DB_PATH, timeout=10)
+    try:
+        db.row_factory = sqlite3.Row
+        if not _initialised:
+            # WAL lets the GUI read history while a flash job is writing to it
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            _initialised = True
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+# Function to hash a list of (address, image bytes) into one identifier for the history
+def image_set_hash(images):
+    return image_set_digest([(address, hashlib.sha256(image).hexdigest()) for address, image in images])
+
+
+# Function to combine (address, image SHA-256) pairs into the same identifier without the image bytes
+def image_set_digest(digests):
+    if len(digests) == 1:
+        return digests[0][1]
+    digest = hashlib.sha256()
+    for address, sha256 in sorted(digests):
+        digest.update(f"{address:08x}:{sha256}\n".encode())
+    return digest.hexdigest()
+
+
+# Function to add a device or refresh what we know about it; None leaves a field unchanged
+def update_device(serial_number, symbolic_name=None, chip=None, mac=None):
+    now = time.time()
+    with _lock, _connect() as db:
+        db.execute(
+            "INSERT INTO devices (serial_number, symbolic_name, chip, mac, first_seen, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (serial_number) DO UPDATE SET "
+            "symbolic_name = COALESCE(excluded.symbolic_name, symbolic_name), "
+            "chip = COALESCE(excluded.chip, chip), "
+            "mac = COALESCE(excluded.mac, mac), "
+            "last_seen = excluded.last_seen",
+            (serial_number, symbolic_name, chip, mac, now, now)
+        )
+
+
+# Function to set or clear the symbolic name recorded for a device
+def set_symbolic_name(serial_number, symbolic_name):
+    update_device(serial_number)
+    with _lock, _connect() as db:
+        db.execute("UPDATE devices SET symbolic_name = ? WHERE serial_number = ?", (symbolic_name, serial_number))
+
+
+# Function to append one flash attempt to a device's history
+def record_flash(serial_number, image_sha256, started, duration, baud, result, port=None, symbolic_name=None):
+    update_device(serial_number, symbolic_name=symbolic_name)
+    with _lock, _connect() as db:
+        if symbolic_name is None:
+            row = db.execute("SELECT symbolic_name FROM devices WHERE serial_number = ?", (serial_number,)).fetchone()
+            symbolic_name = row["symbolic_name"] if row else None
+        db.execute(
+            "INSERT INTO flashes (serial_number, symbolic_name, image_sha256, started, duration, baud, result, station, port) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (serial_number, symbolic_name, image_sha256, started, round(duration, 3), baud, result, STATION, port)
+        )
+
+
+# Function to look up a device by serial number or symbolic name
+def find_device(key):
+    with _lock, _connect() as db:
+        row = db.execute(
+            "SELECT * FROM devices WHERE serial_number = ? OR symbolic_name = ? ORDER BY last_seen DESC",
+            (key, key)
+        ).fetchone()
+        return dict(row) if row else None
+
+
+# Function to list the most recent flashes of a device, newest first
+def flash_history(serial_number, limit=20):
+    with _lock, _connect() as db:
+        rows = db.execute(
+            "SELECT * FROM flashes WHERE serial_number = ? ORDER BY started DESC LIMIT ?",
+            (serial_number, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+# Function to store one run of the link benchmark (one row per baud rate and chunk size)
+def record_link_benchmark(serial_number, started, port, results):
+    update_device(serial_number)
+    with _lock, _connect() as db:
+        db.executemany(
+            "INSERT INTO link_benchmarks (serial_number, started, port, baud, chunk_size, bytes_per_sec, error_rate, "
+            "rtt_p50_ms, rtt_p95_ms, rtt_p99_ms, station) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(serial_number, started, port, r["baud"], r["chunk_size"], r["bytes_per_sec"], r["error_rate"],
+              r["rtt_p50_ms"], r["rtt_p95_ms"], r["rtt_p99_ms"], STATION) for r in results]
+        )
+
+
+# Function to get the rows of a device's most recent link benchmark run
+def latest_link_benchmark(serial_number):
+    with _lock, _connect() as db:
+        rows = db.execute(
+            "SELECT * FROM link_benchmarks WHERE serial_number = ? AND started = "
+            "(SELECT MAX(started) FROM link_benchmarks WHERE serial_number = ?) ORDER BY baud, chunk_size",
+            (serial_number, serial_number)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+# Function to append one run of a send/expect test script to a device's history; metrics are stored as JSON
+def record_test_run(serial_number, script, started, duration, result, failed_step=None, reason=None, metrics=None,
+                    port=None):
+    update_device(serial_number)
+    with _lock, _connect() as db:
+        db.execute(
+            "INSERT INTO test_runs (serial_number, script, started, duration, result, failed_step, reason, metrics, "
+            "station, port) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (serial_number, script, started, round(duration, 3), result, failed_step, reason,
+             json.dumps(metrics or {}, sort_keys=True), STATION, port)
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python device_inventory.py <serial number or symbolic name>")
+        sys.exit(2)
+    device = find_device(sys.argv[1])
+    if not device:
+        print(f"No device matches {sys.argv[1]}.")
+        sys.exit(1)
+    print(f"{device['serial_number']} ({device['symbolic_name'] or 'no symbolic name'}) {device['chip'] or ''} {device['mac'] or ''}")
+    for flash in flash_history(device["serial_number"]):
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(flash["started"]))
+        print(f"  {when}  {flash['result']:<9} {flash['duration']:>7.2f}s  {flash['baud'] or '-':>7}  "
+              f"{(flash['image_sha256'] or '-')[:12]}  {flash['station']} {flash['port'] or ''}")
@@ -0,0 +1,717 @@
+import hashlib
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+import artifact_store
+import device_cache
+import device_inventory
+import remote_ports
+import reset_sequences
+import tracing
+
+# Defaults matching the flags the uploader used to pass to esptool.py
+DEFAULT_CHIP = "esp32"
+DEFAULT_BAUD = 115200
+DEFAULT_CONNECT_ATTEMPTS = 7
+FAST_CONNECT_ATTEMPTS = 2  # esptool attempts for a fingerprinted device when no learned reset is left to try
+DEFAULT_CONNECT_MODE = "default_reset"  # esptool's full connect, used once the learned reset sequences fail
+
+FLASH_MODES = {"qio": 0, "qout": 1, "dio": 2, "dout": 3}
+ESP_IMAGE_MAGIC = 0xE9
+
+# Seconds per MB of erase/write, same figure esptool uses for its block timeouts
+ERASE_WRITE_TIMEOUT_PER_MB = 40
+MIN_BLOCK_TIMEOUT = 3
+
+# How long a cancelled job may take to wind down before its worker is killed
+CANCEL_GRACE_SECONDS = 3.0
+
+# Share of the overall progress bar owned by each stage of a flash job
+STAGE_SPANS = {
+    "connect": (0, 15),
+    "erase": (15, 25),
+    "write": (25, 90),
+    "verify": (90, 98),
+    "reset": (98, 100),
+}
+
+# Worker processes start as `python -m esp_flasher --worker`: a fresh interpreter that imports only this module,
+# so they neither inherit the GUI's threads and held locks (as a fork would) nor re-run the GUI script (as
+# multiprocessing's spawn and forkserver do when preparing a child)
+WORKER_FLAG = "--worker"
+CANCEL_SIGNAL = signal.SIGUSR1  # Sent to a worker to stop its job at the next progress check
+
+
+class FlashError(Exception):
+    pass
+
+
+class FlashCancelled(Exception):
+    pass
+
+
+# Function to convert a (stage, done, total) progress report into a 0-100 value
+def overall_percent(stage, done, total):
+    start, end = STAGE_SPANS.get(stage, (0, 100))
+    if total <= 0:
+        return start
+    return int(start + (end - start) * min(done, total) / total)
+
+
+# Function to pad an image to a 4 byte boundary and set its header flash parameters
+def prepare_image(esp, image, address, flash_mode, flash_freq, flash_size):
+    image = bytes(image)
+    if len(image) % 4:
+        image += b"\xff" * (4 - len(image) % 4)
+
+    # Only a bootloader image carries the flash parameters esptool would rewrite
+    if address != esp.BOOTLOADER_FLASH_OFFSET or len(image) < 24 or image[0] != ESP_IMAGE_MAGIC:
+        return image
+
+    header = bytearray(image[:24])
+    if flash_mode != "keep":
+        header[2] = FLASH_MODES[flash_mode]
+    size_freq = header[3]
+    if flash_size != "keep":
+        size_freq = esp.parse_flash_size_arg(flash_size) | (size_freq & 0x0F)
+    if flash_freq != "keep":
+        size_freq = (size_freq & 0xF0) | esp.parse_flash_freq_arg(flash_freq)
+    header[3] = size_freq
+    if bytes(header) == image[:24]:
+        return image
+
+    patched = bytes(header) + image[24:]
+    # Byte 23 flags an appended SHA-256 of the image, which the patch invalidates
+    if header[23] == 1:
+        body = patched[:-32]
+        patched = body + hashlib.sha256(body).digest()
+    return patched
+
+
+# Class holding one live esptool connection inside the worker process
+class _FlashSession:
+    def __init__(self, conn, cancel_event):
+        import esptool
+        import esptool.cmds
+        import esptool.loader
+        import esptool.targets
+        import esptool.util
+
+        self.esptool = esptool
+        self.conn = conn
+        self.cancel_event = cancel_event
+        self.esp = None
+        self.port = None
+        self.flash_size = None
+        self.fingerprint = None
+        self.link_rtt = 0.0
+        self.reset_attempts = []
+        self.connect_started = 0.0
+        self._sync_timeout = getattr(esptool.loader, "SYNC_TIMEOUT", None)
+
+    def send(self, *message):
+        self.conn.send(message)
+
+    def log(self, message):
+        self.send("log", message)
+
+    def progress(self, stage, done, total):
+        self.send("progress", stage, done, total)
+
+    def check_cancel(self):
+        if self.cancel_event.is_set():
+            raise FlashCancelled("Flash job cancelled.")
+
+    # Function to allow for the round trip of a remote (RFC2217) link: every sync and block reply arrives
+    # that much later, and DTR/RTS changes shouldn't wait for the station's acknowledgement on a slow link
+    def _compensate(self, port, link_rtt):
+        self.link_rtt = link_rtt
+        if self._sync_timeout is not None:
+            self.esptool.loader.SYNC_TIMEOUT = self._sync_timeout + 2 * link_rtt
+        return remote_ports.compensated_url(port, link_rtt)
+
+    # Function to open the port and sync with the ROM loader: each learned reset sequence gets one try, then
+    # esptool's own connect_mode gets connect_attempts (none when connect_mode is None, returning None instead)
+    def _open(self, port, chip, candidates, connect_mode, connect_attempts):
+        port = self._compensate(port, self.link_rtt)
+        for candidate in candidates:
+            self.check_cancel()
+            started = time.monotonic()
+            esp = self._try_reset(port, chip, candidate)
+            elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+            self.reset_attempts.append(dict(candidate, ok=esp is not None, ms=elapsed_ms))
+            if esp is not None:
+                self.log(f"In download mode after {elapsed_ms:.0f} ms (reset {reset_sequences.candidate_key(candidate)})")
+                return esp
+        if connect_mode is None:
+            return None
+        if candidates:
+            self.log("Learned reset sequences failed, trying esptool's full connect.")
+        started = time.monotonic()
+        esp = self._esptool_connect(port, chip, connect_mode, connect_attempts)
+        self.reset_attempts.append({"sequence": connect_mode, "ok": True,
+                                    "ms": round((time.monotonic() - started) * 1000, 1)})
+        return esp
+
+    # Function to drive one DTR/RTS sequence ourselves and sync once; None if the chip didn't answer
+    def _try_reset(self, port, chip, candidate):
+        rom_baud = self.esptool.loader.ESPLoader.ESP_ROM_BAUD
+        if chip == "auto":
+            esp = self.esptool.loader.ESPLoader(port, rom_baud)
+        else:
+            esp = self.esptool.targets.CHIP_DEFS[chip](port, rom_baud)
+        try:
+            esp._port.reset_input_buffer()
+            reset_sequences.run(esp._port, candidate)
+            if chip == "auto":
+                # detect_chip takes the already open port, so the chip isn't reset again on the way
+                return self.esptool.cmds.detect_chip(esp._port, rom_baud, "no_reset", connect_attempts=1)
+            esp.connect("no_reset", 1)
+            return esp
+        except self.esptool.util.FatalError:
+            esp._port.close()
+            return None
+        except BaseException:
+            esp._port.close()
+            raise
+
+    def _esptool_connect(self, port, chip, connect_mode, connect_attempts):
+        rom_baud = self.esptool.loader.ESPLoader.ESP_ROM_BAUD
+        if chip == "auto":
+            return self.esptool.cmds.detect_chip(port, rom_baud, connect_mode, connect_attempts=connect_attempts)
+        esp = self.esptool.targets.CHIP_DEFS[chip](port, rom_baud)
+        try:
+            esp.connect(connect_mode, connect_attempts)
+        except BaseException:
+            esp._port.close()
+            raise
+        return esp
+
+    def _read_mac(self, esp):
+        return ":".join(f"{b:02x}" for b in esp.read_mac())
+
+    def _revision(self, esp):
+        if hasattr(esp, "get_major_chip_version"):
+            return f"v{esp.get_major_chip_version()}.{esp.get_minor_chip_version()}"
+        return None
+
+    def connect(self, port, chip=DEFAULT_CHIP, baud=DEFAULT_BAUD, flash_size="detect",
+                connect_mode=DEFAULT_CONNECT_MODE, connect_attempts=DEFAULT_CONNECT_ATTEMPTS, fingerprint=None,
+                link_rtt=0.0, reset_candidates=()):
+        # Reuse the connection and the running stub if nothing changed since the last call
+        if self.esp is not None and self.port == port:
+            return dict(self.fingerprint, port=port, link_rtt_ms=round(self.link_rtt * 1000, 1), connect_ms=0.0,
+                        reset_attempts=[])
+        self.close()
+        self.link_rtt = link_rtt
+        self.reset_attempts = []
+        self.connect_started = time.monotonic()
+        if link_rtt:
+            self.log(f"Remote link, round trip {link_rtt * 1000:.1f} ms")
+
+        self.progress("connect", 0, 3)
+        self.log(f"Connecting to {port}...")
+
+        # A known device only needs its MAC read back to prove it is still the same board
+        if fingerprint:
+            esp = None
+            try:
+                if reset_candidates:
+                    esp = self._open(port, fingerprint["chip"], reset_candidates, None, 0)
+                else:
+                    # Nothing learned to try (all retired, or a new bridge): esptool's reset, briefly
+                    esp = self._open(port, fingerprint["chip"], (), connect_mode, FAST_CONNECT_ATTEMPTS)
+                if esp is None:
+                    raise FlashError("no learned reset sequence worked")
+                if self._read_mac(esp) == fingerprint["mac"]:
+                    self.log(f"Chip is {fingerprint['description']} (cached fingerprint)")
+                    self.progress("connect", 1, 3)
+                    return self._finish_connect(esp, port, baud, dict(fingerprint, cached=True), flash_size)
+                self.log("Device answered differently from its cached fingerprint, detecting again.")
+            except FlashCancelled:
+                raise
+            except Exception as e:
+                self.log(f"Cached connect failed ({e}), detecting again.")
+            if esp is not None:
+                esp._port.close()
+            self.check_cancel()
+            # The learned sequences had their try; what follows is the full connect
+            reset_candidates = ()
+
+        esp = self._open(port, chip, reset_candidates, connect_mode, connect_attempts)
+        try:
+            self.check_cancel()
+            found = {
+                "chip": chip if chip != "auto" else esp.CHIP_NAME.lower().replace("-", ""),
+                "description": esp.get_chip_description(),
+                "revision": self._revision(esp),
+                "mac": self._read_mac(esp),
+                "flash_size": None,
+                "cached": False,
+            }
+        except BaseException:
+            esp._port.close()
+            raise
+        self.log(f"Chip is {found['description']}")
+        self.progress("connect", 1, 3)
+        return self._finish_connect(esp, port, baud, found, flash_size)
+
+    # Function to name the reset that got the chip into download mode in the last connect
+    def _reset_used(self):
+        attempt = self.reset_attempts[-1] if self.reset_attempts else {}
+        if attempt.get("sequence") in reset_sequences.SEQUENCES:
+            return reset_sequences.candidate_key(attempt)
+        return attempt.get("sequence")
+
+    # Function to load the stub, raise the baud rate and settle the flash size for a synced chip
+    def _finish_connect(self, esp, port, baud, fingerprint, flash_size):
+        try:
+            esp = esp.run_stub()
+            if baud > esp.ESP_ROM_BAUD:
+                esp.change_baud(baud)
+            self.check_cancel()
+            self.progress("connect", 2, 3)
+
+            if flash_size == "detect" and fingerprint.get("flash_size"):
+                flash_size = fingerprint["flash_size"]
+            elif flash_size == "detect":
+                flash_id = esp.flash_id()
+                flash_size = self.esptool.cmds.DETECTED_FLASH_SIZES.get((flash_id >> 16) & 0xFF)
+                if flash_size is None:
+                    raise FlashError(f"Could not detect flash size (flash ID 0x{flash_id:06x}).")
+                self.log(f"Auto-detected flash size: {flash_size}")
+            esp.flash_set_parameters(self.esptool.util.flash_size_bytes(flash_size))
+        except BaseException:
+            esp._port.close()
+            raise
+
+        fingerprint["flash_size"] = flash_size
+        fingerprint["reset_sequence"] = self._reset_used()
+        self.esp = esp
+        self.port = port
+        self.flash_size = flash_size
+        self.fingerprint = fingerprint
+        self.progress("connect", 3, 3)
+        connect_ms = round((time.monotonic() - self.connect_started) * 1000, 1)
+        self.log(f"Connected in {connect_ms:.0f} ms")
+        return dict(fingerprint, port=port, link_rtt_ms=round(self.link_rtt * 1000, 1), connect_ms=connect_ms,
+                    reset_attempts=self.reset_attempts)
+
+    def erase(self, address=None, size=None):
+        self.progress("erase", 0, 1)
+        if address is None:
+            self.log("Erasing flash (this may take a while)...")
+            self.esp.erase_flash()
+        else:
+            self.log(f"Erasing region 0x{address:08x}-0x{address + size - 1:08x}...")
+            self.esp.erase_region(address, size)
+        self.progress("erase", 1, 1)
+
+    # Function to get the stored image as it will be written: padded and, for a bootloader, with the job's
+    # flash parameters; each distinct variant is prepared, hashed and compressed only once
+    def _flash_artifact(self, sha256, address, flash_mode, flash_freq, flash_size):
+        esp = self.esp
+        if flash_size == "detect":
+            flash_size = self.flash_size
+        artifact = artifact_store.open_artifact(sha256)
+        if artifact is None:
+            raise FlashError(f"Image {sha256[:12]} is not in the artifact store.")
+        chip = esp.CHIP_NAME.lower().replace("-", "")
+        if artifact.header and artifact.header["chip"] and artifact.header["chip"] != chip:
+            raise FlashError(f"Image at 0x{address:08x} is built for {artifact.header['chip']}, not {chip}.")
+        key = f"{chip}@0x{address:x}:{flash_mode}:{flash_freq}:{flash_size}"
+        return artifact_store.derive(
+            artifact, key, lambda data: prepare_image(esp, data, address, flash_mode, flash_freq, flash_size)
+        )
+
+    # Function to stream an image's stored compressed copy straight from the mapped file
+    def _write(self, artifact, address, progress_base=0, progress_total=None):
+        esp = self.esp
+        uncsize = artifact.size
+        with artifact.compressed() as compressed:
+            total = len(compressed)
+            ratio = uncsize / total
+            esp.flash_defl_begin(uncsize, total, address)
+            block_size = esp.FLASH_WRITE_SIZE
+            self.log(f"Writing {uncsize} bytes ({total} compressed) at 0x{address:08x}...")
+            for seq, offset in enumerate(range(0, total, block_size)):
+                self.check_cancel()
+                block = compressed[offset:offset + block_size]
+                timeout = max(MIN_BLOCK_TIMEOUT, ERASE_WRITE_TIMEOUT_PER_MB * len(block) * ratio / 1e6)
+                timeout += 2 * self.link_rtt
+                esp.flash_defl_block(block, seq, timeout=timeout)
+                done = min(uncsize, int((offset + len(block)) * ratio))
+                self.progress("write", progress_base + done, progress_total or uncsize)
+
+        # Leave the stub running so verify and reset can reuse the connection
+        esp.flash_begin(0, 0)
+        esp.flash_defl_finish(False)
+        return {"address": address, "size": uncsize, "md5": artifact.md5, "sha256": artifact.sha256}
+
+    def write(self, sha256, address, flash_mode="dio", flash_freq="40m", flash_size="keep", progress_base=0,
+              progress_total=None):
+        artifact = self._flash_artifact(sha256, address, flash_mode, flash_freq, flash_size)
+        return self._write(artifact, address, progress_base, progress_total)
+
+    def verify(self, address, size, expected_md5, sha256=None):
+        self.check_cancel()
+        self.progress("verify", 0, 1)
+        actual = self.esp.flash_md5sum(address, size)
+        if actual != expected_md5:
+            message = f"Verify failed at 0x{address:08x}: expected {expected_md5}, got {actual}."
+            artifact = artifact_store.open_artifact(sha256) if sha256 else None
+            if artifact is not None:
+                # The stored per-block hashes narrow the mismatch down to the first bad erase block
+                for i, block_md5 in enumerate(artifact.block_md5s):
+                    self.check_cancel()
+                    start = i * artifact_store.BLOCK_SIZE
+                    length = min(artifact_store.BLOCK_SIZE, size - start)
+                    if self.esp.flash_md5sum(address + start, length) != block_md5:
+                        message += f" First differing block starts at 0x{address + start:08x}."
+                        break
+            raise FlashError(message)
+        self.log("Hash of data verified.")
+        self.progress("verify", 1, 1)
+
+    def reset(self):
+        self.progress("reset", 0, 1)
+        self.log("Hard resetting via RTS pin...")
+        self.esp.hard_reset()
+        self.close()
+        self.progress("reset", 1, 1)
+
+    # Function to ask the chip whether flash already holds exactly these images
+    def is_current(self, images, flash_mode, flash_freq, flash_size):
+        artifacts = [(address, self._flash_artifact(sha256, address, flash_mode, flash_freq, flash_size))
+                     for address, sha256 in images]
+        return self._holds(artifacts)
+
+    def _holds(self, artifacts):
+        for address, artifact in artifacts:
+            self.check_cancel()
+            if self.esp.flash_md5sum(address, artifact.size) != artifact.md5:
+                return False
+        return True
+
+    # Function to flash (address, SHA-256) images from the artifact store
+    def flash(self, port, images, chip=DEFAULT_CHIP, baud=DEFAULT_BAUD, flash_mode="dio",
+              flash_freq="40m", flash_size="detect", erase_all=False, verify=True, reset=True, fingerprint=None,
+              skip_if_current=False, link_rtt=0.0, reset_candidates=()):
+        info = self.connect(port, chip=chip, baud=baud, flash_size=flash_size, fingerprint=fingerprint,
+                            link_rtt=link_rtt, reset_candidates=reset_candidates)
+        info["flash_mode"] = flash_mode
+        info["flash_freq"] = flash_freq
+        info["skipped"] = False
+        artifacts = [(address, self._flash_artifact(sha256, address, flash_mode, flash_freq, flash_size))
+                     for address, sha256 in images]
+        info["size"] = sum(artifact.size for _, artifact in artifacts)
+
+        if skip_if_current and not erase_all and self._holds(artifacts):
+            self.log("Flash already holds this image, skipping write.")
+            info["skipped"] = True
+            if reset:
+                self.reset()
+            return info
+
+        if erase_all:
+            self.erase()
+        # Report write progress over the size of every image so the bar only fills once
+        written, base = [], 0
+        for address, artifact in artifacts:
+            written.append(self._write(artifact, address, base, info["size"]))
+            base += artifact.size
+        if verify:
+            for item in written:
+                self.verify(item["address"], item["size"], item["md5"], item["sha256"])
+        if reset:
+            self.reset()
+        info["images"] = written
+        info["size"] = sum(item["size"] for item in written)
+        return info
+
+    def close(self):
+        if self.esp is not None:
+            try:
+                self.esp._port.close()
+            except Exception:
+                pass
+        self.esp = None
+        self.port = None
+        self.flash_size = None
+        self.fingerprint = None
+
+
+# Class standing in for the cancel event inside the worker: set by the engine's cancel signal, cleared per request
+class _CancelFlag:
+    def __init__(self):
+        self._set = False
+        signal.signal(CANCEL_SIGNAL, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self._set = True
+
+    def is_set(self):
+        return self._set
+
+    def clear(self):
+        self._set = False
+
+
+# Function run in the worker process: import esptool once and serve requests until shut down
+def _worker_main(conn, cancel_event):
+    session = _FlashSession(conn, cancel_event)
+    while True:
+        try:
+            op, kwargs = conn.recv()
+        except (EOFError, OSError):
+            break
+        if op == "shutdown":
+            break
+        cancel_event.clear()
+        try:
+            result = getattr(session, op)(**kwargs)
+            conn.send(("result", result))
+        except FlashCancelled as e:
+            # A cancelled job leaves the chip mid-operation, so never reuse that connection
+            session.close()
+            conn.send(("cancelled", str(e)))
+        except Exception as e:
+            session.close()
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    session.close()
+
+
+# Class driving esptool in a long-lived worker process dedicated to one serial port
+class FlashEngine:
+    def __init__(self, port, chip=DEFAULT_CHIP, baud=DEFAULT_BAUD):
+        self.port = port
+        self.chip = chip
+        self.baud = baud
+        self._process = None
+        self._conn = None
+        self._bridge = None  # USB bridge chip behind the port, looked up on the first job
+        self._cancel_event = threading.Event()
+        self._job_lock = threading.Lock()
+
+    def _worker_alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    # Function to start the worker on one end of a socket pair; the child finds this module through PYTHONPATH
+    def _ensure_worker(self):
+        if self._worker_alive():
+            return
+        parent_sock, child_sock = socket.socketpair()
+        env = dict(os.environ)
+        here = os.path.dirname(os.path.abspath(__file__))
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [here, env.get("PYTHONPATH")]))
+        try:
+            self._process = subprocess.Popen(
+                [sys.executable, "-m", "esp_flasher", WORKER_FLAG, str(child_sock.fileno())],
+                pass_fds=(child_sock.fileno(),), stdin=subprocess.DEVNULL, env=env
+            )
+        except OSError:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        self._conn = Connection(parent_sock.detach())
+
+    def _kill_worker(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+        if self._conn is not None:
+            self._conn.close()
+        self._process = None
+        self._conn = None
+
+    # Function to send one request to the worker and pump its messages into the callbacks; each stage the
+    # worker reports progress for becomes a span of the trace
+    def _call(self, op, on_progress=None, on_log=None, **kwargs):
+        with self._job_lock, tracing.span(f"worker {op}", "flash", port=self.port):
+            stages = tracing.PhaseSpans("flash")
+            try:
+                return self._pump(op, kwargs, on_progress, on_log, stages)
+            finally:
+                stages.close()
+
+    def _pump(self, op, kwargs, on_progress, on_log, stages):
+        self._ensure_worker()
+        self._cancel_event.clear()
+        try:
+            self._conn.send((op, kwargs))
+        except OSError:
+            self._kill_worker()
+            raise FlashError("Flash worker exited unexpectedly.")
+        cancel_deadline = None
+        while True:
+            if self._cancel_event.is_set():
+                # Repeated until the worker answers, so a signal that lands before it reads the request still counts;
+                # esptool can block inside a serial read, so it gets a moment, then it is killed
+                self._process.send_signal(CANCEL_SIGNAL)
+                cancel_deadline = cancel_deadline or time.monotonic() + CANCEL_GRACE_SECONDS
+                if time.monotonic() > cancel_deadline:
+                    self._kill_worker()
+                    raise FlashCancelled("Flash job cancelled.")
+            if not self._conn.poll(0.1):
+                if not self._worker_alive():
+                    self._kill_worker()
+                    raise FlashError("Flash worker exited unexpectedly.")
+                continue
+            try:
+                kind, *payload = self._conn.recv()
+            except (EOFError, OSError):
+                self._kill_worker()
+                raise FlashError("Flash worker exited unexpectedly.")
+            if kind == "progress":
+                stages.enter(payload[0])
+                if on_progress:
+                    on_progress(*payload)
+            elif kind == "log":
+                if on_log:
+                    on_log(payload[0])
+            elif kind == "result":
+                return payload[0]
+            elif kind == "cancelled":
+                raise FlashCancelled(payload[0])
+            else:
+                raise FlashError(payload[0])
+
+    # Function to get the reset sequences to try first on this port and its device, fastest expected first
+    def _reset_candidates(self, serial_number=None):
+        if self._bridge is None:
+            self._bridge = reset_sequences.bridge_for_port(self.port) or "unknown"
+        return reset_sequences.candidates(self._bridge, serial_number)
+
+    # Function to learn from how the resets of a connect went
+    def _learn_reset(self, result, serial_number=None):
+        if result.get("reset_attempts"):
+            reset_sequences.record(self._bridge, serial_number, result["reset_attempts"])
+
+    def connect(self, on_progress=None, on_log=None, serial_number=None, **kwargs):
+        kwargs.setdefault("chip", self.chip)
+        kwargs.setdefault("baud", self.baud)
+        kwargs.setdefault("link_rtt", remote_ports.link_rtt(self.port))
+        kwargs.setdefault("reset_candidates", self._reset_candidates(serial_number))
+        result = self._call("connect", on_progress, on_log, port=self.port, **kwargs)
+        self._learn_reset(result, serial_number)
+        return result
+
+    def erase(self, address=None, size=None, on_progress=None, on_log=None):
+        return self._call("erase", on_progress, on_log, address=address, size=size)
+
+    def write(self, image, address, on_progress=None, on_log=None, **kwargs):
+        artifact = artifact_store.ingest_bytes(image)
+        return self._call("write", on_progress, on_log, sha256=artifact.sha256, address=address, **kwargs)
+
+    def verify(self, address, size, expected_md5, sha256=None, on_progress=None, on_log=None):
+        return self._call("verify", on_progress, on_log, address=address, size=size, expected_md5=expected_md5,
+                          sha256=sha256)
+
+    def reset(self, on_progress=None, on_log=None):
+        return self._call("reset", on_progress, on_log)
+
+    # Function to run connect, erase, write, verify and reset as one job on a single connection
+    def flash(self, bin_path, address=0x1000, on_progress=None, on_log=None, **kwargs):
+        return self.flash_images([(address, bin_path)], on_progress, on_log, **kwargs)
+
+    # Function to write several (address, path) images, e.g. bootloader, partitions and app, in one job
+    # Each file goes through the artifact store, so the worker maps a stored blob instead of being sent the bytes
+    def flash_images(self, images, on_progress=None, on_log=None, serial_number=None, symbolic_name=None, **kwargs):
+        with tracing.span("flash images", "flash", port=self.port, serial_number=serial_number,
+                          symbolic_name=symbolic_name, images=len(images)):
+            return self._flash_images(images, on_progress, on_log, serial_number, symbolic_name, **kwargs)
+
+    def _flash_images(self, images, on_progress, on_log, serial_number, symbolic_name, **kwargs):
+        with tracing.span("store images", "flash"):
+            stored = [(address, artifact_store.ingest_file(path).sha256) for address, path in images]
+        kwargs.setdefault("chip", self.chip)
+        kwargs.setdefault("baud", self.baud)
+        # Ports on a remote station get their timeouts and reset handling adjusted to the measured round trip
+        kwargs.setdefault("link_rtt", remote_ports.link_rtt(self.port))
+        # The chip is put into download mode with the fastest reset this bridge and device are known to take
+        kwargs.setdefault("reset_candidates", self._reset_candidates(serial_number))
+        # A device seen before is connected with its cached fingerprint instead of full detection
+        if serial_number:
+            kwargs.setdefault("fingerprint", device_cache.get_fingerprint(serial_number))
+
+        image_hash = device_inventory.image_set_digest(stored)
+        started = time.time()
+        try:
+            result = self._call("flash", on_progress, on_log, port=self.port, images=stored, **kwargs)
+        except FlashCancelled:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            outcome = "failed"
+            raise
+        else:
+            outcome = "skipped" if result["skipped"] else "ok"
+        finally:
+            if serial_number:
+                device_inventory.record_flash(
+                    serial_number, image_hash, started, time.time() - started, kwargs["baud"], outcome,
+                    port=self.port, symbolic_name=symbolic_name
+                )
+        self._learn_reset(result, serial_number)
+        if serial_number:
+            device_cache.store_fingerprint(serial_number, result)
+            device_inventory.update_device(serial_number, chip=result["description"], mac=result["mac"])
+        return result
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def close(self):
+        self.cancel()
+        with self._job_lock:
+            if self._conn is not None and self._worker_alive():
+                try:
+                    self._conn.send(("shutdown", {}))
+                    self._process.wait(timeout=2)
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
+            self._kill_worker()
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+# Function to get the engine for a port, starting its worker process on first use
+def get_engine(port, chip=DEFAULT_CHIP, baud=DEFAULT_BAUD):
+    with _engines_lock:
+        engine = _engines.get(port)
+        if engine is None or engine.chip != chip or engine.baud != baud:
+            if engine is not None:
+                engine.close()
+            engine = FlashEngine(port, chip=chip, baud=baud)
+            _engines[port] = engine
+        return engine
+
+
+# Function to cancel the job running on a port, if it has an engine
+def cancel_engine(port):
+    with _engines_lock:
+        engine = _engines.get(port)
+    if engine is not None:
+        engine.cancel()
+
+
+# Function to stop every worker process, used when the application exits
+def shutdown_engines():
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.close()
+
+
+if __name__ == "__main__" and sys.argv[1:2] == [WORKER_FLAG]:
+    _worker_main(Connection(int(sys.argv[2])), _CancelFlag())
@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+import time
+
+import esp_flasher
+import remote_ports
+import serial_broker
+import sysfs_ports
+import tracing
+
+# Learned per-hub concurrency limits and throughput, kept between batches
+HUB_LIMITS_PATH = os.path.expanduser("~/.dognosis/hub_limits.json")
+
+DEFAULT_HUB_LIMIT = 2          # Concurrent transfers per hub until we have measured it
+MAX_HUB_LIMIT = 8
+DEFAULT_CONTROLLER_LIMIT = 6   # Concurrent transfers per USB host controller
+MAX_RETRIES = 1                # A job that times out is retried once at lower hub concurrency
+
+# Per-job rate, as a share of the best rate seen alone on the hub, that decides the limit
+GROW_EFFICIENCY = 0.8
+SHRINK_EFFICIENCY = 0.5
+RATE_SMOOTHING = 0.3
+
+SYSFS_USB_DEVICES = "/sys/bus/usb/devices"
+
+
+# Function to find the host controller behind a USB bus, so USB2 and USB3 buses of one xHCI count once
+def host_controller(bus):
+    path = os.path.realpath(os.path.join(SYSFS_USB_DEVICES, f"usb{bus}"))
+    if os.path.exists(path):
+        return os.path.basename(os.path.dirname(path))
+    return f"usb{bus}"
+
+
+# Function to split a port's USB location (e.g. "1-1.4.2:1.0") into its host controller and parent hub
+def port_topology(location):
+    if not location:
+        return "unknown", "unknown"
+    device_path = location.split(":")[0]
+    bus, _, chain = device_path.partition("-")
+    controller = host_controller(bus)
+    # Ports plugged straight into a root port share the root hub
+    hub = device_path.rsplit(".", 1)[0] if "." in chain else f"{bus}-root"
+    return controller, f"{controller}/{hub}"
+
+
+# Function to map device nodes to their topology using the USB locations pySerial reports
+def scan_topology():
+    topology = {}
+    for port in sysfs_ports.comports():
+        topology[port.device] = port_topology(port.location)
+    for port in remote_ports.comports():
+        topology[port.device] = port.controller, port.hub
+    return topology
+
+
+# Class remembering how many concurrent transfers each hub sustains and adjusting it from measured rates
+class HubLimits:
+    def __init__(self, path=HUB_LIMITS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self._hubs = json.load(f)
+        except (OSError, ValueError):
+            self._hubs = {}
+
+    def limit(self, hub):
+        with self._lock:
+            return self._hubs.get(hub, {}).get("limit", DEFAULT_HUB_LIMIT)
+
+    def rate(self, hub):
+        with self._lock:
+            return self._hubs.get(hub, {}).get("rate")
+
+    # Function to learn from one finished transfer: its byte rate and how many shared the hub with it
+    def observe(self, hub, rate, concurrency):
+        with self._lock:
+            entry = self._hubs.setdefault(hub, {"limit": DEFAULT_HUB_LIMIT})
+            if concurrency <= 1:
+                solo = entry.get("solo_rate")
+                entry["solo_rate"] = rate if solo is None else max(rate, solo * (1 - RATE_SMOOTHING) + rate * RATE_SMOOTHING)
+            solo = entry.get("solo_rate") or rate
+            previous = entry.get("rate")
+            entry["rate"] = rate if previous is None else previous * (1 - RATE_SMOOTHING) + rate * RATE_SMOOTHING
+
+            # Only move the limit when the hub was actually running at it
+            efficiency = rate / solo if solo else 1.0
+            if concurrency >= entry["limit"] and efficiency >= GROW_EFFICIENCY:
+                entry["limit"] = min(MAX_HUB_LIMIT, entry["limit"] + 1)
+            elif efficiency < SHRINK_EFFICIENCY:
+                entry["limit"] = max(1, min(entry["limit"], concurrency) - 1)
+            self._save()
+
+    # Function to back off a hub after a transfer on it timed out
+    def penalise(self, hub):
+        with self._lock:
+            entry = self._hubs.setdefault(hub, {"limit": DEFAULT_HUB_LIMIT})
+            entry["limit"] = max(1, entry["limit"] // 2)
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._hubs, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+# Class describing one device to flash in a batch
+class FlashJob:
+    def __init__(self, port, images, serial_number=None, symbolic_name=None, chip=esp_flasher.DEFAULT_CHIP):
+        self.port = port
+        self.images = images
+        self.chip = chip
+        self.serial_number = serial_number
+        self.symbolic_name = symbolic_name
+        self.size = sum(os.path.getsize(path) for _, path in images)
+        self.controller = "unknown"
+        self.hub = "unknown"
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.duration = None
+        self.rate = None
+        self.connect_ms = None  # Time from opening the port to a running stub, from the job's result
+
+    @property
+    def label(self):
+        return self.symbolic_name or self.port
+
+
+# Class running a batch of flash jobs with per-hub and per-controller concurrency caps
+class BatchFlashScheduler:
+    def __init__(self, jobs, flash_kwargs=None, hub_limits=None, controller_limit=DEFAULT_CONTROLLER_LIMIT,
+                 on_job_start=None, on_job_progress=None, on_job_done=None):
+        self.jobs = list(jobs)
+        self.flash_kwargs = flash_kwargs or {}
+        self.hub_limits = hub_limits or HubLimits()
+        self.controller_limit = controller_limit
+        self.on_job_start = on_job_start
+        self.on_job_progress = on_job_progress
+        self.on_job_done = on_job_done
+        self._cond = threading.Condition()
+        self._active_hub = {}
+        self._active_controller = {}
+        self._cancelled = False
+
+    # Function to pick the next job: least busy controller, then least busy hub, then largest image
+    def _pick(self, pending):
+        best = None
+        for job in pending:
+            hub_active = self._active_hub.get(job.hub, 0)
+            controller_active = self._active_controller.get(job.controller, 0)
+            if hub_active >= self.hub_limits.limit(job.hub) or controller_active >= self.controller_limit:
+                continue
+            key = (controller_active, hub_active, -job.size)
+            if best is None or key < best[0]:
+                best = (key, job)
+        return best[1] if best else None
+
+    def _start(self, job):
+        job.attempts += 1
+        self._active_hub[job.hub] = self._active_hub.get(job.hub, 0) + 1
+        self._active_controller[job.controller] = self._active_controller.get(job.controller, 0) + 1
+        concurrency = self._active_hub[job.hub]
+        threading.Thread(target=self._run_job, args=(job, concurrency), daemon=True).start()
+
+    def _run_job(self, job, concurrency):
+        write_window = {}
+
+        def on_progress(stage, done, total):
+            if stage == "write":
+                now = time.monotonic()
+                write_window.setdefault("start", (now, done))
+                write_window["end"] = (now, done)
+            if self.on_job_progress:
+                self.on_job_progress(job, esp_flasher.overall_percent(stage, done, total))
+
+        started = time.monotonic()
+        retry = False
+        try:
+            if self.on_job_start:
+                self.on_job_start(job)
+            engine = esp_flasher.get_engine(job.port, chip=job.chip)
+            # Each device gets its own row in the trace, so a whole batch reads as one timeline
+            with tracing.span("flash job", "batch", track=job.label, port=job.port, hub=job.hub,
+                              controller=job.controller, attempt=job.attempts, concurrency=concurrency):
+                # A monitor, log or TCP client on the port gets it back, and the boot output, once the job ends
+                with serial_broker.handed_over(job.port):
+                    job.result = engine.flash_images(
+                        job.images, on_progress=on_progress, serial_number=job.serial_number,
+                        symbolic_name=job.symbolic_name, **self.flash_kwargs
+                    )
+            job.error = None
+            job.connect_ms = job.result["connect_ms"]
+        except esp_flasher.FlashCancelled as e:
+            job.error = str(e)
+        except Exception as e:
+            job.error = str(e)
+            # A timeout usually means the hub is oversubscribed rather than the board being bad
+            if "timed out" in job.error.lower() or "timeout" in job.error.lower():
+                self.hub_limits.penalise(job.hub)
+                retry = job.attempts <= MAX_RETRIES and not self._cancelled
+        finally:
+            job.duration = time.monotonic() - started
+            # The slot is given back however the job ended, or run() would wait for it forever
+            with self._cond:
+                # Jobs started after this one shared the hub too, so count the busier of the two moments
+                concurrency = max(concurrency, self._active_hub[job.hub])
+                self._active_hub[job.hub] -= 1
+                self._active_controller[job.controller] -= 1
+                if retry:
+                    self._pending.append(job)
+                self._cond.notify_all()
+
+        if "start" in write_window and write_window["end"][0] > write_window["start"][0]:
+            (t0, b0), (t1, b1) = write_window["start"], write_window["end"]
+            job.rate = (b1 - b0) / (t1 - t0)
+            self.hub_limits.observe(job.hub, job.rate, concurrency)
+        if not retry and self.on_job_done:
+            self.on_job_done(job)
+
+    # Function to flash every job and return them once all have finished
+    def run(self):
+        with tracing.span("batch flash", "batch", jobs=len(self.jobs)):
+            return self._run()
+
+    def _run(self):
+        with tracing.span("port scan", "ports"):
+            topology = scan_topology()
+        for job in self.jobs:
+            job.controller, job.hub = topology.get(job.port, ("unknown", "unknown"))
+        self._pending = list(self.jobs)
+
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                if self._cancelled:
+                    self._pending.clear()
+                job = self._pick(self._pending) if self._pending else None
+                if job is not None:
+                    self._pending.remove(job)
+                    self._start(job)
+                    continue
+                if not self._pending and not any(self._active_hub.values()):
+                    break
+                self._cond.wait()
+        self.duration = time.monotonic() - started
+        return self.jobs
+
+    def cancel(self):
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+        for job in self.jobs:
+            esp_flasher.cancel_engine(job.port)
@@ -0,0 +1,235 @@
+import threading
+
+import tkinter as tk
+from tkinter import ttk
+
+RING_CAPACITY = 4 * 1024 * 1024  # Bytes of raw serial capture kept for the hex view
+BYTES_PER_ROW = 16
+REFRESH_MS = 100                 # How often the view checks for new data while following the tail
+
+
+# Class keeping the last bytes received in one preallocated bytearray, addressed by absolute stream offset
+class ByteRing:
+    def __init__(self, capacity=RING_CAPACITY):
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.capacity = capacity
+        self.total = 0  # Bytes ever appended; the newest byte is at offset total - 1
+        self._lock = threading.Lock()
+
+    @property
+    def start(self):
+        return max(0, self.total - self.capacity)
+
+    def append(self, data):
+        size = len(data)
+        # Only the last capacity bytes of an oversized chunk are kept, but offsets count all of it
+        data = memoryview(data)[-self.capacity:]
+        with self._lock:
+            pos = (self.total + size - len(data)) % self.capacity
+            first = min(len(data), self.capacity - pos)
+            self.view[pos:pos + first] = data[:first]
+            self.view[:len(data) - first] = data[first:]
+            self.total += size
+
+    # Function to copy out just the bytes between two absolute offsets (used for the rows on screen)
+    def read(self, offset, size):
+        with self._lock:
+            offset = max(offset, self.start)
+            end = min(offset + size, self.total)
+            if end <= offset:
+                return b""
+            pos = offset % self.capacity
+            first = min(end - offset, self.capacity - pos)
+            data = bytes(self.view[pos:pos + first])
+            if first < end - offset:
+                data += bytes(self.view[:end - offset - first])
+            return data
+
+    # Function to find a byte pattern at or after an absolute offset, searching the ring in place
+    def find(self, pattern, offset=0):
+        with self._lock:
+            offset = max(offset, self.start)
+            if offset >= self.total or not pattern:
+                return -1
+            pos = offset % self.capacity
+            end_pos = self.total % self.capacity
+            if self.total - offset <= self.capacity - pos:
+                # The searched range is one contiguous run of the buffer
+                found = self.buf.find(pattern, pos, pos + self.total - offset)
+                return -1 if found < 0 else offset + found - pos
+            # Wrapped: search the run up to the end of the buffer, the seam, then the run from the start
+            first_len = self.capacity - pos
+            found = self.buf.find(pattern, pos)
+            if found >= 0:
+                return offset + found - pos
+            overlap = min(len(pattern) - 1, first_len)
+            seam = bytes(self.view[self.capacity - overlap:]) + bytes(self.view[:min(len(pattern) - 1, end_pos)])
+            found = seam.find(pattern)
+            if found >= 0:
+                return offset + first_len - overlap + found
+            found = self.buf.find(pattern, 0, end_pos)
+            return -1 if found < 0 else offset + first_len + found
+
+
+# Function to turn a search string into bytes: hex pairs ("de ad be ef") or quoted text ("'OK'")
+def parse_pattern(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1].encode("utf-8")
+    return bytes.fromhex(text.replace("0x", "").replace(",", " "))
+
+
+# Function to format one row of a hex dump; lead blanks the first bytes of a row that is no longer held
+def format_row(offset, data, lead=0):
+    hex_part = "   " * lead + " ".join(f"{b:02x}" for b in data)
+    ascii_part = " " * lead + "".join(chr(b) if 32 <= b < 127 else "." for b in data)
+    return f"{offset:08x}  {hex_part:<{BYTES_PER_ROW * 3 - 1}}  |{ascii_part}|"
+
+
+# Class showing a ByteRing as a hex + ASCII dump, formatting only the rows on screen
+class HexView:
+    def __init__(self, parent, ring):
+        self.ring = ring
+        self.frame = ttk.Frame(parent)
+        self.top_row = 0
+        self.follow = True
+        self.match = None
+        self._shown_total = -1
+        self._running = False
+
+        controls = ttk.Frame(self.frame)
+        controls.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(controls, text="Offset:").pack(side=tk.LEFT)
+        self.offset_var = tk.StringVar()
+        offset_entry = ttk.Entry(controls, textvariable=self.offset_var, width=12)
+        offset_entry.pack(side=tk.LEFT, padx=5)
+        offset_entry.bind("<Return>", lambda event: self.jump_to_entry())
+        ttk.Button(controls, text="Go", command=self.jump_to_entry).pack(side=tk.LEFT)
+        ttk.Label(controls, text="Find (hex or 'text'):").pack(side=tk.LEFT, padx=(10, 0))
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(controls, textvariable=self.search_var, width=24)
+        search_entry.pack(side=tk.LEFT, padx=5)
+        search_entry.bind("<Return>", lambda event: self.find_next())
+        ttk.Button(controls, text="Find Next", command=self.find_next).pack(side=tk.LEFT)
+        ttk.Button(controls, text="Follow", command=self.follow_tail).pack(side=tk.LEFT, padx=5)
+        self.status_label = ttk.Label(controls, text="")
+        self.status_label.pack(side=tk.LEFT, padx=5)
+
+        body = ttk.Frame(self.frame)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.text = tk.Text(body, font=("Courier", 10), wrap=tk.NONE, state=tk.DISABLED)
+        self.text.tag_configure("match", background="yellow")
+        self.scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self._on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.text.bind("<MouseWheel>", lambda event: self.scroll_rows(-3 if event.delta > 0 else 3))
+        self.text.bind("<Button-4>", lambda event: self.scroll_rows(-3))
+        self.text.bind("<Button-5>", lambda event: self.scroll_rows(3))
+        self.text.bind("<Configure>", lambda event: self.render())
+
+    def visible_rows(self):
+        line_height = max(self.text.tk.call("font", "metrics", self.text.cget("font"), "-linespace"), 1)
+        return max(1, self.text.winfo_height() // line_height)
+
+    def row_range(self):
+        return self.ring.start // BYTES_PER_ROW, (self.ring.total + BYTES_PER_ROW - 1) // BYTES_PER_ROW
+
+    def scroll_rows(self, rows):
+        self.follow = False
+        self.top_row += rows
+        self.render()
+
+    def _on_scroll(self, action, amount, unit=None):
+        first_row, last_row = self.row_range()
+        if action == "moveto":
+            self.top_row = first_row + int(float(amount) * (last_row - first_row))
+        elif unit == "pages":
+            self.top_row += int(amount) * self.visible_rows()
+        else:
+            self.top_row += int(amount)
+        self.follow = False
+        self.render()
+
+    def jump_to(self, offset):
+        self.follow = False
+        self.top_row = offset // BYTES_PER_ROW
+        self.render()
+
+    def jump_to_entry(self):
+        try:
+            self.jump_to(int(self.offset_var.get(), 0))
+        except ValueError:
+            self.status_label.config(text="Offset must be a number (e.g. 4096 or 0x1000).")
+
+    def find_next(self):
+        try:
+            pattern = parse_pattern(self.search_var.get())
+        except ValueError:
+            self.status_label.config(text="Use hex bytes (de ad be ef) or quoted text ('OK').")
+            return
+        start = self.match[0] + 1 if self.match else self.top_row * BYTES_PER_ROW
+        found = self.ring.find(pattern, start)
+        if found < 0 and start > self.ring.start:
+            found = self.ring.find(pattern, self.ring.start)  # Wrap around to the oldest byte
+        if found < 0:
+            self.match = None
+            self.status_label.config(text="Not found.")
+            self.render()
+            return
+        self.match = (found, len(pattern))
+        self.status_label.config(text=f"Found at 0x{found:x}.")
+        self.jump_to(max(found - BYTES_PER_ROW * 2, 0))
+
+    def follow_tail(self):
+        self.follow = True
+        self.render()
+
+    # Function to draw only the rows that fit in the window
+    def render(self):
+        rows = self.visible_rows()
+        first_row, last_row = self.row_range()
+        if self.follow:
+            self.top_row = last_row - rows
+        self.top_row = max(first_row, min(self.top_row, last_row - rows))
+        offset = self.top_row * BYTES_PER_ROW
+        # The oldest row may be partly overwritten already; keep rows aligned and blank the lost bytes
+        lead = max(0, self.ring.start - offset)
+        data = b" " * lead + self.ring.read(offset + lead, rows * BYTES_PER_ROW - lead)
+
+        lines = []
+        for i in range(0, len(data), BYTES_PER_ROW):
+            row_lead = max(0, lead - i)
+            lines.append(format_row(offset + i, data[i + row_lead:i + BYTES_PER_ROW], row_lead))
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(lines))
+        if self.match:
+            self._highlight(offset, len(data))
+        self.text.configure(state=tk.DISABLED)
+
+        span = max(last_row - first_row, 1)
+        self.scrollbar.set((self.top_row - first_row) / span, min(1.0, (self.top_row + rows - first_row) / span))
+        self._shown_total = self.ring.total
+
+    def _highlight(self, offset, size):
+        match_start, match_len = self.match
+        for pos in range(max(match_start, offset), min(match_start + match_len, offset + size)):
+            line = (pos - offset) // BYTES_PER_ROW + 1
+            column = 10 + (pos % BYTES_PER_ROW) * 3
+            self.text.tag_add("match", f"{line}.{column}", f"{line}.{column + 2}")
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._tick()
+
+    def stop(self):
+        self._running = False
+
+    def _tick(self):
+        if not self._running:
+            return
+        if self.follow and self.ring.total != self._shown_total:
+            self.render()
+        self.frame.after(REFRESH_MS, self._tick)
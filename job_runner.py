@@ -0,0 +1,106 @@
+import asyncio
+import os
+import signal
+import threading
+
+# Largest single output line we buffer; verbose gcc command lines from arduino-cli can be long
+STREAM_LIMIT = 1024 * 1024
+# Seconds a killed process group gets to exit after SIGTERM before SIGKILL
+KILL_GRACE_SECONDS = 3
+
+
+class JobTimeout(Exception):
+    pass
+
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+# Function to get the background event loop, starting its thread on first use (and again after a fork)
+def get_loop():
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="job-runner", daemon=True).start()
+        return _loop
+
+
+# Function to schedule a coroutine on the background loop; the returned future can be cancelled from any thread
+def submit(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+# Function to stop a child and everything it started (arduino-cli spawns esptool and the compilers)
+async def kill_process_group(process):
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+    except ProcessLookupError:
+        pass
+
+
+# Function to run a process, streaming stdout and stderr lines to on_line without blocking the loop
+async def run_process(args, on_line=None, timeout=None, cwd=None):
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        cwd=cwd, start_new_session=True, limit=STREAM_LIMIT
+    )
+
+    def emit(raw):
+        if on_line:
+            on_line(raw.decode("utf-8", errors="replace").rstrip("\r\n"))
+
+    async def pump(stream):
+        while True:
+            try:
+                raw = await stream.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                # End of output; a last line without a newline still counts
+                if e.partial:
+                    emit(e.partial)
+                return
+            except asyncio.LimitOverrunError as e:
+                # A line longer than STREAM_LIMIT is passed on in pieces rather than failing the job
+                raw = await stream.read(e.consumed)
+            emit(raw)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(pump(process.stdout), pump(process.stderr), process.wait()), timeout
+        )
+    except asyncio.TimeoutError:
+        raise JobTimeout(f"{os.path.basename(args[0])} did not finish within {timeout}s.")
+    finally:
+        # Whatever ended the wait (timeout, cancel, a failing on_line), nothing the job started outlives it
+        await kill_process_group(process)
+    return process.returncode
+
+
+# Function to run a blocking call in a worker thread with cancel and timeout support
+# cancel() is called to make the blocking call return early (e.g. FlashEngine.cancel)
+async def run_blocking(func, *args, cancel=None, timeout=None):
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, func, *args)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        if cancel:
+            cancel()
+        await asyncio.gather(future, return_exceptions=True)
+        raise JobTimeout(f"Job did not finish within {timeout}s.")
+    except asyncio.CancelledError:
+        if cancel:
+            cancel()
+        await asyncio.gather(future, return_exceptions=True)
+        raise
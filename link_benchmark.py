@@ -0,0 +1,223 @@
+import os
+import pty
+import sys
+import threading
+import time
+import tty
+
+import numpy as np
+import serial
+
+import device_inventory
+import sysfs_ports
+
+# The far end has to echo every byte back: a TX-RX loopback plug on the adapter, echo firmware
+# that follows the host's baud rate, or a PTY stand-in (see open_loopback_pty)
+DEFAULT_BAUDS = (115200, 230400, 460800, 921600)
+DEFAULT_CHUNK_SIZES = (64, 256, 1024, 4096)
+STEP_SECONDS = 2.0        # How long each (baud, chunk size) step keeps the line busy
+DRAIN_SECONDS = 1.0       # How long to wait for the last echoed bytes before counting them as lost
+READ_TIMEOUT = 0.01
+LATENCY_PROBES = 50
+PROBE_SIZE = 8
+PROBE_TIMEOUT = 0.5
+
+# Thresholds that flag a link as slow at onboarding
+MIN_EFFICIENCY = 0.7      # Sustained rate as a share of the 8N1 line rate (baud / 10 bytes/s)
+MAX_ERROR_RATE = 1e-4
+MAX_RTT_P95_MS = 20.0
+
+PATTERN_SIZE = 64 * 1024
+
+
+class BenchmarkCancelled(Exception):
+    pass
+
+
+# Random test data, doubled so any slice of up to PATTERN_SIZE bytes at any stream position is contiguous
+_pattern = np.frombuffer(os.urandom(PATTERN_SIZE), dtype=np.uint8)
+_pattern = np.concatenate([_pattern, _pattern])
+
+
+def _expected(position, size):
+    start = position % PATTERN_SIZE
+    return _pattern[start:start + size]
+
+
+# Function to start an echo thread behind a pseudo-terminal, for trying the benchmark without hardware
+def open_loopback_pty():
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    stop = threading.Event()
+
+    def echo():
+        while not stop.is_set():
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                break
+            os.write(master, data)
+
+    threading.Thread(target=echo, name="pty-loopback", daemon=True).start()
+
+    def close():
+        stop.set()
+        os.close(slave)
+        os.close(master)
+
+    return os.ttyname(slave), close
+
+
+# Function to stream the test pattern for a while and count what comes back, and how much of it is wrong
+def measure_throughput(ser, chunk_size, duration=STEP_SECONDS, cancel_event=None):
+    # Two chunks in flight keep the line busy without flooding the far end's receive buffer
+    window = 2 * chunk_size
+    ser.timeout = READ_TIMEOUT
+    ser.reset_input_buffer()
+    written = received = mismatched = 0
+
+    def take(data):
+        nonlocal received, mismatched
+        for i in range(0, len(data), PATTERN_SIZE):
+            part = np.frombuffer(data[i:i + PATTERN_SIZE], dtype=np.uint8)
+            mismatched += int(np.count_nonzero(part != _expected(received, len(part))))
+            received += len(part)
+
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        if cancel_event is not None and cancel_event.is_set():
+            raise BenchmarkCancelled("Benchmark cancelled.")
+        if written - received < window:
+            ser.write(_expected(written, chunk_size).tobytes())
+            written += chunk_size
+            if ser.in_waiting:
+                take(ser.read(ser.in_waiting))
+        else:
+            take(ser.read(max(ser.in_waiting, 1)))
+
+    drain_deadline = time.perf_counter() + DRAIN_SECONDS
+    while received < written and time.perf_counter() < drain_deadline:
+        take(ser.read(max(min(ser.in_waiting, written - received), 1)))
+    elapsed = time.perf_counter() - started
+
+    lost = max(written - received, 0)
+    return {
+        "bytes_per_sec": received / elapsed,
+        "error_rate": (mismatched + lost) / written if written else 0.0,
+        "bytes": written,
+    }
+
+
+# Function to time small probes echoed one at a time; returns the 50th/95th/99th percentile in ms
+def measure_latency(ser, probes=LATENCY_PROBES, cancel_event=None):
+    ser.timeout = PROBE_TIMEOUT
+    ser.reset_input_buffer()
+    samples = []
+    for i in range(probes):
+        if cancel_event is not None and cancel_event.is_set():
+            raise BenchmarkCancelled("Benchmark cancelled.")
+        probe = _expected(i * PROBE_SIZE, PROBE_SIZE).tobytes()
+        started = time.perf_counter()
+        ser.write(probe)
+        echoed = ser.read(PROBE_SIZE)
+        if echoed == probe:
+            samples.append((time.perf_counter() - started) * 1000)
+        else:
+            # A lost or garbled probe may leave bytes behind that would skew the next one
+            time.sleep(PROBE_TIMEOUT)
+            ser.reset_input_buffer()
+    if not samples:
+        return None, None, None
+    return tuple(float(p) for p in np.percentile(samples, [50, 95, 99]))
+
+
+# Function to sweep baud rates and chunk sizes on one port; on_result gets each step's result as it finishes
+def benchmark_port(port, bauds=DEFAULT_BAUDS, chunk_sizes=DEFAULT_CHUNK_SIZES, duration=STEP_SECONDS,
+                   probes=LATENCY_PROBES, on_result=None, cancel_event=None):
+    # serial_for_url, so a station's rfc2217:// port can be benchmarked across the network as well
+    ser = serial.serial_for_url(port, do_not_open=True)
+    # Keep DTR/RTS low so opening the port doesn't reset an ESP32 running the echo firmware
+    ser.dtr = False
+    ser.rts = False
+    ser.open()
+    results = []
+    try:
+        for baud in bauds:
+            ser.baudrate = baud
+            p50, p95, p99 = measure_latency(ser, probes, cancel_event)
+            for chunk_size in chunk_sizes:
+                result = measure_throughput(ser, chunk_size, duration, cancel_event)
+                result.update(baud=baud, chunk_size=chunk_size, rtt_p50_ms=p50, rtt_p95_ms=p95, rtt_p99_ms=p99)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    finally:
+        ser.close()
+    return results
+
+
+# Function to list what makes a link unfit for service; an empty list means it passed
+def assess(results):
+    problems = []
+    best = {}
+    for result in results:
+        baud = result["baud"]
+        if result["error_rate"] > MAX_ERROR_RATE:
+            problems.append(f"{result['error_rate']:.2%} errors at {baud} baud with {result['chunk_size']} B chunks")
+        best[baud] = max(best.get(baud, 0.0), result["bytes_per_sec"] / (baud / 10))
+    for baud, efficiency in sorted(best.items()):
+        if efficiency < MIN_EFFICIENCY:
+            problems.append(f"only {efficiency:.0%} of the line rate at {baud} baud")
+    for baud in sorted(best):
+        p95 = next((r["rtt_p95_ms"] for r in results if r["baud"] == baud), None)
+        if p95 is None:
+            problems.append(f"no latency probes came back at {baud} baud")
+        elif p95 > MAX_RTT_P95_MS:
+            problems.append(f"round-trip p95 of {p95:.1f} ms at {baud} baud")
+    return problems
+
+
+# Function to format one step's result as a table row
+def format_result(result):
+    p50, p95, p99 = (f"{v:.2f}" if v is not None else "-" for v in
+                     (result["rtt_p50_ms"], result["rtt_p95_ms"], result["rtt_p99_ms"]))
+    return (f"{result['baud']:>7} baud {result['chunk_size']:>5} B  {result['bytes_per_sec'] / 1024:>8.1f} KiB/s  "
+            f"errors {result['error_rate']:.2e}  rtt p50/p95/p99 {p50}/{p95}/{p99} ms")
+
+
+# Function to find the USB serial number of a port (symlinks like /dev/<symbolic name> work too)
+def port_serial_number(port):
+    device = os.path.realpath(port)
+    for info in sysfs_ports.comports():
+        if os.path.realpath(info.device) == device:
+            return info.serial_number
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python link_benchmark.py <port | --pty>")
+        sys.exit(2)
+    close_pty = None
+    if sys.argv[1] == "--pty":
+        port, close_pty = open_loopback_pty()
+        serial_number = None
+    else:
+        port = sys.argv[1]
+        serial_number = port_serial_number(port)
+    started = time.time()
+    try:
+        results = benchmark_port(port, on_result=lambda result: print(format_result(result)))
+    finally:
+        if close_pty:
+            close_pty()
+    problems = assess(results)
+    for problem in problems:
+        print(f"SLOW: {problem}")
+    if not problems:
+        print("Link OK.")
+    if serial_number:
+        device_inventory.record_link_benchmark(serial_number, started, port, results)
+        print(f"Stored against serial {serial_number}.")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,324 @@
+import base64
+import binascii
+import csv
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+
+# NVS layout (format version 2, what ESP-IDF's nvs_partition_gen.py writes): 4 KiB pages, each a 32 byte
+# header, a 32 byte bitmap of entry states and 126 entries of 32 bytes
+PAGE_SIZE = 4096
+ENTRY_SIZE = 32
+ENTRIES_PER_PAGE = 126
+FIRST_ENTRY_OFFSET = 64
+PAGE_ACTIVE = 0xFFFFFFFE
+PAGE_FULL = 0xFFFFFFFC
+FORMAT_VERSION = 0xFE
+CHUNK_ANY = 0xFF
+MAX_KEY_LENGTH = 15
+MAX_STRING_SIZE = 4000
+MIN_PAGES = 3  # NVS needs a page to spare for its own garbage collection
+
+# Entry type codes for the CSV encodings
+INT_TYPES = {
+    "u8": (0x01, "<B"), "i8": (0x11, "<b"), "u16": (0x02, "<H"), "i16": (0x12, "<h"),
+    "u32": (0x04, "<I"), "i32": (0x14, "<i"), "u64": (0x08, "<Q"), "i64": (0x18, "<q"),
+}
+TYPE_STRING = 0x21
+TYPE_BLOB_DATA = 0x42
+TYPE_BLOB_INDEX = 0x48
+
+# Partition table entries, as in the partitions.bin an ESP32 Arduino build writes at 0x8000
+PARTITION_ENTRY = struct.Struct("<2sBBII16sI")
+PARTITION_MAGIC = b"\xaa\x50"
+PARTITION_TYPE_DATA = 0x01
+PARTITION_SUBTYPE_NVS = 0x02
+
+# Where the Arduino core's default partition tables put NVS, for builds without a partitions.bin
+DEFAULT_NVS_OFFSET = 0x9000
+DEFAULT_NVS_SIZE = 0x5000
+
+# Column of the values CSV naming the device a row is for: its symbolic name or its USB serial number
+DEVICE_COLUMN = "device"
+
+
+class NvsError(Exception):
+    pass
+
+
+def _crc(data):
+    return zlib.crc32(data, 0xFFFFFFFF) & 0xFFFFFFFF
+
+
+# Class filling NVS pages entry by entry; pages close as FULL once the next item doesn't fit
+class NvsImage:
+    def __init__(self, size):
+        if size % PAGE_SIZE or size < MIN_PAGES * PAGE_SIZE:
+            raise NvsError(f"NVS size must be a multiple of {PAGE_SIZE} and at least {MIN_PAGES * PAGE_SIZE} bytes.")
+        self.size = size
+        self.pages = []
+        self.entry = 0
+        self.namespaces = {}
+        self.namespace = None
+        # Even an empty image has its first page started, as nvs_partition_gen.py writes it
+        self._new_page()
+
+    def _new_page(self):
+        if self.pages:
+            struct.pack_into("<I", self.pages[-1], 0, PAGE_FULL)
+        if len(self.pages) + 1 >= self.size // PAGE_SIZE:
+            raise NvsError(f"Data does not fit in an NVS partition of {self.size} bytes.")
+        page = bytearray(b"\xff" * PAGE_SIZE)
+        struct.pack_into("<IIB", page, 0, PAGE_ACTIVE, len(self.pages), FORMAT_VERSION)
+        struct.pack_into("<I", page, 28, _crc(bytes(page[4:28])))
+        self.pages.append(page)
+        self.entry = 0
+
+    # Function to make sure count entries fit in the current page, starting a new one if they don't
+    def _reserve(self, count):
+        if self.entry + count > ENTRIES_PER_PAGE:
+            self._new_page()
+
+    def _put(self, data, count):
+        page = self.pages[-1]
+        start = FIRST_ENTRY_OFFSET + self.entry * ENTRY_SIZE
+        page[start:start + len(data)] = data
+        for i in range(self.entry, self.entry + count):
+            page[32 + i // 4] &= ~(1 << ((i % 4) * 2)) & 0xFF  # 0b11 empty -> 0b10 written
+        self.entry += count
+
+    def _header(self, namespace, type_code, span, chunk, key, data):
+        encoded_key = key.encode()
+        if not encoded_key or len(encoded_key) > MAX_KEY_LENGTH:
+            raise NvsError(f"NVS key {key!r} must be 1 to {MAX_KEY_LENGTH} characters.")
+        entry = bytearray(struct.pack("<BBBB", namespace, type_code, span, chunk))
+        entry += b"\xff" * 4 + encoded_key.ljust(16, b"\x00") + data.ljust(8, b"\xff")
+        struct.pack_into("<I", entry, 4, _crc(bytes(entry[0:4] + entry[8:32])))
+        return entry
+
+    def _current_namespace(self, key):
+        if self.namespace is None:
+            raise NvsError(f"Key {key!r} comes before any namespace.")
+        return self.namespace
+
+    # Function to switch namespaces; one named again goes back to its first index (nvs_partition_gen.py 0.3.0 keeps
+    # filing the rows after it under the newest namespace, so the parity test doesn't reopen one)
+    def set_namespace(self, name):
+        if name not in self.namespaces:
+            self.namespaces[name] = len(self.namespaces) + 1
+            self._reserve(1)
+            self._put(self._header(0, INT_TYPES["u8"][0], 1, CHUNK_ANY, name, bytes([self.namespaces[name]])), 1)
+        self.namespace = self.namespaces[name]
+
+    def add_int(self, key, encoding, value):
+        type_code, fmt = INT_TYPES[encoding]
+        try:
+            data = struct.pack(fmt, value)
+        except struct.error:
+            raise NvsError(f"Value {value} of {key!r} does not fit in {encoding}.")
+        self._reserve(1)
+        self._put(self._header(self._current_namespace(key), type_code, 1, CHUNK_ANY, key, data), 1)
+
+    def add_string(self, key, text):
+        data = text.encode() + b"\x00"
+        if len(data) > MAX_STRING_SIZE:
+            raise NvsError(f"String {key!r} is longer than {MAX_STRING_SIZE - 1} bytes.")
+        count = (len(data) + ENTRY_SIZE - 1) // ENTRY_SIZE
+        # nvs_partition_gen.py never lets a string end on a page's last entry; matching it keeps images identical
+        self._reserve(count + 2)
+        header = struct.pack("<HHI", len(data), 0xFFFF, _crc(data))
+        self._put(self._header(self._current_namespace(key), TYPE_STRING, count + 1, CHUNK_ANY, key, header), 1)
+        self._put(data, count)
+
+    # Function to store a blob as data chunks that each fit the rest of a page, then an index entry
+    def add_blob(self, key, data):
+        namespace = self._current_namespace(key)
+        self._reserve(1)
+        offset = chunks = 0
+        while True:
+            room = (ENTRIES_PER_PAGE - self.entry - 1) * ENTRY_SIZE
+            chunk = data[offset:offset + room]
+            count = (len(chunk) + ENTRY_SIZE - 1) // ENTRY_SIZE
+            header = struct.pack("<HHI", len(chunk), 0xFFFF, _crc(chunk))
+            self._put(self._header(namespace, TYPE_BLOB_DATA, count + 1, chunks, key, header), 1)
+            self._put(chunk, count)
+            chunks += 1
+            offset += len(chunk)
+            if offset < len(data) or room - len(chunk) < ENTRY_SIZE:
+                self._new_page()
+            if offset >= len(data):
+                break
+        index = struct.pack("<IBB", len(data), chunks, 0)
+        self._put(self._header(namespace, TYPE_BLOB_INDEX, 1, CHUNK_ANY, key, index), 1)
+
+    # Function to get the partition image: the written pages, then erased flash up to the partition size
+    def to_bytes(self):
+        return b"".join(bytes(page) for page in self.pages).ljust(self.size, b"\xff")
+
+
+# Function to turn one CSV row's encoding and text into what gets stored
+def _decode_value(key, encoding, text):
+    if encoding in INT_TYPES:
+        try:
+            return int(text, 0)
+        except ValueError:
+            raise NvsError(f"Value {text!r} of {key!r} is not an integer.")
+    if encoding == "string":
+        return text
+    try:
+        if encoding == "hex2bin":
+            return binascii.unhexlify(text.strip())
+        if encoding == "base64":
+            return base64.b64decode(text.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise NvsError(f"Value of {key!r} is not valid {encoding}.")
+    raise NvsError(f"Unknown encoding {encoding!r} for {key!r}.")
+
+
+# Function to build an NVS image from rows in nvs_partition_gen.py's CSV format (key,type,encoding,value);
+# file rows name a file, relative to base_dir, whose contents are the value
+def generate(rows, size=DEFAULT_NVS_SIZE, base_dir="."):
+    image = NvsImage(size)
+    for row in rows:
+        key, kind = row["key"], row["type"]
+        encoding, value = row.get("encoding") or "", row.get("value") or ""
+        if kind == "namespace":
+            image.set_namespace(key)
+            continue
+        if kind == "file":
+            try:
+                with open(os.path.join(base_dir, value), "rb") as f:
+                    content = f.read()
+            except OSError as e:
+                raise NvsError(f"Could not read the file for {key!r}: {e}")
+            if encoding == "binary":
+                image.add_blob(key, content)
+                continue
+            value = content.decode()
+        elif kind != "data":
+            raise NvsError(f"Unknown type {kind!r} for {key!r}.")
+        decoded = _decode_value(key, encoding, value)
+        if encoding in INT_TYPES:
+            image.add_int(key, encoding, decoded)
+        elif encoding == "string":
+            image.add_string(key, decoded)
+        else:
+            image.add_blob(key, decoded)
+    return image.to_bytes()
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+# Function to read a CSV once per change of the file, since a batch asks for it once per device
+def _read_csv(path):
+    st = os.stat(path)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == (st.st_mtime_ns, st.st_size):
+            return cached[1]
+    with open(path, newline="") as f:
+        # Comment lines start with #, as in nvs_partition_gen.py's CSVs
+        rows = [row for row in csv.DictReader(line for line in f if not line.lstrip().startswith("#"))]
+    rows = [{k.strip(): (v or "").strip() for k, v in row.items() if k} for row in rows]
+    with _cache_lock:
+        _cache[path] = ((st.st_mtime_ns, st.st_size), rows)
+    return rows
+
+
+# Function to find a device's row in the values CSV, by symbolic name first, then by serial number
+def device_values(values_path, symbolic_name=None, serial_number=None):
+    rows = {row.get(DEVICE_COLUMN): row for row in _read_csv(values_path)}
+    for device in (symbolic_name, serial_number):
+        if device and device in rows:
+            return rows[device]
+    return None
+
+
+# Function to fill a template's {placeholders} with one device's values; serial_number and symbolic_name are
+# always available
+def render(template_rows, values):
+    rendered = []
+    for row in template_rows:
+        try:
+            rendered.append(dict(row, value=(row.get("value") or "").format_map(values)))
+        except KeyError as e:
+            raise NvsError(f"No value for {e} in {row['key']!r} of the template.")
+        except (ValueError, IndexError) as e:
+            raise NvsError(f"Bad placeholder in {row['key']!r} of the template: {e}")
+    return rendered
+
+
+# Function to list the entries of a partition table image
+def parse_partition_table(data):
+    partitions = []
+    for offset in range(0, len(data) - PARTITION_ENTRY.size + 1, PARTITION_ENTRY.size):
+        magic, kind, subtype, address, size, label, flags = PARTITION_ENTRY.unpack_from(data, offset)
+        if magic != PARTITION_MAGIC:
+            break
+        partitions.append({"type": kind, "subtype": subtype, "offset": address, "size": size,
+                           "label": label.rstrip(b"\x00").decode(errors="replace"), "flags": flags})
+    return partitions
+
+
+# Function to get (offset, size) of the NVS partition with a label, from partitions.bin or the Arduino default
+def nvs_location(partitions_path=None, label="nvs"):
+    if not partitions_path:
+        return DEFAULT_NVS_OFFSET, DEFAULT_NVS_SIZE
+    with open(partitions_path, "rb") as f:
+        for partition in parse_partition_table(f.read()):
+            if partition["label"] == label:
+                if (partition["type"], partition["subtype"]) != (PARTITION_TYPE_DATA, PARTITION_SUBTYPE_NVS):
+                    raise NvsError(f"Partition {label!r} is not an NVS partition.")
+                return partition["offset"], partition["size"]
+    raise NvsError(f"The partition table has no partition labelled {label!r}.")
+
+
+# Function to write a device's personalised NVS image under output_dir and return (offset, path) to flash;
+# None if the values CSV has no row for the device
+def device_image(template_path, values_path, output_dir, symbolic_name=None, serial_number=None,
+                 partitions_path=None, label="nvs"):
+    row = device_values(values_path, symbolic_name, serial_number)
+    if row is None:
+        return None
+    values = dict(row, symbolic_name=symbolic_name or "", serial_number=serial_number or "")
+    offset, size = nvs_location(partitions_path, label)
+    image = generate(render(_read_csv(template_path), values), size, os.path.dirname(os.path.abspath(template_path)))
+    os.makedirs(output_dir, exist_ok=True)
+    # The device column is free text; keep it to one safe file name
+    path = os.path.join(output_dir, re.sub(r"[^\w.-]", "_", f"{row[DEVICE_COLUMN]}.{label}.bin"))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(image)
+    os.replace(tmp_path, path)
+    return offset, path
+
+
+USAGE = """Usage:
+  python nvs_partition.py generate <input.csv> <output.bin> [size]
+  python nvs_partition.py device <template.csv> <values.csv> <device> <output dir> [partitions.bin]"""
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    try:
+        if args[:1] == ["generate"] and len(args) in (3, 4):
+            size = int(args[3], 0) if len(args) == 4 else DEFAULT_NVS_SIZE
+            with open(args[2], "wb") as f:
+                f.write(generate(_read_csv(args[1]), size, os.path.dirname(os.path.abspath(args[1]))))
+        elif args[:1] == ["device"] and len(args) in (5, 6):
+            result = device_image(args[1], args[2], args[4], symbolic_name=args[3], serial_number=args[3],
+                                  partitions_path=args[5] if len(args) == 6 else None)
+            if result is None:
+                print(f"{args[2]} has no row for {args[3]}.")
+                sys.exit(1)
+            print(f"0x{result[0]:x} {result[1]}")
+        else:
+            print(USAGE)
+            sys.exit(2)
+    except (OSError, NvsError) as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,188 @@
+import concurrent.futures
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+
+import rfc2217_station
+
+# Stations this controller drives, as "host" or "host:index_port"
+STATIONS_PATH = os.path.expanduser("~/.dognosis/stations.json")
+URL_SCHEME = "rfc2217://"
+
+QUERY_TIMEOUT = 1.0         # An unreachable station must not hold up the port list
+RTT_SAMPLES = 5
+RTT_CACHE_SECONDS = 60
+# Above this round trip, waiting for the station to acknowledge every DTR/RTS change stretches the reset
+# pulses more than pySerial's fixed 100 ms pause does, so the flasher stops waiting for the answers
+IGNORE_CONTROL_ANSWER_RTT = 0.05
+MIN_NETWORK_TIMEOUT = 3     # pySerial's own default for RFC2217 negotiation
+
+_lock = threading.Lock()
+_url_stations = {}  # rfc2217 URL -> station it was listed by
+_url_hwids = {}     # rfc2217 URL -> hwid of the device behind it, as its station reported it
+_rtts = {}          # station -> (measured at, round trip seconds)
+
+
+# Class shaped like pySerial's ListPortInfo, so remote ports go wherever comports() results go
+class RemotePortInfo:
+    def __init__(self, station, host, entry):
+        self.station = station
+        self.device = f"{URL_SCHEME}{host}:{entry['tcp_port']}"
+        self.name = entry["device"]
+        self.description = f"{entry['description']} @ {host}"
+        self.serial_number = entry.get("serial_number")
+        self.location = entry.get("location")
+        self.hwid = entry.get("hwid")
+        # Hubs are named after the station, so a batch limits concurrency per station hub, not per local hub
+        self.controller = f"{station}/{entry.get('controller')}"
+        self.hub = f"{station}/{entry.get('hub')}"
+        self.in_use = entry.get("in_use", False)
+
+
+def is_remote(port):
+    return isinstance(port, str) and port.startswith(URL_SCHEME)
+
+
+def _split_station(station):
+    host, _, port = station.rpartition(":") if station.count(":") == 1 else (station, "", "")
+    return (host, int(port)) if port else (station, rfc2217_station.INDEX_PORT)
+
+
+def load_stations(path=STATIONS_PATH):
+    try:
+        with open(path, "r") as f:
+            return list(json.load(f))
+    except (OSError, ValueError):
+        return []
+
+
+def save_stations(stations, path=STATIONS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(sorted(set(stations)), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Function to send one command to a station's index port and return its reply line
+def _query(station, command, timeout=QUERY_TIMEOUT):
+    with socket.create_connection(_split_station(station), timeout=timeout) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = sock.makefile("rb")
+        sock.sendall(command.encode() + b"\n")
+        return reader.readline().decode().strip()
+
+
+def list_station(station, timeout=QUERY_TIMEOUT):
+    host, _ = _split_station(station)
+    ports = [RemotePortInfo(station, host, entry) for entry in json.loads(_query(station, "list", timeout))]
+    with _lock:
+        for port in ports:
+            _url_stations[port.device] = station
+            _url_hwids[port.device] = port.hwid
+    return ports
+
+
+# Function to get the hwid string of a remote port listed in this process, or None
+def port_hwid(url):
+    with _lock:
+        return _url_hwids.get(url)
+
+
+# Function to list the ports of every configured station at once; stations that don't answer are left out
+def comports(stations=None, timeout=QUERY_TIMEOUT):
+    stations = load_stations() if stations is None else stations
+    if not stations:
+        return []
+    ports = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(stations), 16)) as pool:
+        futures = {pool.submit(list_station, station, timeout): station for station in stations}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                ports.extend(future.result())
+            except (OSError, ValueError) as e:
+                print(f"Station {futures[future]} unavailable: {e}", file=sys.stderr)
+    return sorted(ports, key=lambda port: port.device)
+
+
+# Function to measure a station's round trip with a few pings; the median ignores one slow outlier
+def measure_rtt(station, samples=RTT_SAMPLES, timeout=QUERY_TIMEOUT):
+    with socket.create_connection(_split_station(station), timeout=timeout) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = sock.makefile("rb")
+        times = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            sock.sendall(b"ping\n")
+            if reader.readline().strip() != b"pong":
+                raise OSError(f"Station {station} did not answer the ping.")
+            times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+# Function to get the round trip to the station behind an rfc2217 URL, measured at most once a minute
+def link_rtt(url):
+    if not is_remote(url):
+        return 0.0
+    with _lock:
+        station = _url_stations.get(url)
+    if station is None:
+        # Not listed in this process yet: the station's index runs on the default port of the same host
+        station = urllib.parse.urlsplit(url).hostname
+    with _lock:
+        cached = _rtts.get(station)
+    if cached and time.monotonic() - cached[0] < RTT_CACHE_SECONDS:
+        return cached[1]
+    try:
+        rtt = measure_rtt(station)
+    except OSError:
+        return 0.0
+    with _lock:
+        _rtts[station] = (time.monotonic(), rtt)
+    return rtt
+
+
+# Function to add the pySerial URL options that suit a link's round trip
+def compensated_url(url, rtt):
+    if not is_remote(url):
+        return url
+    parts = urllib.parse.urlsplit(url)
+    options = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    names = {name for name, _ in options}
+    if rtt >= IGNORE_CONTROL_ANSWER_RTT and "ign_set_control" not in names:
+        options.append(("ign_set_control", ""))
+    if "timeout" not in names:
+        options.append(("timeout", str(max(MIN_NETWORK_TIMEOUT, int(10 * rtt) + 1))))
+    query = "&".join(name if not value else f"{name}={value}" for name, value in options)
+    return urllib.parse.urlunsplit(parts._replace(query=query))
+
+
+USAGE = """Usage:
+  python remote_ports.py add <host[:index port]>
+  python remote_ports.py remove <host[:index port]>
+  python remote_ports.py list"""
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["add"] and len(args) == 2:
+        save_stations(load_stations() + [args[1]])
+    elif args[:1] == ["remove"] and len(args) == 2:
+        save_stations([s for s in load_stations() if s != args[1]])
+    elif args == ["list"]:
+        for station in load_stations():
+            try:
+                rtt = measure_rtt(station)
+                print(f"{station}: round trip {rtt * 1000:.1f} ms")
+                for port in list_station(station):
+                    busy = " (in use)" if port.in_use else ""
+                    print(f"  {port.device}  {port.name}  {port.description}  Serial: {port.serial_number}{busy}")
+            except (OSError, ValueError) as e:
+                print(f"{station}: unavailable ({e})")
+    else:
+        print(USAGE)
+        sys.exit(2)
@@ -0,0 +1,267 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+    import termios
+except ImportError:  # Windows: DTR and RTS are set one after the other
+    fcntl = None
+    termios = None
+
+import remote_ports
+import sysfs_ports
+
+# What each USB bridge and device has taught the flasher about getting its chip into the ROM loader
+LEARNED_PATH = os.path.expanduser("~/.dognosis/reset_sequences.json")
+
+# USB vendor IDs of the bridges found on ESP boards; the CH9102 behaves like the CH340 it replaces
+BRIDGE_VENDORS = {
+    0x10C4: "cp210x",
+    0x1A86: "ch340",
+    0x0403: "ftdi",
+    0x303A: "usb_jtag_serial",  # The chip's own USB-Serial/JTAG peripheral (ESP32-C3, -S3, ...)
+}
+
+# Sequences worth trying first on each bridge; the rest are only tried if those don't work
+PREFERRED_SEQUENCES = {
+    "cp210x": ("classic",),
+    "ch340": ("tight",),
+    "ftdi": ("classic",),
+    "usb_jtag_serial": ("usb_jtag",),
+}
+HOLD_TIMES = (0.03, 0.1)         # Seconds EN is held low; esptool always holds 100 ms
+RELEASE_DELAYS = (0.02, 0.05, 0.55)  # Seconds IO0 stays low after EN rises; esptool uses 50 ms, then 550 ms
+SYNC_ESTIMATE_MS = 30            # What a sync takes once the chip is in the ROM loader
+FAILED_TRY_MS = 600              # What a sequence that doesn't work costs before the next one is tried
+PREFERRED_PRIOR = 0.6            # Success chance assumed for an untried sequence the bridge prefers...
+OTHER_PRIOR = 0.3                # ...and for one it doesn't
+MAX_TRIES = 3                    # Learned sequences tried before falling back to esptool's full connect
+MIN_SUCCESS_RATE = 0.2           # Sequences below this after MIN_RETIRE_TRIES are no longer tried
+MIN_RETIRE_TRIES = 3
+HALF_LIFE_SECONDS = 7 * 24 * 3600  # Statistics fade by half in this time, so a retired sequence gets tried again
+
+_lock = threading.Lock()
+_learned = None
+
+
+# Function to set both lines in one call where the OS allows it, so the chip never sees the in-between state
+def _set_lines(port, dtr, rts):
+    fileno = getattr(port, "fileno", None)
+    if fcntl is not None and fileno is not None:
+        try:
+            status = int.from_bytes(fcntl.ioctl(fileno(), termios.TIOCMGET, bytes(4)), sys.byteorder)
+            status = (status | termios.TIOCM_DTR) if dtr else (status & ~termios.TIOCM_DTR)
+            status = (status | termios.TIOCM_RTS) if rts else (status & ~termios.TIOCM_RTS)
+            fcntl.ioctl(fileno(), termios.TIOCMSET, status.to_bytes(4, sys.byteorder))
+            return
+        except (OSError, ValueError, AttributeError):
+            pass  # Not a local tty (rfc2217://, loop://)
+    port.dtr = dtr
+    _set_rts(port, rts)
+
+
+def _set_rts(port, rts):
+    port.rts = rts
+    # Windows only applies RTS once DTR is written again
+    port.dtr = port.dtr
+
+
+# Function for esptool's classic sequence: reset with IO0 high, then release EN with IO0 held low
+def _classic(port, hold, delay):
+    port.dtr = False
+    _set_rts(port, True)
+    time.sleep(hold)
+    port.dtr = True
+    _set_rts(port, False)
+    time.sleep(delay)
+    port.dtr = False
+
+
+# Function for the same sequence with both lines changed together, for bridges that glitch between writes
+def _tight(port, hold, delay):
+    _set_lines(port, False, False)
+    _set_lines(port, True, True)
+    _set_lines(port, False, True)
+    time.sleep(hold)
+    _set_lines(port, True, False)
+    time.sleep(delay)
+    _set_lines(port, False, False)
+    port.dtr = False  # Brings pySerial's own idea of the lines back in step after the ioctls
+
+
+# Function for the USB-Serial/JTAG peripheral, which decodes the line changes itself instead of wiring them to pins
+def _usb_jtag(port, hold, delay):
+    _set_rts(port, False)
+    port.dtr = False
+    time.sleep(hold)
+    port.dtr = True
+    _set_rts(port, False)
+    time.sleep(hold)
+    _set_rts(port, True)
+    port.dtr = False
+    _set_rts(port, True)
+    time.sleep(delay)
+    port.dtr = False
+    _set_rts(port, False)
+
+
+SEQUENCES = {"classic": _classic, "tight": _tight, "usb_jtag": _usb_jtag}
+
+
+def candidate_key(candidate):
+    return f"{candidate['sequence']}/{candidate['hold'] * 1000:.0f}/{candidate['delay'] * 1000:.0f}"
+
+
+# Function to drive one candidate's DTR/RTS sequence on an open pySerial port
+def run(port, candidate):
+    SEQUENCES[candidate["sequence"]](port, candidate["hold"], candidate["delay"])
+
+
+# Function to list every candidate a bridge can be reset with
+def all_candidates(bridge):
+    names = ("usb_jtag",) if bridge == "usb_jtag_serial" else ("classic", "tight")
+    return [{"sequence": name, "hold": hold, "delay": delay}
+            for name in names for hold in HOLD_TIMES for delay in RELEASE_DELAYS]
+
+
+# Function to name the USB bridge behind a port from its vendor ID; None when it can't be told
+def bridge_for_port(port):
+    vid = None
+    if remote_ports.is_remote(port):
+        match = re.search(r"VID:PID=([0-9A-Fa-f]{4}):", remote_ports.port_hwid(port) or "")
+        vid = int(match.group(1), 16) if match else None
+    else:
+        device = os.path.realpath(port)
+        for info in sysfs_ports.comports():
+            if info.device and os.path.realpath(info.device) == device:
+                vid = info.vid
+                break
+    return BRIDGE_VENDORS.get(vid)
+
+
+def _load():
+    global _learned
+    if _learned is None:
+        try:
+            with open(LEARNED_PATH, "r") as f:
+                _learned = json.load(f)
+        except (OSError, ValueError):
+            _learned = {}
+        _learned.setdefault("bridges", {})
+        _learned.setdefault("devices", {})
+    return _learned
+
+
+def _save():
+    os.makedirs(os.path.dirname(LEARNED_PATH), exist_ok=True)
+    tmp_path = LEARNED_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_learned, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, LEARNED_PATH)
+
+
+# Function to fade stored [tries, successes, total ms of the successes, last update] by their age; entries
+# written before they carried a time count as fully faded
+def _decayed(stats, now):
+    if not stats:
+        return 0.0, 0.0, 0.0
+    tries, successes, success_ms = stats[:3]
+    updated = stats[3] if len(stats) > 3 else 0
+    weight = 0.5 ** (max(now - updated, 0) / HALF_LIFE_SECONDS)
+    return tries * weight, successes * weight, success_ms * weight
+
+
+# Function to estimate what connecting with a candidate costs, from its faded (tries, successes, total ms of
+# the successes); the untried start from a guess that counts as one try
+def _expected_ms(candidate, stats, preferred):
+    prior = PREFERRED_PRIOR if preferred else OTHER_PRIOR
+    tries, successes, success_ms = stats
+    rate = (successes + prior) / (tries + 1)
+    guess = (candidate["hold"] + candidate["delay"]) * 1000 + SYNC_ESTIMATE_MS
+    mean_ms = (success_ms + guess) / (successes + 1)
+    return mean_ms + (1 - rate) / rate * FAILED_TRY_MS, rate, tries
+
+
+# Function to order the candidates for a connect, fastest expected first: what this device has shown, else what
+# its bridge has, else the untried guess; sequences that keep failing are dropped
+def candidates(bridge, serial_number=None, limit=MAX_TRIES):
+    preferred = PREFERRED_SEQUENCES.get(bridge, ("classic",))
+    with _lock:
+        learned = _load()
+        bridge_stats = learned["bridges"].get(bridge or "unknown", {})
+        device_stats = learned["devices"].get(serial_number, {}) if serial_number else {}
+    ranked = []
+    now = time.time()
+    for candidate in all_candidates(bridge):
+        key = candidate_key(candidate)
+        stats = _decayed(device_stats.get(key) or bridge_stats.get(key), now)
+        expected, rate, tries = _expected_ms(candidate, stats, candidate["sequence"] in preferred)
+        if tries >= MIN_RETIRE_TRIES and rate < MIN_SUCCESS_RATE:
+            continue
+        ranked.append((expected, key, candidate))
+    ranked.sort(key=lambda item: item[:2])
+    return [candidate for _, _, candidate in ranked[:limit]]
+
+
+# Function to add a connect's tries, as reported by the flasher, to the bridge's and the device's statistics;
+# a connect that never reached the chip (unplugged, port busy) says nothing about the sequences and is ignored
+def record(bridge, serial_number, attempts):
+    if not any(a.get("ok") for a in attempts):
+        return
+    attempts = [a for a in attempts if a.get("sequence") in SEQUENCES]
+    if not attempts:
+        return
+    now = time.time()
+    with _lock:
+        learned = _load()
+        tables = [learned["bridges"].setdefault(bridge or "unknown", {})]
+        if serial_number:
+            tables.append(learned["devices"].setdefault(serial_number, {}))
+        for attempt in attempts:
+            key = candidate_key(attempt)
+            for table in tables:
+                tries, successes, success_ms = _decayed(table.get(key), now)
+                if attempt["ok"]:
+                    successes += 1
+                    success_ms += attempt["ms"]
+                table[key] = [round(tries + 1, 3), round(successes, 3), round(success_ms, 1), round(now)]
+        _save()
+
+
+# Function to forget a device's statistics, e.g. after its board was swapped for another kind
+def forget_device(serial_number):
+    with _lock:
+        if _load()["devices"].pop(serial_number, None) is not None:
+            _save()
+
+
+# Function to describe what has been learned for a bridge or device, best first
+def summary(table):
+    rows = []
+    now = time.time()
+    for key, stats in table.items():
+        tries, successes, success_ms = _decayed(stats, now)
+        mean = f"{success_ms / successes:.0f} ms" if successes else "-"
+        rows.append((-(successes / tries if tries else 0), key,
+                     f"{key}: {successes:.1f}/{tries:.1f} ok, mean {mean}"))
+    return [text for *_, text in sorted(rows)]
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["forget"] and len(args) == 2:
+        forget_device(args[1])
+    elif not args:
+        learned = _load()
+        for kind in ("bridges", "devices"):
+            for name, table in sorted(learned[kind].items()):
+                print(f"{kind[:-1]} {name}:")
+                for line in summary(table):
+                    print(f"  {line}")
+    else:
+        print("Usage: python reset_sequences.py [forget <serial number>]")
+        sys.exit(2)
@@ -0,0 +1,191 @@
+import json
+import socket
+import socketserver
+import sys
+import threading
+
+import serial
+import serial.rfc2217
+
+import sysfs_ports
+
+# A station answers "list" and "ping" on its index port and serves each device over RFC2217 on a port of its own
+INDEX_PORT = 4000
+BASE_PORT = 4001
+BIND_ADDRESS = "0.0.0.0"
+LOOPBACK_URL = "loop://"  # pySerial's built-in echo device, served with --loopback for testing without hardware
+READ_SIZE = 4096
+
+
+# Class serving one serial device to one RFC2217 client at a time
+class PortServer:
+    def __init__(self, device, tcp_port, bind=BIND_ADDRESS):
+        self.device = device
+        self.tcp_port = tcp_port
+        self.client = None
+        self._listener = socket.create_server((bind, tcp_port), reuse_port=False)
+        threading.Thread(target=self._accept, name=f"rfc2217 {device}", daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self._listener.accept()
+            except OSError:
+                return
+            if self.client is not None:
+                # One owner per device: a second controller would fight the first over the reset lines
+                sock.close()
+                continue
+            self.client = address
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        # Control-line and data messages are small; don't let Nagle hold them back
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        ser = serial.serial_for_url(self.device, do_not_open=True)
+        ser.timeout = 0.2
+        # Opening must not reset the board; the client drives DTR/RTS from here on
+        ser.dtr = False
+        ser.rts = False
+        send_lock = threading.Lock()
+
+        class Connection:
+            @staticmethod
+            def write(data):
+                with send_lock:
+                    sock.sendall(data)
+
+        try:
+            ser.open()
+        except serial.SerialException as e:
+            print(f"{self.device}: {e}")
+            sock.close()
+            self.client = None
+            return
+        connection = Connection()
+        manager = serial.rfc2217.PortManager(ser, connection)
+        running = threading.Event()
+        running.set()
+        reader = threading.Thread(target=self._to_network, args=(ser, manager, connection, running), daemon=True)
+        reader.start()
+        print(f"{self.device}: client {self.client[0]}:{self.client[1]} connected")
+        try:
+            while True:
+                data = sock.recv(READ_SIZE)
+                if not data:
+                    break
+                ser.write(b"".join(manager.filter(data)))
+        except (OSError, serial.SerialException):
+            pass
+        finally:
+            running.clear()
+            reader.join(timeout=1)
+            ser.close()
+            sock.close()
+            print(f"{self.device}: client {self.client[0]}:{self.client[1]} disconnected")
+            self.client = None
+
+    def _to_network(self, ser, manager, connection, running):
+        while running.is_set():
+            try:
+                data = ser.read(min(max(ser.in_waiting, 1), READ_SIZE))
+                if data:
+                    connection.write(b"".join(manager.escape(data)))
+                manager.check_modem_lines()
+            except (OSError, serial.SerialException):
+                running.clear()
+
+    def close(self):
+        self._listener.close()
+
+
+# Class answering the controller's "list" and "ping" requests, one request per line
+class _IndexHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for line in self.rfile:
+            command = line.strip().decode("ascii", errors="replace")
+            if command == "ping":
+                reply = "pong"
+            elif command == "list":
+                reply = json.dumps(self.server.station.list_ports())
+            else:
+                reply = json.dumps({"error": f"unknown command {command!r}"})
+            self.wfile.write((reply + "\n").encode())
+
+
+class _IndexServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# Class running a station: one RFC2217 server per local device, on ports that stay fixed while it runs
+class Station:
+    def __init__(self, bind=BIND_ADDRESS, index_port=INDEX_PORT, base_port=BASE_PORT, loopback=False):
+        self.bind = bind
+        self.base_port = base_port
+        self.loopback = loopback
+        self._servers = {}
+        self._lock = threading.Lock()
+        self.index = _IndexServer((bind, index_port), _IndexHandler)
+        self.index.station = self
+
+    def _server_for(self, device):
+        with self._lock:
+            server = self._servers.get(device)
+            if server is None:
+                server = PortServer(device, self.base_port + len(self._servers), self.bind)
+                self._servers[device] = server
+            return server
+
+    # Function to describe the station's ports: what comports() says, the RFC2217 port, and the USB hub
+    def list_ports(self):
+        import flash_scheduler  # Only needed for the hub topology, and it imports the flasher
+
+        ports = []
+        if self.loopback:
+            loopback = self._server_for(LOOPBACK_URL)
+            ports.append({"device": LOOPBACK_URL, "description": "Loopback", "serial_number": "LOOPBACK",
+                          "location": None, "hwid": "loop", "controller": "loop", "hub": "loop",
+                          "tcp_port": loopback.tcp_port, "in_use": loopback.client is not None})
+        for info in sysfs_ports.comports():
+            if not info.serial_number or not info.device:
+                continue
+            controller, hub = flash_scheduler.port_topology(info.location)
+            server = self._server_for(info.device)
+            ports.append({"device": info.device, "description": info.description,
+                          "serial_number": info.serial_number, "location": info.location, "hwid": info.hwid,
+                          "controller": controller, "hub": hub, "tcp_port": server.tcp_port,
+                          "in_use": server.client is not None})
+        return ports
+
+    def serve_forever(self):
+        self.index.serve_forever()
+
+    def close(self):
+        self.index.shutdown()
+        self.index.server_close()
+        with self._lock:
+            for server in self._servers.values():
+                server.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    loopback = "--loopback" in args
+    args = [a for a in args if a != "--loopback"]
+    if len(args) % 2:
+        print("Usage: python rfc2217_station.py [--bind ADDRESS] [--index-port N] [--base-port N] [--loopback]")
+        sys.exit(2)
+    options = dict(zip(args[::2], args[1::2]))
+    station = Station(options.get("--bind", BIND_ADDRESS), int(options.get("--index-port", INDEX_PORT)),
+                      int(options.get("--base-port", BASE_PORT)), loopback)
+    for port in station.list_ports():
+        print(f"{port['device']} ({port['serial_number']}) on rfc2217 port {port['tcp_port']}")
+    print(f"Station index on {station.bind}:{station.index.server_address[1]}")
+    try:
+        station.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        station.close()
@@ -0,0 +1,332 @@
+import codecs
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import time
+
+import serial
+
+import device_inventory
+import link_benchmark
+import serial_broker
+import tracing
+
+# A test script is JSON: {"name": ..., "baud": 115200, "timeout": 5, "fail_on": [regex, ...], "steps": [...]}.
+# Each step does one thing:
+#   {"send": "status\r\n"}                      text to write; {serial_number}, {symbolic_name}, {port} and the
+#                                               metrics captured so far are filled in ({{ and }} for braces)
+#   {"expect": "temp=(?P<temp_c>[\\d.]+)"}      regex to wait for; named groups become metrics, "timeout" overrides
+#                                               the script's, and "time_as": "boot_ms" stores the ms since the last
+#                                               send or reset as a metric
+#   {"fail_on": "Guru Meditation"}              regex that fails the run whenever it shows up from here on
+#   {"check": {"temp_c": [10, 60]}}             metric bounds, min or max may be null
+#   {"sleep": 0.5}                              seconds to let the device work
+#   {"reset": true}                             restart the board through RTS and drop what it printed before
+REPORT_DIR = os.path.expanduser("~/.dognosis/test_reports")
+DEFAULT_TIMEOUT = 5.0            # Seconds an expect step waits when neither it nor the script says otherwise
+READ_TIMEOUT = 0.1               # Longest wait for output before the cancel flag is checked again
+BUFFER_LIMIT = 64 * 1024         # Characters of unmatched output kept for the patterns to search
+OUTPUT_TAIL = 2048               # Characters of output kept in the report of a run that didn't pass
+ACTIONS = ("send", "expect", "fail_on", "check", "sleep", "reset")
+
+
+class ScriptError(Exception):
+    pass
+
+
+class StepFailed(Exception):
+    pass
+
+
+class TestCancelled(Exception):
+    pass
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# Function to check one step's arguments, so a malformed script is refused before it reaches any device
+def _check_step(step):
+    action = step["action"]
+    value = step[action]
+    if action in ("send", "expect", "fail_on") and not isinstance(value, str):
+        return f"{action} needs a string"
+    if action == "expect":
+        if "timeout" in step and not (_is_number(step["timeout"]) and step["timeout"] > 0):
+            return "timeout needs a positive number of seconds"
+        if "time_as" in step and not isinstance(step["time_as"], str):
+            return "time_as needs a metric name"
+    if action == "check":
+        if not isinstance(value, dict) or not value:
+            return "check needs an object of metric names and [min, max] bounds"
+        for name, bounds in value.items():
+            if (not isinstance(bounds, list) or len(bounds) != 2
+                    or not all(bound is None or _is_number(bound) for bound in bounds)):
+                return f"bounds of {name} need to be [min, max], either of which may be null"
+    if action == "sleep" and not (_is_number(value) and value >= 0):
+        return "sleep needs a number of seconds"
+    return None
+
+
+# Function to read and check a test script, compiling its patterns once for every device it runs on
+def load_script(path):
+    try:
+        with open(path, "r") as f:
+            script = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ScriptError(f"Could not read test script {path}: {e}")
+    if not isinstance(script, dict):
+        raise ScriptError(f"{path} is not a test script object.")
+    script.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    script.setdefault("baud", serial_broker.DEFAULT_BAUD)
+    script.setdefault("timeout", DEFAULT_TIMEOUT)
+    if not isinstance(script["name"], str) or not isinstance(script["baud"], int) or not (
+            _is_number(script["timeout"]) and script["timeout"] > 0):
+        raise ScriptError(f"{path} needs a string name, an integer baud and a positive timeout.")
+    fail_on = script.get("fail_on", [])
+    script["fail_on"] = [fail_on] if isinstance(fail_on, str) else fail_on
+    if not isinstance(script["fail_on"], list) or not all(isinstance(p, str) for p in script["fail_on"]):
+        raise ScriptError(f"fail_on of {path} needs a pattern or a list of patterns.")
+    steps = script.get("steps")
+    if not isinstance(steps, list) or not steps:
+        raise ScriptError(f"{path} has no steps.")
+    for index, step in enumerate(steps, 1):
+        actions = [action for action in ACTIONS if action in step] if isinstance(step, dict) else []
+        if len(actions) != 1:
+            raise ScriptError(f"Step {index} of {path} needs exactly one of {', '.join(ACTIONS)}.")
+        step["action"] = actions[0]
+        problem = _check_step(step)
+        if problem:
+            raise ScriptError(f"Step {index} of {path}: {problem}.")
+    try:
+        script["fail_on"] = [re.compile(pattern) for pattern in script["fail_on"]]
+        for step in steps:
+            if step["action"] in ("expect", "fail_on"):
+                step["pattern"] = re.compile(step[step["action"]])
+    except re.error as e:
+        raise ScriptError(f"Bad pattern in {path}: {e}")
+    return script
+
+
+# Function to turn a captured group into a number where it reads as one, so checks and reports can compare it
+def _metric_value(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except (TypeError, ValueError):
+            pass
+    return text
+
+
+# Class running one script on one device through the port's broker, so the monitor keeps showing the output
+class DeviceTest:
+    def __init__(self, script, port, serial_number=None, symbolic_name=None, cancel_event=None):
+        self.script = script
+        self.port = port
+        self.serial_number = serial_number
+        self.symbolic_name = symbolic_name
+        self.cancel_event = cancel_event
+        self.owner = f"test {script['name']}"
+        self.metrics = {}
+        self.fail_on = list(script["fail_on"])
+        self.text = ""
+        self.last_action = time.monotonic()  # When the device was last sent something or reset
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.broker = None
+        self.subscription = None
+
+    @property
+    def label(self):
+        return self.symbolic_name or self.serial_number or self.port
+
+    def _cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise TestCancelled("Test cancelled.")
+
+    def _take(self, timeout):
+        data = self.subscription.read(timeout)
+        if data:
+            self.text = (self.text + self._decoder.decode(data))[-BUFFER_LIMIT:]
+        return bool(data)
+
+    def _check_fail_on(self):
+        for pattern in self.fail_on:
+            match = pattern.search(self.text)
+            if match:
+                raise StepFailed(f"device printed {match.group(0)!r}")
+
+    def _expect(self, step):
+        timeout = step.get("timeout", self.script["timeout"])
+        deadline = time.monotonic() + timeout
+        while True:
+            self._check_fail_on()
+            match = step["pattern"].search(self.text)
+            if match:
+                self.text = self.text[match.end():]
+                return match
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise StepFailed(f"no {step['expect']!r} within {timeout}s")
+            self._cancelled()
+            self._take(min(remaining, READ_TIMEOUT))
+
+    def _run_step(self, step):
+        action = step["action"]
+        if action == "send":
+            values = dict(self.metrics, serial_number=self.serial_number, symbolic_name=self.symbolic_name,
+                          port=self.port)
+            try:
+                text = step["send"].format_map(values)
+            except (KeyError, IndexError, ValueError) as e:
+                raise StepFailed(f"cannot fill in {step['send']!r}: {e}")
+            self.broker.write(text.encode(), self.owner)
+            self.last_action = time.monotonic()
+        elif action == "expect":
+            match = self._expect(step)
+            self.metrics.update((name, _metric_value(value)) for name, value in match.groupdict().items()
+                                if value is not None)
+            if step.get("time_as"):
+                self.metrics[step["time_as"]] = round((time.monotonic() - self.last_action) * 1000, 1)
+        elif action == "fail_on":
+            self.fail_on.append(step["pattern"])
+        elif action == "check":
+            for name, (low, high) in step["check"].items():
+                value = self.metrics.get(name)
+                if not isinstance(value, (int, float)):
+                    raise StepFailed(f"no numeric {name} captured")
+                if (low is not None and value < low) or (high is not None and value > high):
+                    raise StepFailed(f"{name} = {value} is outside [{low}, {high}]")
+        elif action == "sleep":
+            deadline = time.monotonic() + step["sleep"]
+            while (remaining := deadline - time.monotonic()) > 0:
+                self._cancelled()
+                self._take(min(remaining, READ_TIMEOUT))
+        elif action == "reset":
+            while self._take(0):
+                pass
+            self.broker.hard_reset(self.owner)
+            self.last_action = time.monotonic()
+            self.text = ""
+
+    def _steps(self, report):
+        for index, step in enumerate(self.script["steps"], 1):
+            self._cancelled()
+            started = time.monotonic()
+            report["failed_step"] = index
+            self._run_step(step)
+            report["steps"].append({"step": index, "action": step["action"],
+                                    "ms": round((time.monotonic() - started) * 1000, 1)})
+        self._check_fail_on()
+        report["failed_step"] = None
+
+    # Function to run the script; returns the device's report, whose result is pass, fail, error or cancelled
+    def run(self):
+        report = {"port": self.port, "serial_number": self.serial_number, "symbolic_name": self.symbolic_name,
+                  "script": self.script["name"], "started": time.time(), "result": "pass", "failed_step": None,
+                  "reason": None, "steps": [], "metrics": self.metrics}
+        started = time.monotonic()
+        with tracing.span("serial test", "test", track=self.label, port=self.port,
+                          script=self.script["name"]) as attributes:
+            self.broker = serial_broker.get_broker(self.port, self.script["baud"])
+            # Subscribe before opening, so nothing the board prints on open is missed
+            self.subscription = self.broker.subscribe()
+            try:
+                self.broker.claim_write(self.owner)
+                self.broker.open()
+                self._steps(report)
+            except StepFailed as e:
+                report.update(result="fail", reason=str(e))
+            except TestCancelled as e:
+                report.update(result="cancelled", reason=str(e))
+            except (OSError, serial.SerialException, serial_broker.BrokerError) as e:
+                report.update(result="error", reason=str(e))
+            except Exception as e:
+                # Whatever else goes wrong stays this device's error instead of sinking the whole run's report
+                report.update(result="error", reason=f"{type(e).__name__}: {e}")
+            finally:
+                self.broker.release_write(self.owner)
+                self.subscription.close()
+                serial_broker.release_if_idle(self.port)
+            attributes["result"] = report["result"]
+        report["duration"] = round(time.monotonic() - started, 3)
+        if report["result"] != "pass":
+            report["output"] = self.text[-OUTPUT_TAIL:]
+        return report
+
+
+# Function to run a script on many devices at once, each on its own thread; targets are (port, serial number,
+# symbolic name) and on_result gets each device's report as it finishes, on that device's thread
+def run_all(script, targets, cancel_event=None, on_result=None):
+    reports = []
+    if not targets:
+        return reports
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="serial-test") as pool:
+        futures = [pool.submit(DeviceTest(script, *target, cancel_event=cancel_event).run) for target in targets]
+        for future in concurrent.futures.as_completed(futures):
+            report = future.result()
+            reports.append(report)
+            if on_result:
+                on_result(report)
+    return sorted(reports, key=lambda report: report["port"])
+
+
+# Function to keep a device's run in the inventory, next to its flashes and link benchmarks
+def record(report):
+    if report["serial_number"] and report["result"] != "cancelled":
+        device_inventory.record_test_run(report["serial_number"], report["script"], report["started"],
+                                         report["duration"], report["result"], report["failed_step"],
+                                         report["reason"], report["metrics"], report["port"])
+
+
+# Function to write the reports of one run to a JSON file; returns its path
+def save_report(script, reports, path=None):
+    if path is None:
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        path = os.path.join(REPORT_DIR, f"{script['name']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"script": script["name"], "devices": reports,
+                   "passed": sum(1 for report in reports if report["result"] == "pass")}, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Function to format one device's report as a line of the pass/fail summary
+def format_report(report):
+    label = report["symbolic_name"] or report["serial_number"] or report["port"]
+    line = f"{report['result'].upper():9} {label} ({report['duration']:.1f}s)"
+    if report["failed_step"]:
+        line += f" at step {report['failed_step']}"
+    if report["reason"]:
+        line += f": {report['reason']}"
+    if report["metrics"]:
+        line += "  " + " ".join(f"{name}={value}" for name, value in sorted(report["metrics"].items()))
+    return line
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    report_path = None
+    if "--report" in args:
+        at = args.index("--report")
+        report_path = args[at + 1] if at + 1 < len(args) else None
+        del args[at:at + 2]
+    if len(args) < 2 or ("--report" in sys.argv and report_path is None):
+        print("Usage: python send_expect.py <script.json> <port> [port ...] [--report FILE]")
+        sys.exit(2)
+    try:
+        script = load_script(args[0])
+    except ScriptError as e:
+        print(e)
+        sys.exit(2)
+    targets = [(port, link_benchmark.port_serial_number(port), None) for port in args[1:]]
+    reports = run_all(script, targets, on_result=lambda report: print(format_report(report)))
+    for report in reports:
+        record(report)
+    passed = sum(1 for report in reports if report["result"] == "pass")
+    print(f"{passed}/{len(reports)} passed. Report written to {save_report(script, reports, report_path)}")
+    serial_broker.shutdown_brokers()
+    sys.exit(0 if passed == len(reports) else 1)
@@ -0,0 +1,399 @@
+import contextlib
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import serial
+
+import hex_view
+import tracing
+
+DEFAULT_BAUD = 115200
+READ_SIZE = 4096                 # Most bytes taken from the device per read
+RING_CAPACITY = 4 * 1024 * 1024  # Bytes kept for subscribers that read at their own pace
+RECLAIM_SECONDS = 5.0            # A board re-enumerating after a flash may take a moment to come back
+RECLAIM_INTERVAL = 0.2
+TCP_HOST = "127.0.0.1"           # TCP consumers are local tools and scripts, never the network
+RESET_PULSE_SECONDS = 0.1        # How long EN is held low by hard_reset()
+
+
+class BrokerError(Exception):
+    pass
+
+
+class WriteDenied(BrokerError):
+    pass
+
+
+# Class for one consumer of a port: a callback run on the reader thread for every chunk, or a cursor into
+# the broker's ring that read() advances at the consumer's own pace
+class Subscription:
+    def __init__(self, broker, callback=None, on_status=None, from_start=False):
+        self.broker = broker
+        self.callback = callback
+        self.on_status = on_status
+        self.cursor = broker.ring.start if from_start else broker.ring.total
+        self.dropped = 0  # Bytes the ring overwrote before this consumer read them
+        self.closed = False
+
+    # Function to wait up to timeout seconds for bytes after the cursor; b"" on timeout or once closed
+    def read(self, timeout=None, size=READ_SIZE * 16):
+        ring = self.broker.ring
+        with self.broker._cond:
+            if not self.broker._cond.wait_for(lambda: self.closed or ring.total > self.cursor, timeout):
+                return b""
+            if self.closed:
+                return b""
+            if self.cursor < ring.start:
+                self.dropped += ring.start - self.cursor
+                self.cursor = ring.start
+            data = ring.read(self.cursor, size)
+            self.cursor += len(data)
+            return data
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+# Class owning one serial device: reads it on one thread into a shared ring and fans the bytes out
+class PortBroker:
+    def __init__(self, port, baudrate=DEFAULT_BAUD, ring_capacity=RING_CAPACITY):
+        self.port = port
+        self.baudrate = baudrate
+        self.ring = hex_view.ByteRing(ring_capacity)
+        self.serial = None
+        self.error = None
+        self._subscriptions = []
+        self._cond = threading.Condition()
+        self._reader = None
+        self._handovers = 0
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.serial is not None
+
+    def subscribers(self):
+        with self._cond:
+            return len(self._subscriptions)
+
+    def subscribe(self, callback=None, on_status=None, from_start=False):
+        with self._cond:
+            subscription = Subscription(self, callback, on_status, from_start)
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._cond:
+            subscription.closed = True
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+            self._cond.notify_all()
+
+    def _status(self, message):
+        with self._cond:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.on_status:
+                subscription.on_status(message)
+
+    # Function to open the device and start reading it; a port handed to the flasher stays closed until returned
+    def open(self):
+        with self._cond:
+            if self.serial is not None or self._handovers:
+                return
+            # serial_for_url so remote rfc2217:// ports are monitored like local ones
+            self.serial = serial.serial_for_url(self.port, baudrate=self.baudrate, timeout=0.2)
+            self.error = None
+            self._reader = threading.Thread(target=self._read, args=(self.serial,), name=f"broker {self.port}",
+                                            daemon=True)
+            self._reader.start()
+        self._status(f"Serial monitor started on {self.port}")
+
+    def _read(self, ser):
+        while True:
+            with self._cond:
+                if self.serial is not ser:
+                    break
+            try:
+                data = ser.read(min(max(ser.in_waiting, 1), READ_SIZE))
+            except (OSError, serial.SerialException, TypeError) as e:
+                # TypeError: pyserial's read on a port closed under it
+                with self._cond:
+                    if self.serial is not ser:
+                        break
+                    self.serial = None
+                    self.error = str(e)
+                self._status(f"Error reading from serial port: {e}")
+                with contextlib.suppress(Exception):
+                    ser.close()
+                break
+            if data:
+                self._deliver(data)
+
+    def _deliver(self, data):
+        with self._cond:
+            self.ring.append(data)
+            subscriptions = list(self._subscriptions)
+            self._cond.notify_all()
+        for subscription in subscriptions:
+            if subscription.callback:
+                try:
+                    subscription.callback(data)
+                except Exception as e:
+                    print(f"Serial subscriber failed: {e}", file=sys.stderr)
+
+    # Function to stop reading and close the device, keeping the ring and every subscription
+    def close(self):
+        with self._cond:
+            ser, reader = self.serial, self._reader
+            self.serial = None
+            self._reader = None
+        if ser is None:
+            return
+        if reader is not None and reader is not threading.current_thread():
+            reader.join(timeout=1)
+        # Whatever arrived after the reader's last read still belongs to the subscribers
+        with contextlib.suppress(Exception):
+            pending = ser.read(ser.in_waiting) if ser.in_waiting else b""
+            if pending:
+                self._deliver(pending)
+        with contextlib.suppress(Exception):
+            ser.close()
+
+    # Function to close the port and every subscription for good
+    def shutdown(self):
+        self.close()
+        with self._cond:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            self.unsubscribe(subscription)
+
+    # Function to lend the device to a tool that must open it itself (esptool, arduino-cli, the benchmark)
+    # and take it back afterwards; subscribers stay attached, and the boot output after a flash lands in the ring
+    @contextlib.contextmanager
+    def handed_over(self):
+        with self._cond:
+            self._handovers += 1
+            was_open = self.serial is not None or bool(self._subscriptions)
+        self.close()
+        if was_open:
+            self._status(f"Serial monitor paused, {self.port} handed over")
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._handovers -= 1
+                resume = not self._handovers and was_open
+            if resume:
+                self._reclaim()
+
+    def _reclaim(self):
+        deadline = time.monotonic() + RECLAIM_SECONDS
+        with tracing.span("monitor reconnect", "serial", port=self.port) as attributes:
+            attributes["tries"] = 0
+            while True:
+                attributes["tries"] += 1
+                try:
+                    self.open()
+                    return
+                except (OSError, serial.SerialException) as e:
+                    if time.monotonic() > deadline:
+                        self.error = attributes["error"] = str(e)
+                        self._status(f"Could not reopen {self.port} after hand-over: {e}")
+                        return
+                time.sleep(RECLAIM_INTERVAL)
+
+    # Function to reserve writing to the device for one owner until release_write()
+    def claim_write(self, owner):
+        with self._write_lock:
+            if self._writer not in (None, owner):
+                raise WriteDenied(f"{self.port} is being written by {self._writer}.")
+            self._writer = owner
+
+    def release_write(self, owner):
+        with self._write_lock:
+            if self._writer == owner:
+                self._writer = None
+
+    # Function to send bytes to the device; refused while another owner holds the write claim
+    def write(self, data, owner=None):
+        with self._write_lock:
+            if self._writer not in (None, owner):
+                raise WriteDenied(f"{self.port} is being written by {self._writer}.")
+            ser = self.serial
+            if ser is None:
+                raise BrokerError(f"{self.port} is not open.")
+            ser.write(data)
+
+    # Function to restart the board through RTS, like esptool's hard reset, keeping IO0 high so it boots the app
+    def hard_reset(self, owner=None):
+        with self._write_lock:
+            if self._writer not in (None, owner):
+                raise WriteDenied(f"{self.port} is being written by {self._writer}.")
+            ser = self.serial
+            if ser is None:
+                raise BrokerError(f"{self.port} is not open.")
+            ser.dtr = False
+            ser.rts = True
+            time.sleep(RESET_PULSE_SECONDS)
+            ser.rts = False
+
+
+# Class writing everything a port receives to a file, on its own thread so a slow disk never holds the reader up
+class FileLogger:
+    def __init__(self, broker, path):
+        self.path = path
+        self.subscription = broker.subscribe()
+        self._thread = threading.Thread(target=self._run, name=f"log {broker.port}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        with open(self.path, "ab") as f:
+            while not self.subscription.closed:
+                data = self.subscription.read(timeout=0.5)
+                if data:
+                    f.write(data)
+                    f.flush()
+
+    def stop(self):
+        self.subscription.close()
+        self._thread.join(timeout=2)
+
+
+# Class relaying one TCP client: port output to the socket, socket input to the port when allowed to write
+class _TcpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        broker = self.server.broker
+        owner = f"tcp {self.client_address[0]}:{self.client_address[1]}"
+        subscription = broker.subscribe()
+        sender = threading.Thread(target=self._send, args=(subscription,), daemon=True)
+        sender.start()
+        try:
+            while True:
+                data = self.request.recv(READ_SIZE)
+                if not data:
+                    break
+                try:
+                    broker.write(data, owner)
+                except BrokerError:
+                    pass  # Another owner has the port, or it is handed over; input is dropped
+        except OSError:
+            pass
+        finally:
+            subscription.close()
+            broker.release_write(owner)
+            sender.join(timeout=1)
+
+    def _send(self, subscription):
+        while not subscription.closed:
+            data = subscription.read(timeout=0.5)
+            if data:
+                try:
+                    self.request.sendall(data)
+                except OSError:
+                    break
+        with contextlib.suppress(OSError):
+            self.request.shutdown(socket.SHUT_RDWR)
+
+
+# Class serving a port's bytes to any number of localhost TCP clients
+class TcpFanout(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, broker, port=0, host=TCP_HOST):
+        super().__init__((host, port), _TcpHandler)
+        self.broker = broker
+        # Keeps the broker owning the device while the server runs, even with no client connected
+        self.anchor = broker.subscribe()
+        threading.Thread(target=self.serve_forever, name=f"tcp {broker.port}", daemon=True).start()
+
+    @property
+    def address(self):
+        return self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.anchor.close()
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def _key(port):
+    return port if "://" in port else os.path.realpath(port)
+
+
+# Function to get the broker of a port, creating it (closed) on first use; symlinks share their device's broker
+def get_broker(port, baudrate=DEFAULT_BAUD):
+    with _brokers_lock:
+        broker = _brokers.get(_key(port))
+        if broker is None:
+            broker = PortBroker(port, baudrate)
+            _brokers[_key(port)] = broker
+        return broker
+
+
+def find_broker(port):
+    with _brokers_lock:
+        return _brokers.get(_key(port))
+
+
+# Function to close a port's device once nobody is subscribed, so other programs can open it again
+def release_if_idle(port):
+    broker = find_broker(port)
+    if broker is not None and not broker.subscribers():
+        broker.close()
+
+
+# Function for code that opens a port itself: lends the device out of its broker, if it has one, for the block
+@contextlib.contextmanager
+def handed_over(port):
+    broker = find_broker(port)
+    if broker is None:
+        yield None
+        return
+    with broker.handed_over():
+        yield broker
+
+
+def shutdown_brokers():
+    with _brokers_lock:
+        brokers = list(_brokers.values())
+        _brokers.clear()
+    for broker in brokers:
+        broker.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or len(args) % 2 == 0:
+        print("Usage: python serial_broker.py <port> [--baud N] [--tcp PORT] [--log FILE]")
+        sys.exit(2)
+    options = dict(zip(args[1::2], args[2::2]))
+    broker = get_broker(args[0], int(options.get("--baud", DEFAULT_BAUD)))
+    server = TcpFanout(broker, int(options.get("--tcp", 0)))
+    logger = FileLogger(broker, options["--log"]) if "--log" in options else None
+    try:
+        broker.open()
+    except serial.SerialException as e:
+        print(e)
+        sys.exit(1)
+    print(f"Sharing {args[0]} on {server.address[0]}:{server.address[1]}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if logger:
+            logger.stop()
+        shutdown_brokers()
@@ -0,0 +1,300 @@
+import binascii
+import struct
+
+import numpy as np
+
+# Frames whose payload can't be longer than this are dropped as garbage instead of buffered forever
+MAX_FRAME_SIZE = 4096
+
+SLIP_END = 0xC0
+SLIP_ESC = 0xDB
+SLIP_ESC_END = 0xDC
+SLIP_ESC_ESC = 0xDD
+
+
+# Class holding every frame found in one received chunk as (start, end) slices into a single buffer
+class Frames:
+    def __init__(self, buf, starts, ends, errors=0):
+        self.buf = buf
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.starts)
+
+    def payloads(self):
+        return [self.buf[s:e].tobytes() for s, e in zip(self.starts, self.ends)]
+
+    def lines(self):
+        return [payload.decode("utf-8", errors="replace") for payload in self.payloads()]
+
+    # Function to decode every frame of the schema's size into one structured array in a single gather
+    def records(self, dtype):
+        size = dtype.itemsize
+        lengths = self.ends - self.starts
+        good = lengths == size
+        starts = self.starts[good]
+        if not len(starts):
+            return np.empty(0, dtype=dtype), int((~good).sum())
+        rows = self.buf[starts[:, None] + np.arange(size)]
+        return rows.view(dtype).reshape(-1), int((~good).sum())
+
+
+# Base class for framers: keeps the unfinished tail of the stream between chunks
+class Framer:
+    name = "raw"
+
+    def __init__(self):
+        self._pending = np.empty(0, dtype=np.uint8)
+
+    def _join(self, data):
+        chunk = np.frombuffer(data, dtype=np.uint8)
+        if len(self._pending):
+            chunk = np.concatenate([self._pending, chunk])
+        return chunk
+
+    def feed(self, data):
+        raise NotImplementedError
+
+    def reset(self):
+        self._pending = np.empty(0, dtype=np.uint8)
+
+
+# Function to split a buffer on a delimiter byte, keeping the tail after the last delimiter as pending
+def _split_on(buf, delimiter):
+    ends = np.flatnonzero(buf == delimiter)
+    if not len(ends):
+        return ends, ends, len(buf) if len(buf) <= MAX_FRAME_SIZE else None
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    return starts, ends, ends[-1] + 1
+
+
+# Framer for newline terminated text, the format read_from_port() always assumed
+class NewlineFramer(Framer):
+    name = "newline"
+
+    def feed(self, data):
+        buf = self._join(data)
+        starts, ends, tail = _split_on(buf, 0x0A)
+        if tail is None:
+            # An endless line: hand it over as one frame rather than buffering it forever
+            self.reset()
+            return Frames(buf, [0], [len(buf)])
+        self._pending = buf[tail:].copy() if len(starts) else buf.copy()
+        if not len(starts):
+            return Frames(buf, [], [])
+        # Drop the '\r' of CRLF endings
+        ends = ends - ((ends > starts) & (buf[np.maximum(ends - 1, 0)] == 0x0D))
+        return Frames(buf, starts, ends)
+
+
+# Framer for COBS encoded frames separated by 0x00
+class CobsFramer(Framer):
+    name = "cobs"
+
+    def feed(self, data):
+        buf = self._join(data)
+        starts, ends, tail = _split_on(buf, 0x00)
+        if tail is None:
+            self.reset()
+            return Frames(buf, [], [], errors=1)
+        self._pending = buf[tail:].copy() if len(starts) else buf.copy()
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+        if not len(starts):
+            return Frames(buf, [], [])
+        return self._decode(buf, starts, ends)
+
+    # Function to decode all frames at once by walking their code bytes in lock-step
+    def _decode(self, buf, starts, ends):
+        zero_at = np.zeros(len(buf), dtype=bool)
+        pos = starts.copy()
+        active = np.ones(len(starts), dtype=bool)
+        bad = np.zeros(len(starts), dtype=bool)
+        long_runs = np.zeros(len(starts), dtype=bool)
+        while active.any():
+            codes = buf[pos[active]].astype(np.int64)
+            bad[active] |= codes == 0
+            long_runs[active] |= codes == 0xFF
+            nxt = pos.copy()
+            nxt[active] = pos[active] + codes
+            inside = active & (nxt < ends)
+            # Every code byte after the first stands for a zero in the decoded data
+            zero_at[nxt[inside]] = True
+            bad |= active & (nxt > ends)
+            active = inside & ~bad
+            pos = nxt
+        decoded = np.where(zero_at, 0, buf).astype(np.uint8)
+
+        good = ~bad & ~long_runs
+        frames = Frames(decoded, starts[good] + 1, ends[good], errors=int(bad.sum()))
+        if long_runs.any():
+            # 0xFF codes drop their byte instead of zeroing it; those rare frames are decoded one by one
+            slow = long_runs & ~bad
+            extra = [cobs_decode(buf[s:e].tobytes()) for s, e in zip(starts[slow], ends[slow])]
+            frames = _append_payloads(frames, extra, np.concatenate([starts[good], starts[slow]]))
+        return frames
+
+
+# Function to decode a single COBS frame (without its 0x00 delimiter)
+def cobs_decode(data):
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if code == 0 or i + code > len(data) + 1:
+            raise ValueError("Invalid COBS frame.")
+        out += data[i + 1:i + code]
+        i += code
+        if code != 0xFF and i < len(data):
+            out.append(0)
+    return bytes(out)
+
+
+# Function to add separately decoded payloads to a Frames object; order gives each frame's position in the stream
+# (the frames' own first, then the payloads'), so the result keeps the order the frames arrived in
+def _append_payloads(frames, payloads, order=None):
+    if not payloads:
+        return frames
+    parts = [frames.buf] + [np.frombuffer(p, dtype=np.uint8) for p in payloads]
+    # offsets[k] is where part k ends, so payload k spans offsets[k]:offsets[k + 1]
+    offsets = np.cumsum([len(p) for p in parts])
+    buf = np.concatenate(parts)
+    starts = np.concatenate([frames.starts, offsets[:-1]])
+    ends = np.concatenate([frames.ends, offsets[1:]])
+    if order is not None:
+        by_position = np.argsort(order, kind="stable")
+        starts, ends = starts[by_position], ends[by_position]
+    return Frames(buf, starts, ends, frames.errors)
+
+
+# Framer for SLIP (RFC 1055) frames
+class SlipFramer(Framer):
+    name = "slip"
+
+    def feed(self, data):
+        buf = self._join(data)
+        starts, ends, tail = _split_on(buf, SLIP_END)
+        if tail is None:
+            self.reset()
+            return Frames(buf, [], [], errors=1)
+        self._pending = buf[tail:].copy() if len(starts) else buf.copy()
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+        if not len(starts):
+            return Frames(buf, [], [])
+
+        # Unescape the whole chunk at once, then map frame bounds onto the shorter buffer
+        body = buf[:tail]
+        esc = body == SLIP_ESC
+        out = body.copy()
+        follows_esc = np.zeros(len(body), dtype=bool)
+        follows_esc[1:] = esc[:-1]
+        out[follows_esc & (body == SLIP_ESC_END)] = SLIP_END
+        out[follows_esc & (body == SLIP_ESC_ESC)] = SLIP_ESC
+        bad_escape = follows_esc & (body != SLIP_ESC_END) & (body != SLIP_ESC_ESC)
+        keep_byte = ~esc
+        kept_before = np.concatenate([[0], np.cumsum(keep_byte)])
+
+        errors = 0
+        if bad_escape.any():
+            bad_frames = np.searchsorted(ends, np.flatnonzero(bad_escape))
+            good = np.ones(len(starts), dtype=bool)
+            good[bad_frames] = False
+            errors = int((~good).sum())
+            starts, ends = starts[good], ends[good]
+        return Frames(out[keep_byte], kept_before[starts], kept_before[ends], errors)
+
+
+# Framer for [sync][u16 length][payload][u16 CRC-CCITT] frames
+class LengthCrcFramer(Framer):
+    name = "length-crc"
+
+    def __init__(self, sync=b"\xAA\x55", crc_init=0xFFFF):
+        super().__init__()
+        self.sync = sync
+        self.crc_init = crc_init
+
+    def feed(self, data):
+        buf = self._join(data)
+        raw = buf.tobytes()
+        header = len(self.sync) + 2
+        starts, ends, errors = [], [], 0
+        i = 0
+        # Headers have to be walked in order, but each step skips a whole frame and the CRC runs in C
+        while True:
+            i = raw.find(self.sync, i)
+            if i < 0:
+                i = max(0, len(raw) - len(self.sync) + 1)
+                break
+            if i + header > len(raw):
+                break
+            (length,) = struct.unpack_from("<H", raw, i + len(self.sync))
+            if length > MAX_FRAME_SIZE:
+                errors += 1
+                i += 1
+                continue
+            end = i + header + length + 2
+            if end > len(raw):
+                break
+            payload_start = i + header
+            (crc,) = struct.unpack_from("<H", raw, payload_start + length)
+            if binascii.crc_hqx(raw[payload_start:payload_start + length], self.crc_init) != crc:
+                # Could be a sync pattern inside payload data; resynchronise on the next byte
+                errors += 1
+                i += 1
+                continue
+            starts.append(payload_start)
+            ends.append(payload_start + length)
+            i = end
+        self._pending = buf[i:].copy()
+        return Frames(buf, starts, ends, errors)
+
+
+FRAMERS = {
+    "newline": NewlineFramer,
+    "cobs": CobsFramer,
+    "slip": SlipFramer,
+    "length-crc": LengthCrcFramer,
+}
+
+
+# Function to build a NumPy record type from "name:type, ..." (types like u4, i2, f4; little-endian by default)
+def parse_schema(text):
+    fields = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, kind = part.partition(":")
+        kind = kind.strip()
+        if kind[:1] not in "<>=|":
+            kind = "<" + kind
+        fields.append((name.strip(), kind))
+    if not fields:
+        raise ValueError("Schema has no fields.")
+    return np.dtype(fields)
+
+
+# Class combining a framer with an optional record schema: bytes in, lines or records out
+class DecoderPipeline:
+    def __init__(self, framer="newline", schema=None):
+        self.framer = FRAMERS[framer]() if isinstance(framer, str) else framer
+        self.dtype = parse_schema(schema) if isinstance(schema, str) else schema
+        self.frames = 0
+        self.errors = 0
+
+    # Function to decode one received chunk; returns text lines, or a record array when a schema is set
+    def feed(self, data):
+        frames = self.framer.feed(data)
+        self.frames += len(frames)
+        self.errors += frames.errors
+        if self.dtype is None:
+            return frames.lines()
+        records, wrong_size = frames.records(self.dtype)
+        self.errors += wrong_size
+        return records
+
+    def reset(self):
+        self.framer.reset()
@@ -0,0 +1,178 @@
+import re
+import threading
+import time
+
+import numpy as np
+import tkinter as tk
+
+RING_SIZE = 100000     # Samples kept per channel
+MAX_CHANNELS = 8
+MAX_FPS = 20           # Redraws per second at most, however fast samples arrive
+PLOT_MARGIN = 6
+
+CHANNEL_COLOURS = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b", "#e377c2", "#17becf"]
+
+KEY_VALUE_PATTERN = re.compile(r"([A-Za-z_][\w.]*)\s*[=:]\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+
+
+# Class holding the latest samples of one channel in a fixed-size NumPy ring
+class ChannelRing:
+    def __init__(self, size=RING_SIZE):
+        self.data = np.full(size, np.nan)
+        self.pos = 0
+        self.count = 0
+
+    def extend(self, values):
+        size = len(self.data)
+        values = np.asarray(values, dtype=np.float64)[-size:]
+        n = len(values)
+        end = self.pos + n
+        if end <= size:
+            self.data[self.pos:end] = values
+        else:
+            first = size - self.pos
+            self.data[self.pos:] = values[:first]
+            self.data[:n - first] = values[first:]
+        self.pos = end % size
+        self.count = min(size, self.count + n)
+
+    # Function to copy out the stored samples, oldest first
+    def latest(self):
+        if self.count < len(self.data):
+            return self.data[:self.count].copy()
+        return np.concatenate((self.data[self.pos:], self.data[:self.pos]))
+
+
+# Function to reduce samples to a min and a max per pixel column, so drawing cost depends on width only
+def decimate_min_max(values, width):
+    n = len(values)
+    if n <= 2 * width:
+        return np.arange(n) * (width / max(n, 1)), values
+    edges = np.linspace(0, n, width + 1).astype(np.int64)[:-1]
+    mins = np.fmin.reduceat(values, edges)
+    maxs = np.fmax.reduceat(values, edges)
+    xs = np.repeat(np.arange(width, dtype=np.float64), 2)
+    ys = np.empty(2 * width)
+    ys[0::2] = mins
+    ys[1::2] = maxs
+    return xs, ys
+
+
+# Function to pull numbers out of CSV lines; every line with the same field count becomes one row
+def parse_csv_lines(lines):
+    rows = [line.split(",") for line in lines if "," in line]
+    if not rows:
+        return {}
+    width = len(rows[-1])
+    try:
+        table = np.array([row for row in rows if len(row) == width], dtype=np.float64)
+    except ValueError:
+        return {}
+    return {f"ch{i}": table[:, i] for i in range(width)}
+
+
+# Function to pull name=value (or name: value) pairs out of text lines
+def parse_key_value_lines(lines):
+    channels = {}
+    for line in lines:
+        for name, value in KEY_VALUE_PATTERN.findall(line):
+            channels.setdefault(name, []).append(float(value))
+    return channels
+
+
+# Class drawing the serial monitor's numeric channels on a Tk canvas
+class SerialPlot:
+    def __init__(self, parent, height=200):
+        self.canvas = tk.Canvas(parent, height=height, background="white", highlightthickness=0)
+        self.rings = {}
+        self.lines = {}
+        self.labels = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._running = False
+
+    # Function to add samples from a text chunk (CSV or key=value); called from the reader thread
+    def add_lines(self, lines):
+        channels = parse_key_value_lines(lines)
+        if not channels:
+            channels = parse_csv_lines(lines)
+        self._add(channels)
+
+    # Function to add every numeric field of a decoded record array
+    def add_records(self, records):
+        self._add({
+            name: records[name] for name in records.dtype.names
+            if np.issubdtype(records.dtype[name], np.number) and records.dtype[name].shape == ()
+        })
+
+    def _add(self, channels):
+        if not channels:
+            return
+        with self._lock:
+            for name, values in channels.items():
+                ring = self.rings.get(name)
+                if ring is None:
+                    if len(self.rings) >= MAX_CHANNELS:
+                        continue
+                    ring = self.rings[name] = ChannelRing()
+                ring.extend(values)
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self.rings.clear()
+            self._dirty = True
+        self.canvas.delete("all")
+        self.lines.clear()
+        self.labels.clear()
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._tick()
+
+    def stop(self):
+        self._running = False
+
+    # Function to redraw at most MAX_FPS times a second, and only when something new arrived
+    def _tick(self):
+        if not self._running:
+            return
+        started = time.monotonic()
+        if self._dirty:
+            self._redraw()
+        spent_ms = int((time.monotonic() - started) * 1000)
+        self.canvas.after(max(1, int(1000 / MAX_FPS) - spent_ms), self._tick)
+
+    def _redraw(self):
+        with self._lock:
+            self._dirty = False
+            snapshot = {name: ring.latest() for name, ring in self.rings.items()}
+        width = max(self.canvas.winfo_width() - 2 * PLOT_MARGIN, 10)
+        height = max(self.canvas.winfo_height() - 2 * PLOT_MARGIN, 10)
+
+        decimated = {name: decimate_min_max(values, width) for name, values in snapshot.items() if len(values)}
+        finite = [ys[np.isfinite(ys)] for _, ys in decimated.values()]
+        finite = [ys for ys in finite if len(ys)]
+        if not finite:
+            return
+        low = min(ys.min() for ys in finite)
+        high = max(ys.max() for ys in finite)
+        span = (high - low) or 1.0
+
+        for index, (name, (xs, ys)) in enumerate(decimated.items()):
+            colour = CHANNEL_COLOURS[index % len(CHANNEL_COLOURS)]
+            keep = np.isfinite(ys)
+            px = PLOT_MARGIN + xs[keep]
+            py = PLOT_MARGIN + height - (ys[keep] - low) / span * height
+            coords = np.column_stack((px, py)).ravel().tolist()
+            if len(coords) < 4:
+                continue
+            if name not in self.lines:
+                self.lines[name] = self.canvas.create_line(*coords, fill=colour)
+                self.labels[name] = self.canvas.create_text(
+                    PLOT_MARGIN + 4, PLOT_MARGIN + 12 * index, anchor="nw", fill=colour, font=("Helvetica", 9)
+                )
+            else:
+                self.canvas.coords(self.lines[name], *coords)
+            self.canvas.itemconfigure(self.labels[name], text=f"{name}: {snapshot[name][-1]:g}")
@@ -0,0 +1,237 @@
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import serial.tools.list_ports
+
+SYSFS_ROOT = "/sys"
+DEV_DIR = "/dev"
+# The only ttys that can carry a USB serial number; pySerial also scans ttyS*, ttyAMA*, rfcomm* and more
+TTY_PREFIXES = ("ttyUSB", "ttyACM", "ttyXRUSB")
+
+
+# Class with the ListPortInfo fields the apps use, so it can stand in for pySerial's results
+class PortInfo:
+    def __init__(self, device, name, serial_number, product, interface, location, vid, pid, usb_device_path):
+        self.device = device
+        self.name = name
+        self.serial_number = serial_number
+        self.product = product
+        self.interface = interface
+        self.location = location
+        self.vid = vid
+        self.pid = pid
+        self.usb_device_path = usb_device_path
+        # Same description and hwid strings pySerial builds, so display and matching code sees no difference
+        if interface is not None:
+            self.description = f"{product} - {interface}"
+        else:
+            self.description = product if product is not None else name
+        self.hwid = (f"USB VID:PID={vid or 0:04X}:{pid or 0:04X}"
+                     + (f" SER={serial_number}" if serial_number is not None else "")
+                     + (f" LOCATION={location}" if location is not None else ""))
+
+    def __repr__(self):
+        return f"PortInfo({self.device!r}, {self.description!r}, serial={self.serial_number!r})"
+
+
+def _read_line(*parts):
+    try:
+        with open(os.path.join(*parts)) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+# Class listing USB serial ports from /sys/class/tty, reading each device's attributes once
+class SysfsEnumerator:
+    def __init__(self, sysfs_root=SYSFS_ROOT, dev_dir=DEV_DIR):
+        self.tty_dir = os.path.join(sysfs_root, "class", "tty")
+        self.dev_dir = dev_dir
+        self._cache = {}  # tty name -> (identity of its sysfs entry, PortInfo or None)
+        self._lock = threading.Lock()
+        self.reads = 0    # Devices whose attributes were read, for the benchmark
+
+    # Function to read the attributes of one tty; None for ttys that aren't USB serial ports
+    def _read(self, name):
+        self.reads += 1
+        try:
+            device_path = os.path.realpath(os.path.join(self.tty_dir, name, "device"))
+        except OSError:
+            return None
+        # usb-serial drivers (ttyUSB) sit one level below the USB interface, CDC-ACM ttys on it directly
+        interface_path = os.path.dirname(device_path) if name.startswith(("ttyUSB", "ttyXRUSB")) else device_path
+        usb_device_path = os.path.dirname(interface_path)
+        vid = _read_line(usb_device_path, "idVendor")
+        if vid is None:
+            return None
+        pid = _read_line(usb_device_path, "idProduct")
+        try:
+            interfaces = int(_read_line(usb_device_path, "bNumInterfaces") or 1)
+        except ValueError:
+            interfaces = 1
+        location = os.path.basename(interface_path if interfaces > 1 else usb_device_path)
+        return PortInfo(
+            os.path.join(self.dev_dir, name), name, _read_line(usb_device_path, "serial"),
+            _read_line(usb_device_path, "product"), _read_line(interface_path, "interface"), location,
+            int(vid, 16), int(pid, 16) if pid else None, usb_device_path,
+        )
+
+    # Function to list the ports, re-reading only ttys that appeared or were re-created since the last call
+    def comports(self):
+        try:
+            entries = [entry for entry in os.scandir(self.tty_dir) if entry.name.startswith(TTY_PREFIXES)]
+        except OSError:
+            return []
+        ports = []
+        with self._lock:
+            seen = {}
+            for entry in entries:
+                try:
+                    # A re-plugged device gets a new sysfs node, and with it a new inode
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                identity = (st.st_ino, st.st_ctime_ns)
+                cached = self._cache.get(entry.name)
+                info = cached[1] if cached and cached[0] == identity else self._read(entry.name)
+                seen[entry.name] = (identity, info)
+                if info is not None:
+                    ports.append(info)
+            self._cache = seen
+        return sorted(ports, key=lambda port: port.device)
+
+
+_enumerator = SysfsEnumerator()
+
+
+# Function the apps call instead of pySerial's comports(); other platforms keep using pySerial
+def comports():
+    if sys.platform.startswith("linux") and os.path.isdir(_enumerator.tty_dir):
+        return _enumerator.comports()
+    return list(serial.tools.list_ports.comports())
+
+
+# Function to build a sysfs tree with count USB serial adapters behind 7-port hubs, plus the 32 ttyS
+# ports a PC typically has, laid out the way the kernel does
+def make_fake_sysfs(root, count):
+    sysfs = os.path.join(root, "sys")
+    dev = os.path.join(root, "dev")
+    tty_dir = os.path.join(sysfs, "class", "tty")
+    usb_serial_bus = os.path.join(sysfs, "bus", "usb-serial")
+    platform_bus = os.path.join(sysfs, "bus", "platform")
+    for path in (dev, tty_dir, usb_serial_bus, platform_bus):
+        os.makedirs(path, exist_ok=True)
+
+    def write(path, text):
+        with open(path, "w") as f:
+            f.write(text + "\n")
+
+    serial8250 = os.path.join(sysfs, "devices", "platform", "serial8250")
+    os.makedirs(serial8250)
+    os.symlink(platform_bus, os.path.join(serial8250, "subsystem"))
+    for i in range(32):
+        port_dir = os.path.join(serial8250, "tty", f"ttyS{i}")
+        os.makedirs(port_dir)
+        os.symlink(serial8250, os.path.join(port_dir, "device"))
+        os.symlink(port_dir, os.path.join(tty_dir, f"ttyS{i}"))
+        open(os.path.join(dev, f"ttyS{i}"), "w").close()
+
+    for i in range(count):
+        hub, port = divmod(i, 7)
+        usb_device = os.path.join(sysfs, "devices", "pci0000:00", "0000:00:14.0", "usb1", "1-1",
+                                  f"1-1.{hub + 1}", f"1-1.{hub + 1}.{port + 1}")
+        interface = os.path.join(usb_device, f"1-1.{hub + 1}.{port + 1}:1.0")
+        serial_port = os.path.join(interface, f"ttyUSB{i}")
+        tty = os.path.join(serial_port, "tty", f"ttyUSB{i}")
+        os.makedirs(tty)
+        for attr, value in (("idVendor", "10c4"), ("idProduct", "ea60"), ("serial", f"{i:016x}"),
+                            ("manufacturer", "Silicon Labs"), ("product", "CP2102 USB to UART Bridge Controller"),
+                            ("bNumInterfaces", " 1")):
+            write(os.path.join(usb_device, attr), value)
+        write(os.path.join(interface, "interface"), "CP2102 USB to UART Bridge Controller")
+        os.symlink(usb_serial_bus, os.path.join(serial_port, "subsystem"))
+        os.symlink(serial_port, os.path.join(tty, "device"))
+        os.symlink(tty, os.path.join(tty_dir, f"ttyUSB{i}"))
+        open(os.path.join(dev, f"ttyUSB{i}"), "w").close()
+    return sysfs, dev
+
+
+# Function to run pySerial's own Linux scanner against a fake tree, by redirecting its /sys and /dev paths
+def _pyserial_comports(sysfs, dev):
+    import serial.tools.list_ports_linux as linux
+
+    def redirect(path):
+        if path.startswith("/sys/"):
+            return sysfs + path[len("/sys"):]
+        if path.startswith("/dev/"):
+            return dev + path[len("/dev"):]
+        return path
+
+    fake_path = types.SimpleNamespace(
+        exists=lambda p: os.path.exists(redirect(p)), realpath=lambda p: os.path.realpath(redirect(p)),
+        islink=lambda p: os.path.islink(redirect(p)), basename=os.path.basename, dirname=os.path.dirname,
+        join=os.path.join,
+    )
+    fake_glob = types.SimpleNamespace(
+        glob=lambda pattern: ["/dev" + p[len(dev):] for p in glob.glob(redirect(pattern))]
+    )
+    real_os, real_glob = linux.os, linux.glob
+    linux.os, linux.glob = types.SimpleNamespace(path=fake_path), fake_glob
+    try:
+        return linux.comports()
+    finally:
+        linux.os, linux.glob = real_os, real_glob
+
+
+# Function to time pySerial's comports() and this enumerator, cold and with its cache warm
+def benchmark(count=128, rounds=20):
+    root = tempfile.mkdtemp(prefix="sysfs-bench-")
+    try:
+        sysfs, dev = make_fake_sysfs(root, count)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            expected = [p for p in _pyserial_comports(sysfs, dev) if p.serial_number]
+        pyserial_time = (time.perf_counter() - started) / rounds
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            cold = SysfsEnumerator(sysfs).comports()
+        cold_time = (time.perf_counter() - started) / rounds
+
+        enumerator = SysfsEnumerator(sysfs)
+        enumerator.comports()
+        reads = enumerator.reads
+        started = time.perf_counter()
+        for _ in range(rounds):
+            warm = enumerator.comports()
+        warm_time = (time.perf_counter() - started) / rounds
+
+        key = lambda p: (p.device, p.serial_number, p.description, p.location, p.hwid)
+        return {
+            "devices": count,
+            "pyserial_ms": pyserial_time * 1000,
+            "cold_ms": cold_time * 1000,
+            "warm_ms": warm_time * 1000,
+            "warm_rereads": enumerator.reads - reads,
+            "same_results": sorted(map(key, expected)) == sorted(map(key, cold)) == sorted(map(key, warm)),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["bench"]:
+        result = benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 128)
+        print(f"{result['devices']} devices: pySerial comports() {result['pyserial_ms']:.2f} ms, "
+              f"sysfs cold {result['cold_ms']:.2f} ms, sysfs cached {result['warm_ms']:.2f} ms "
+              f"({result['warm_rereads']} devices re-read) "
+              f"({'same results' if result['same_results'] else 'RESULTS DIFFER'})")
+        sys.exit(0 if result["same_results"] else 1)
+    for info in comports():
+        print(f"{info.device} - {info.description} | Serial: {info.serial_number} | {info.hwid}")
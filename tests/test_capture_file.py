@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import capture_file
+
+BURST_US = 2_000_000
+CHUNK = 4096
+
+
+def write_capture(path, close=True):
+    writer = capture_file.CaptureWriter(str(path), port="test")
+    written = []
+
+    def write(t_us, data):
+        writer.write(data, writer._start_ns + t_us * 1000)
+        written.append((t_us, data))
+
+    for i in range(4):
+        write(i * 500_000, f"tick {i}".encode())
+    # A burst at one time, long enough that the 64 KiB rule puts several keyframes on that same time
+    for i in range(100):
+        write(BURST_US, bytes([i]) * CHUNK)
+    for i in range(1, 4):
+        write(BURST_US + i * 500_000, f"after {i}".encode())
+    if close:
+        writer.close()
+    else:
+        writer.flush()
+    return written
+
+
+@pytest.mark.parametrize("close", [True, False], ids=["indexed", "unclosed"])
+def test_seek_to_a_keyframe_time_skips_nothing(tmp_path, close):
+    written = write_capture(tmp_path / "burst.dgcap", close)
+    reader = capture_file.CaptureReader(str(tmp_path / "burst.dgcap"))
+    try:
+        times = [t for t, _, _ in reader.keyframes]
+        assert times.count(BURST_US) > 1
+        assert list(reader.chunks(0)) == written
+        for start_us in sorted(set(times)):
+            assert list(reader.chunks(start_us)) == [(t, data) for t, data in written if t >= start_us]
+        assert list(reader.chunks(BURST_US + 1)) == [(t, data) for t, data in written if t > BURST_US]
+    finally:
+        reader.close()
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("tkinter")
+import hex_view
+
+
+def check_against(ring, stream):
+    assert ring.total == len(stream)
+    assert ring.start == max(0, len(stream) - ring.capacity)
+    assert ring.read(ring.start, ring.capacity) == stream[ring.start:]
+    for offset in range(ring.start, ring.total, 7):
+        assert ring.read(offset, 5) == stream[offset:offset + 5]
+
+
+def test_oversized_append_keeps_offsets():
+    ring = hex_view.ByteRing(16)
+    stream = b""
+    for chunk in (b"0123456789", bytes(range(100, 150)), b"tail", b"x" * 16, b"ABCDEFGHIJKLMNOPQRS"):
+        ring.append(chunk)
+        stream += chunk
+        check_against(ring, stream)
+    # Bytes that fell out of the ring are gone, even if asked for explicitly
+    assert ring.read(0, 4) == stream[ring.start:ring.start + 4]
+
+
+def test_find_after_oversized_append_and_across_the_seam():
+    ring = hex_view.ByteRing(16)
+    stream = b"abcdef" + b"-" * 30 + b"needle" + b"0123456"
+    ring.append(stream[:6])
+    ring.append(stream[6:])
+    assert ring.total == len(stream)
+    assert ring.find(b"needle") == stream.index(b"needle")
+    assert ring.find(b"abc") == -1  # Dropped with the front of the oversized chunk
+    assert ring.find(b"needle", stream.index(b"needle") + 1) == -1
+
+    # The pattern straddles the end of the buffer: its first half sits at the back, the rest wrapped to the front
+    ring = hex_view.ByteRing(16)
+    stream = b"." * 13 + b"SEAM" + b"..."
+    for i in range(0, len(stream), 3):
+        ring.append(stream[i:i + 3])
+    assert ring.find(b"SEAM") == stream.index(b"SEAM")
+    assert ring.read(stream.index(b"SEAM"), 4) == b"SEAM"
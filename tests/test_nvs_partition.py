@@ -0,0 +1,92 @@
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nvs_partition
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nvs")
+PARITY_SIZE = 0x6000
+
+
+def parity_image():
+    rows = nvs_partition._read_csv(os.path.join(DATA_DIR, "parity.csv"))
+    return nvs_partition.generate(rows, PARITY_SIZE, DATA_DIR)
+
+
+def entry_states(page):
+    return [(page[32 + i // 4] >> ((i % 4) * 2)) & 0b11 for i in range(nvs_partition.ENTRIES_PER_PAGE)]
+
+
+def test_generate_matches_reference_generator():
+    with open(os.path.join(DATA_DIR, "parity.bin"), "rb") as f:
+        expected = f.read()
+    image = parity_image()
+    for offset in range(0, len(expected), nvs_partition.PAGE_SIZE):
+        page = offset // nvs_partition.PAGE_SIZE
+        assert image[offset:offset + nvs_partition.PAGE_SIZE] == expected[offset:offset + nvs_partition.PAGE_SIZE], \
+            f"page {page} differs"
+    assert len(image) == len(expected)
+
+
+def test_pages_headers_crcs_and_bitmaps_agree():
+    image = parity_image()
+    pages = [image[i:i + nvs_partition.PAGE_SIZE] for i in range(0, len(image), nvs_partition.PAGE_SIZE)]
+    used = [page for page in pages if page[:4] != b"\xff" * 4]
+    assert [struct.unpack_from("<I", page)[0] for page in used] == \
+        [nvs_partition.PAGE_FULL] * (len(used) - 1) + [nvs_partition.PAGE_ACTIVE]
+    assert all(page == b"\xff" * nvs_partition.PAGE_SIZE for page in pages[len(used):])
+
+    for number, page in enumerate(used):
+        state, sequence, version = struct.unpack_from("<IIB", page)
+        assert (sequence, version) == (number, nvs_partition.FORMAT_VERSION)
+        assert struct.unpack_from("<I", page, 28)[0] == nvs_partition._crc(page[4:28])
+        states = entry_states(page)
+        i = 0
+        while i < nvs_partition.ENTRIES_PER_PAGE and states[i] == 0b10:
+            entry = page[nvs_partition.FIRST_ENTRY_OFFSET + i * 32:nvs_partition.FIRST_ENTRY_OFFSET + (i + 1) * 32]
+            span = entry[2]
+            assert struct.unpack_from("<I", entry, 4)[0] == nvs_partition._crc(entry[0:4] + entry[8:32])
+            assert states[i:i + span] == [0b10] * span, f"page {number} entry {i} spans unwritten entries"
+            if entry[1] in (nvs_partition.TYPE_STRING, nvs_partition.TYPE_BLOB_DATA):
+                size, _, crc = struct.unpack_from("<HHI", entry, 24)
+                start = nvs_partition.FIRST_ENTRY_OFFSET + (i + 1) * 32
+                assert nvs_partition._crc(page[start:start + size]) == crc
+                assert span == 1 + (size + 31) // 32
+            i += span
+        assert all(s == 0b11 for s in states[i:]), f"page {number} has written entries after the first free one"
+
+
+def test_reentered_namespace_keeps_its_index():
+    image = nvs_partition.NvsImage(PARITY_SIZE)
+    for namespace, key in (("first", "a"), ("second", "b"), ("first", "c")):
+        image.set_namespace(namespace)
+        image.add_int(key, "u8", 1)
+    page = image.to_bytes()
+    entries = [page[nvs_partition.FIRST_ENTRY_OFFSET + i * 32:][:24] for i in range(image.entry)]
+    assert [(entry[0], entry[8:24].rstrip(b"\x00")) for entry in entries] == \
+        [(0, b"first"), (1, b"a"), (0, b"second"), (2, b"b"), (1, b"c")]
+
+
+def test_device_image_prefers_symbolic_name_over_serial(tmp_path):
+    template = tmp_path / "template.csv"
+    template.write_text("key,type,encoding,value\napp,namespace,,\nlabel,data,string,{label}\n")
+    values = tmp_path / "values.csv"
+    values.write_text("device,label\nSER123,by-serial\nbench1,by-name\n")
+    output = tmp_path / "out"
+
+    def image_for(symbolic_name, serial_number):
+        result = nvs_partition.device_image(str(template), str(values), str(output), symbolic_name, serial_number)
+        if result is None:
+            return None
+        offset, path = result
+        assert offset == nvs_partition.DEFAULT_NVS_OFFSET
+        with open(path, "rb") as f:
+            return os.path.basename(path), f.read()
+
+    name, image = image_for("bench1", "SER123")
+    assert name == "bench1.nvs.bin" and b"by-name\x00" in image and b"by-serial" not in image
+    name, image = image_for("unlisted", "SER123")
+    assert name == "SER123.nvs.bin" and b"by-serial\x00" in image
+    assert image_for("unlisted", "SER999") is None
@@ -0,0 +1,64 @@
+import os
+import socket
+import sys
+import threading
+
+import pytest
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import remote_ports
+import rfc2217_station
+import udev_helper
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def station():
+    station = rfc2217_station.Station("127.0.0.1", 0, free_port(), loopback=True)
+    thread = threading.Thread(target=station.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{station.index.server_address[1]}"
+    station.close()
+    thread.join(timeout=5)
+
+
+def loopback_port(station):
+    ports = [port for port in remote_ports.comports([station]) if port.serial_number == "LOOPBACK"]
+    assert len(ports) == 1
+    return ports[0]
+
+
+def test_station_loopback_round_trip(station):
+    port = loopback_port(station)
+    assert remote_ports.is_remote(port.device)
+    assert port.name == rfc2217_station.LOOPBACK_URL
+    assert port.hub == f"{station}/loop"
+    assert remote_ports.measure_rtt(station) >= 0
+
+    url = remote_ports.compensated_url(port.device, remote_ports.link_rtt(port.device))
+    assert "timeout=" in url
+    with serial.serial_for_url(url, timeout=2) as ser:
+        payload = bytes(range(256)) + b"\xff\xff done"
+        ser.write(payload)
+        echoed = b""
+        while len(echoed) < len(payload):
+            chunk = ser.read(len(payload) - len(echoed))
+            assert chunk, "station stopped echoing"
+            echoed += chunk
+    assert echoed == payload
+
+
+def test_station_port_never_gets_a_local_symbolic_name(station, tmp_path):
+    port = loopback_port(station)
+    rules = tmp_path / "99-esp32.rules"
+    rules.write_text(udev_helper.make_rule(port.serial_number, "esp_bench1"))
+    assert udev_helper.symbolic_name_by_serial(port.serial_number, str(rules)) == "esp_bench1"
+    assert udev_helper.symbolic_name_for_port("/dev/ttyUSB0", port.serial_number, str(rules)) == "esp_bench1"
+    assert udev_helper.symbolic_name_for_port(port.device, port.serial_number, str(rules)) is None
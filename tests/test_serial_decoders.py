@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serial_decoders
+
+
+def cobs_encode(data):
+    out = bytearray()
+    block = bytearray()
+    for byte in data:
+        if byte == 0:
+            out += bytes([len(block) + 1]) + block
+            block.clear()
+            continue
+        block.append(byte)
+        if len(block) == 254:
+            out += b"\xff" + block
+            block.clear()
+    out += bytes([len(block) + 1]) + block
+    return bytes(out)
+
+
+def test_cobs_keeps_order_around_a_long_run():
+    payloads = [b"first\x00frame", bytes(range(1, 256)) * 2, b"\x00third", b"fourth"]
+    stream = b"".join(cobs_encode(payload) + b"\x00" for payload in payloads)
+    frames = serial_decoders.CobsFramer().feed(stream)
+    assert frames.errors == 0
+    assert frames.payloads() == payloads
@@ -0,0 +1,181 @@
+import atexit
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# Switch span recording on with DOGNOSIS_TRACE=1 (trace under TRACE_DIR) or DOGNOSIS_TRACE=<path.json>
+ENV_SWITCH = "DOGNOSIS_TRACE"
+TRACE_DIR = os.path.expanduser("~/.dognosis/traces")
+MAX_EVENTS = 500_000  # Spans kept per session; a runaway loop must not eat the station's memory
+TRACK_TID_BASE = 1_000_000  # Named tracks (one per device) get thread ids that can't collide with real ones
+
+
+def enabled():
+    return os.environ.get(ENV_SWITCH, "") not in ("", "0")
+
+
+def _now_us():
+    return time.monotonic_ns() / 1000
+
+
+# Class collecting finished spans as Chrome trace events, ready for chrome://tracing or ui.perfetto.dev
+class Tracer:
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.events = []
+        self.dropped = 0
+        self._tracks = {}   # Track name -> tid
+        self._threads = {}  # tid -> thread name
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # Function to get the (track, attributes) the calling thread's open spans pass on to new ones
+    def context(self):
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else (None, {})
+
+    def _tid(self, track, thread=None):
+        with self._lock:
+            if track is None:
+                tid, name = thread or (threading.get_native_id(), threading.current_thread().name)
+                self._threads.setdefault(tid, name)
+            else:
+                tid = self._tracks.setdefault(track, TRACK_TID_BASE + len(self._tracks))
+            return tid
+
+    # Function to add one finished span; times are _now_us() values, and thread is a (native id, name) pair for
+    # spans measured on behalf of another thread
+    def record(self, name, start_us, end_us, category="app", track=None, thread=None, **attributes):
+        tid = self._tid(track, thread)
+        event = {"name": name, "cat": category, "ph": "X", "ts": round(start_us, 1),
+                 "dur": round(max(end_us - start_us, 0), 1), "pid": self.pid, "tid": tid,
+                 "args": {k: v for k, v in attributes.items() if v is not None}}
+        with self._lock:
+            if len(self.events) >= MAX_EVENTS:
+                self.dropped += 1
+                return
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, category="app", track=None, **attributes):
+        parent_track, parent_attributes = self.context()
+        track = track if track is not None else parent_track
+        attributes = dict(parent_attributes, **attributes)
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append((track, attributes))
+        start = _now_us()
+        failed = None
+        try:
+            yield attributes
+        except BaseException as e:
+            failed = type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            self.record(name, start, _now_us(), category, track, **dict(attributes, error=failed))
+
+    # Function to get the trace as Chrome's JSON object format, with every track and thread named
+    def trace(self):
+        with self._lock:
+            events = list(self.events)
+            names = [(tid, name) for name, tid in self._tracks.items()] + list(self._threads.items())
+            dropped = self.dropped
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                     "args": {"name": os.path.basename(sys.argv[0]) or "python"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                     for tid, name in names]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                "otherData": {"dropped_spans": dropped}}
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.trace(), f)
+        os.replace(tmp_path, path)
+        return path
+
+
+# Class turning a stream of phase names (compile log lines, flash progress stages) into back-to-back spans
+# inside the span open where it was created; the phases may be reported from any thread
+class PhaseSpans:
+    def __init__(self, category="app"):
+        self.category = category
+        self.phase = None
+        self.started = None
+        self.attributes = {}
+        self.context = _tracer.context() if _tracer is not None else (None, {})
+        self.thread = (threading.get_native_id(), threading.current_thread().name)
+
+    def enter(self, phase, **attributes):
+        if phase == self.phase or _tracer is None:
+            return
+        now = _now_us()
+        self._finish(now)
+        self.phase, self.started, self.attributes = phase, now, attributes
+
+    def _finish(self, now):
+        if self.phase is not None:
+            track, context = self.context
+            _tracer.record(self.phase, self.started, now, self.category, track, self.thread,
+                           **dict(context, **self.attributes))
+        self.phase = None
+
+    def close(self):
+        if _tracer is not None:
+            self._finish(_now_us())
+
+
+_tracer = None
+if enabled():
+    _value = os.environ[ENV_SWITCH]
+    _tracer = Tracer(_value if _value.endswith(".json") else
+                     os.path.join(TRACE_DIR, f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"))
+    atexit.register(lambda: _tracer.events and _tracer.save())
+
+
+# Function to time a block as a span, with attributes merged over those of the span around it; a no-op when
+# tracing is off. track= puts the span (and the spans inside it) on a named row, e.g. one per device
+@contextlib.contextmanager
+def span(name, category="app", track=None, **attributes):
+    if _tracer is None:
+        yield attributes
+        return
+    with _tracer.span(name, category, track, **attributes) as merged:
+        yield merged
+
+
+# Function to write the trace so far; returns its path, or None when tracing is off
+def save():
+    if _tracer is None or not _tracer.events:
+        return None
+    return _tracer.save()
+
+
+# Function to total a saved trace's spans by name: count, total and longest duration in ms
+def summarize(path):
+    with open(path) as f:
+        events = [e for e in json.load(f)["traceEvents"] if e.get("ph") == "X"]
+    totals = collections.defaultdict(lambda: [0, 0.0, 0.0])
+    for event in events:
+        entry = totals[(event["cat"], event["name"])]
+        entry[0] += 1
+        entry[1] += event["dur"] / 1000
+        entry[2] = max(entry[2], event["dur"] / 1000)
+    return sorted(((cat, name, *values) for (cat, name), values in totals.items()), key=lambda row: -row[3])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python tracing.py <trace.json>")
+        sys.exit(2)
+    for cat, name, count, total_ms, longest_ms in summarize(sys.argv[1]):
+        print(f"{cat:8} {name:28} {count:6}x  total {total_ms:10.1f} ms  longest {longest_ms:9.1f} ms")
@@ -0,0 +1,301 @@
+import grp
+import json
+import os
+import re
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import tracing
+
+UDEV_RULE_PATH = '/etc/udev/rules.d/99-esp32.rules'  # Path to udev rules file
+
+# Socket the root helper listens on; members of HELPER_GROUP may send it requests
+HELPER_SOCKET_PATH = "/run/dognosis-udev.sock"
+HELPER_GROUP = "dialout"
+CONNECT_TIMEOUT = 2              # A helper that doesn't accept within this isn't running
+SETTLE_TIMEOUT = 120             # udevadm's own default wait for the event queue to drain
+REQUEST_TIMEOUT = SETTLE_TIMEOUT + 30  # Reply wait once sent; the helper's reload includes a settle
+MAX_REQUEST_SIZE = 64 * 1024
+MAX_OPS = 256
+
+# Serial numbers and names end up inside a udev rule, so only allow characters that can't break out of it
+SERIAL_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,64}$")
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]{0,63}$")
+
+RULE_SYMLINK_PATTERN = re.compile(r'SYMLINK\+="([^"]*)"')
+
+
+class UdevRuleError(Exception):
+    pass
+
+
+class HelperUnavailable(Exception):
+    pass
+
+
+# Raised once a request has reached the helper but no reply came back: the edits may have been applied, so they
+# must not be applied again directly
+class HelperTimeout(UdevRuleError):
+    pass
+
+
+def make_rule(serial_number, symbolic_name):
+    return f'SUBSYSTEM=="tty", ATTRS{{serial}}=="{serial_number}", SYMLINK+="{symbolic_name}"\n'
+
+
+def _check(op, key, pattern):
+    value = op.get(key)
+    if not isinstance(value, str) or not pattern.match(value):
+        raise UdevRuleError(f"Invalid {key} {value!r} in {op.get('op')} request.")
+    return value
+
+
+def _find(rules, symbolic_name):
+    for i, rule in enumerate(rules):
+        match = RULE_SYMLINK_PATTERN.search(rule)
+        if match and match.group(1) == symbolic_name:
+            return i
+    return None
+
+
+# Function to apply a batch of edits to the rule lines; raises UdevRuleError and leaves rules alone if any edit is bad
+def apply_ops(rules, ops):
+    if not isinstance(ops, list) or len(ops) > MAX_OPS:
+        raise UdevRuleError(f"Expected a list of at most {MAX_OPS} edits.")
+    rules = list(rules)
+    for op in ops:
+        kind = op.get("op") if isinstance(op, dict) else None
+        if kind == "add":
+            serial_number = _check(op, "serial", SERIAL_PATTERN)
+            name = _check(op, "name", NAME_PATTERN)
+            if _find(rules, name) is not None:
+                raise UdevRuleError(f"Symbolic name '{name}' is already in use.")
+            rules.append(make_rule(serial_number, name))
+        elif kind == "replace_serial":
+            name = _check(op, "name", NAME_PATTERN)
+            serial_number = _check(op, "serial", SERIAL_PATTERN)
+            i = _find(rules, name)
+            if i is None:
+                raise UdevRuleError(f"Symbolic name '{name}' not found.")
+            rules[i] = make_rule(serial_number, name)
+        elif kind == "rename":
+            old = _check(op, "old", NAME_PATTERN)
+            new = _check(op, "new", NAME_PATTERN)
+            i = _find(rules, old)
+            if i is None:
+                raise UdevRuleError(f"Symbolic name '{old}' not found.")
+            if _find(rules, new) is not None:
+                raise UdevRuleError(f"Symbolic name '{new}' is already in use.")
+            rules[i] = rules[i].replace(f'SYMLINK+="{old}"', f'SYMLINK+="{new}"')
+        elif kind == "delete":
+            name = _check(op, "name", NAME_PATTERN)
+            i = _find(rules, name)
+            if i is None:
+                raise UdevRuleError(f"Symbolic name '{name}' not found.")
+            del rules[i]
+        else:
+            raise UdevRuleError(f"Unknown edit {kind!r}.")
+    return rules
+
+
+def read_rules(path=UDEV_RULE_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return f.readlines()
+
+
+# Function to get the symbolic name a rule gives the device with this serial number, or None
+def symbolic_name_by_serial(serial_number, path=UDEV_RULE_PATH):
+    for rule in read_rules(path):
+        if serial_number in rule and 'SYMLINK+=' in rule:
+            return rule.split('SYMLINK+="')[1].split('"')[0]
+    return None
+
+
+# Function to get the local udev name of a port; a station's ports never have one, even if a local rule happens
+# to carry the same serial number, as that rule's symlink points at a device of this machine
+def symbolic_name_for_port(port_device, serial_number, path=UDEV_RULE_PATH):
+    import remote_ports  # Only needed to tell station URLs apart, and it imports pySerial
+
+    if remote_ports.is_remote(port_device):
+        return None
+    return symbolic_name_by_serial(serial_number, path)
+
+
+# Function to edit the rules file in place; the new file replaces the old one atomically
+def apply_ops_to_file(ops, path=UDEV_RULE_PATH):
+    with tracing.span("udev edit", "udev", ops=[op["op"] for op in ops]):
+        rules = apply_ops(read_rules(path), ops)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.writelines(rules)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    return len(ops)
+
+
+# Function to reload the rules and re-run them for tty devices only, returning once udev has settled
+def reload_rules(use_sudo=False):
+    prefix = ['sudo'] if use_sudo else []
+    with tracing.span("udev reload", "udev"):
+        subprocess.run(prefix + ['udevadm', 'control', '--reload-rules'], check=True)
+    with tracing.span("udev settle", "udev"):
+        subprocess.run(prefix + ['udevadm', 'trigger', '--subsystem-match=tty', '--settle'], check=True,
+                       timeout=SETTLE_TIMEOUT)
+
+
+# Class handling one client connection: one JSON request per line, one JSON reply per line
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        uid = self._peer_uid()
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_SIZE + 1)
+            if not line:
+                return
+            started = time.monotonic()
+            try:
+                if len(line) > MAX_REQUEST_SIZE:
+                    raise UdevRuleError("Request too large.")
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    raise UdevRuleError("Request is not valid JSON.")
+                if not isinstance(request, dict):
+                    raise UdevRuleError("Request must be a JSON object.")
+                reply = self.server.execute(request.get("ops", []), bool(request.get("reload", True)))
+                print(f"uid {uid}: {len(request.get('ops', []))} edits, reload={reply['reloaded']} "
+                      f"in {time.monotonic() - started:.3f}s")
+            except UdevRuleError as e:
+                reply = {"ok": False, "error": str(e)}
+            except (OSError, subprocess.SubprocessError) as e:
+                reply = {"ok": False, "error": f"Failed to apply udev changes: {e}"}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+    def _peer_uid(self):
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        return struct.unpack("3i", creds)[1]
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path=HELPER_SOCKET_PATH, rule_path=UDEV_RULE_PATH, group=HELPER_GROUP):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+        os.chown(socket_path, 0, grp.getgrnam(group).gr_gid)
+        os.chmod(socket_path, 0o660)
+        self.rule_path = rule_path
+        self._lock = threading.Lock()
+
+    # Function to apply one batch under the lock, so edits from several clients never interleave
+    def execute(self, ops, reload):
+        with self._lock:
+            changed = apply_ops_to_file(ops, self.rule_path) if ops else 0
+            if reload:
+                reload_rules()
+        return {"ok": True, "changed": changed, "reloaded": reload}
+
+
+def helper_available(socket_path=HELPER_SOCKET_PATH):
+    return os.path.exists(socket_path)
+
+
+# Function to send a batch of edits (and a reload) to the helper; raises HelperUnavailable if it can't be reached,
+# HelperTimeout if it was sent the edits but didn't answer, and UdevRuleError if it refuses them
+def request(ops, reload=True, socket_path=HELPER_SOCKET_PATH, timeout=REQUEST_TIMEOUT):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(socket_path)
+        except OSError as e:
+            raise HelperUnavailable(f"udev helper not reachable at {socket_path}: {e}")
+        reply = b""
+        try:
+            sock.settimeout(timeout)
+            sock.sendall((json.dumps({"ops": ops, "reload": reload}) + "\n").encode())
+            while not reply.endswith(b"\n"):
+                data = sock.recv(4096)
+                if not data:
+                    break
+                reply += data
+        except OSError as e:
+            raise HelperTimeout(f"No reply from the udev helper ({e}); the changes may still have been applied. "
+                                f"Refresh the port list before trying again.")
+    try:
+        reply = json.loads(reply)
+    except ValueError:
+        raise HelperTimeout("The udev helper closed the connection without replying; the changes may still have "
+                            "been applied. Refresh the port list before trying again.")
+    if not reply.get("ok"):
+        raise UdevRuleError(reply.get("error", "udev helper refused the request."))
+    return reply
+
+
+# Serialises direct edits from an app's worker threads, as the helper's lock does for its clients
+_direct_lock = threading.Lock()
+
+
+# Function the apps call to change rules: through the helper when it runs, else directly with sudo udevadm; only a
+# helper that can't be connected to falls back, as one that was sent the edits may have applied them
+def apply_changes(ops, reload=True, path=UDEV_RULE_PATH):
+    with tracing.span("udev change", "udev", ops=[op["op"] for op in ops], reload=reload):
+        if helper_available():
+            try:
+                with tracing.span("udev helper request", "udev"):
+                    return request(ops, reload)
+            except HelperUnavailable:
+                pass
+        with _direct_lock:
+            changed = apply_ops_to_file(ops, path) if ops else 0
+            if reload:
+                reload_rules(use_sudo=os.geteuid() != 0)
+        return {"ok": True, "changed": changed, "reloaded": reload}
+
+
+USAGE = """Usage:
+  sudo python udev_helper.py serve [group]
+  python udev_helper.py add <serial> <name>
+  python udev_helper.py replace <name> <new serial>
+  python udev_helper.py rename <old name> <new name>
+  python udev_helper.py delete <name>
+  python udev_helper.py reload"""
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["serve"] and len(args) <= 2:
+        if os.geteuid() != 0:
+            print("The udev helper has to run as root.")
+            sys.exit(1)
+        server = HelperServer(group=args[1] if len(args) == 2 else HELPER_GROUP)
+        print(f"udev helper listening on {HELPER_SOCKET_PATH}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(HELPER_SOCKET_PATH)
+        sys.exit(0)
+    commands = {
+        "add": lambda serial_number, name: {"op": "add", "serial": serial_number, "name": name},
+        "replace": lambda name, serial_number: {"op": "replace_serial", "name": name, "serial": serial_number},
+        "rename": lambda old, new: {"op": "rename", "old": old, "new": new},
+        "delete": lambda name: {"op": "delete", "name": name},
+    }
+    try:
+        if args[:1] == ["reload"] and len(args) == 1:
+            apply_changes([])
+        elif args and args[0] in commands and len(args) == commands[args[0]].__code__.co_argcount + 1:
+            apply_changes([commands[args[0]](*args[1:])])
+        else:
+            print(USAGE)
+            sys.exit(2)
+    except (UdevRuleError, OSError, subprocess.SubprocessError) as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,79 @@
+import concurrent.futures
+import queue
+import sys
+from tkinter import messagebox
+
+MAX_WORKERS = 2   # Port-manager work is file I/O, port scans and udevadm; a couple of threads is plenty
+POLL_MS = 50
+
+
+# Class running blocking port-manager operations on a small thread pool and their callbacks on the Tk thread
+class UiTaskRunner:
+    def __init__(self, root, max_workers=MAX_WORKERS, poll_ms=POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="port-manager")
+        self._done = queue.Queue()
+        self._running = {}  # Task key -> (button, its normal text) or None
+        self._rerun = {}    # Task key -> the latest request that arrived while it was running
+        self.root.after(self.poll_ms, self._poll)
+
+    def busy(self, key):
+        return key in self._running
+
+    # Function to start func(*args) in the pool unless a task with the same key is running
+    # on_done gets the result and on_error the exception, both on the Tk thread; with rerun_if_busy a request
+    # made while the task runs is started once it finishes, instead of being dropped
+    def run(self, key, func, *args, on_done=None, on_error=None, button=None, busy_text=None, rerun_if_busy=False):
+        if key in self._running:
+            if rerun_if_busy:
+                self._rerun[key] = (func, args, dict(on_done=on_done, on_error=on_error, button=button, busy_text=busy_text))
+            return False
+        restore = None
+        if button is not None:
+            restore = (button, button.cget("text"))
+            button.state(["disabled"])
+            if busy_text:
+                button.config(text=busy_text)
+        self._running[key] = restore
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda f: self._done.put((key, f, on_done, on_error)))
+        return True
+
+    def _poll(self):
+        try:
+            while True:
+                try:
+                    key, future, on_done, on_error = self._done.get_nowait()
+                except queue.Empty:
+                    break
+                self._finish(key, future, on_done, on_error)
+        finally:
+            # Re-armed whatever a callback did, or every later task's button would stay disabled
+            self.root.after(self.poll_ms, self._poll)
+
+    def _finish(self, key, future, on_done, on_error):
+        restore = self._running.pop(key, None)
+        try:
+            if restore:
+                button, text = restore
+                button.config(text=text)
+                button.state(["!disabled"])
+            error = future.exception()
+            if error is not None:
+                (on_error or self._report)(error)
+            elif on_done:
+                on_done(future.result())
+        except Exception:
+            # E.g. a TclError from a widget destroyed while the task ran; reported the way Tk reports its own
+            self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            if key in self._rerun:
+                func, args, kwargs = self._rerun.pop(key)
+                self.run(key, func, *args, **kwargs)
+
+    def _report(self, error):
+        messagebox.showerror("Error", str(error))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,136 @@
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Switch the watchdog on in any build with DOGNOSIS_UI_WATCHDOG=1
+ENV_SWITCH = "DOGNOSIS_UI_WATCHDOG"
+
+HEARTBEAT_MS = 100
+STALL_THRESHOLD_MS = 250
+HISTOGRAM_BUCKETS_MS = (250, 500, 1000, 2000, 5000, 10000)
+TOP_FRAMES = 10
+STALL_LOG_PATH = os.path.expanduser("~/.dognosis/ui_stalls.log")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def enabled():
+    return os.environ.get(ENV_SWITCH, "") not in ("", "0")
+
+
+# Function to name the call that blocked: the innermost frame of our own code, and what it was waiting in
+def _blocking_call(stack):
+    innermost = stack[-1]
+    for frame in reversed(stack):
+        if os.path.abspath(frame.filename).startswith(APP_DIR) and frame.filename != __file__:
+            where = f"{frame.name} ({os.path.basename(frame.filename)}:{frame.lineno})"
+            if frame is not innermost:
+                where += f" -> {innermost.name} ({os.path.basename(innermost.filename)}:{innermost.lineno})"
+            return where
+    return f"{innermost.name} ({os.path.basename(innermost.filename)}:{innermost.lineno})"
+
+
+# Class measuring how late Tk runs a heartbeat callback, and sampling the main thread's stack while it is late
+class StallWatchdog:
+    def __init__(self, root, heartbeat_ms=HEARTBEAT_MS, threshold_ms=STALL_THRESHOLD_MS, log_path=STALL_LOG_PATH,
+                 on_stall=None):
+        self.root = root
+        self.heartbeat = heartbeat_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.log_path = log_path
+        self.on_stall = on_stall
+        self.histogram = [0] * len(HISTOGRAM_BUCKETS_MS)
+        self.samples = collections.Counter()  # Blocking calls seen in the main thread's stack during stalls
+        self.stalls = 0
+        self.worst = 0.0
+        self._lock = threading.Lock()
+        self._main_ident = threading.main_thread().ident
+        self._last_beat = time.monotonic()
+        self._stall_stack = None
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._last_beat = time.monotonic()
+        self.root.after(int(self.heartbeat * 1000), self._beat)
+        threading.Thread(target=self._sample, name="ui-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+
+    # Heartbeat on the Tk thread: any delay beyond its own interval is time the event loop was blocked
+    def _beat(self):
+        now = time.monotonic()
+        with self._lock:
+            lag = now - self._last_beat - self.heartbeat
+            stack = self._stall_stack
+            self._stall_stack = None
+            self._last_beat = now
+        if lag >= self.threshold:
+            self._record(lag, stack)
+        if self._running:
+            self.root.after(int(self.heartbeat * 1000), self._beat)
+
+    # Sampler thread: while a heartbeat is overdue, grab the main thread's stack to see what it is stuck in
+    def _sample(self):
+        while self._running:
+            time.sleep(self.heartbeat)
+            with self._lock:
+                overdue = time.monotonic() - self._last_beat - self.heartbeat
+                if overdue < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self._main_ident)
+                if frame is None:
+                    continue
+                stack = traceback.extract_stack(frame)
+                del frame
+                if self._stall_stack is None:
+                    self._stall_stack = stack
+                self.samples[_blocking_call(stack)] += 1
+
+    def _record(self, lag, stack):
+        lag_ms = lag * 1000
+        bucket = sum(1 for limit in HISTOGRAM_BUCKETS_MS if lag_ms >= limit)
+        self.histogram[max(bucket - 1, 0)] += 1
+        self.stalls += 1
+        self.worst = max(self.worst, lag)
+        message = f"UI stalled for {lag_ms:.0f} ms"
+        if stack:
+            message += f" in {_blocking_call(stack)}"
+        self._log(message, stack)
+        if self.on_stall:
+            self.on_stall(message)
+
+    def _log(self, message, stack=None):
+        when = time.strftime("%Y-%m-%d %H:%M:%S")
+        text = f"{when} {message}\n"
+        if stack:
+            text += "".join(traceback.format_list(stack))
+        sys.stderr.write(text)
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "a") as f:
+                f.write(text)
+        except OSError:
+            pass
+
+    # Function to describe the stall histogram and the calls most often caught blocking the loop
+    def summary(self):
+        lines = [f"{self.stalls} UI stalls of {self.threshold * 1000:.0f} ms or more, worst {self.worst * 1000:.0f} ms"]
+        bounds = list(HISTOGRAM_BUCKETS_MS) + [None]
+        for low, high, count in zip(bounds, bounds[1:], self.histogram):
+            label = f"{low}-{high} ms" if high else f">= {low} ms"
+            lines.append(f"  {label:>14}: {count}")
+        if self.samples:
+            lines.append(f"Blocking calls (samples every {self.heartbeat * 1000:.0f} ms):")
+            for call, count in self.samples.most_common(TOP_FRAMES):
+                lines.append(f"  {count:>5}  {call}")
+        return "\n".join(lines)
+
+    def write_summary(self):
+        self._log(self.summary())